@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 import os
 
 from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
@@ -22,6 +22,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 django_asgi_app = get_asgi_application()
 
 from src.chat.routing import websocket_urlpatterns
+from src.chat.workers import EXTRACTION_CHANNEL, ExtractionConsumer
 from src.middlewares import TokenAuthMiddleware
 
 application = ProtocolTypeRouter(
@@ -35,5 +36,10 @@ application = ProtocolTypeRouter(
         ),
         # ),
         # ),
+        "channel": ChannelNameRouter(
+            {
+                EXTRACTION_CHANNEL: ExtractionConsumer.as_asgi(),
+            }
+        ),
     }
 )
@@ -133,6 +133,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": Path(os.getenv("DJANGO_SQLITE_DIR", ".")) / "db.sqlite3",
+        # Shared with the extraction worker, wait out its writes rather than failing with "database is locked"
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -185,6 +187,14 @@ MEDIA_ROOT = os.getenv("DJANGO_MEDIA_ROOT", "")
 # Examples: "http://example.com/media/", "http://media.example.com/"
 MEDIA_URL = os.getenv("DJANGO_MEDIA_URL", "media/")
 
+# Files uploaded in chunks over the chat socket are assembled here, keep it on
+# the filesystem of MEDIA_ROOT so finished uploads are moved, not copied.
+# None uses the system's temporary directory.
+FILE_UPLOAD_TEMP_DIR = os.getenv("DJANGO_FILE_UPLOAD_TEMP_DIR")
+CHAT_UPLOAD_MAX_SIZE = int(os.getenv("CHAT_UPLOAD_MAX_SIZE", 50 * 1024 * 1024))  # bytes
+CHAT_UPLOAD_CHUNK_SIZE = int(os.getenv("CHAT_UPLOAD_CHUNK_SIZE", 256 * 1024))  # bytes
+CHAT_UPLOAD_WINDOW = int(os.getenv("CHAT_UPLOAD_WINDOW", 4))  # chunks sent ahead of their ack
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
@@ -271,6 +281,11 @@ LOGGING = {
             "level": "ERROR",
             "propagate": False,
         },
+        "src": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
 
@@ -285,6 +300,15 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.BasicAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "src.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "src.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "COERCE_DECIMAL_TO_STRING": False,
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 100,
@@ -340,9 +364,12 @@ REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
 REDIS_HOST = os.getenv("REDIS_HOST", "127.0.0.1")
 REDIS_PORT = os.getenv("REDIS_PORT", 6379)
 REDIS_URL = (
-    "redis://" + (REDIS_USERNAME + ":" + REDIS_PASSWORD + "@")
-    if REDIS_USERNAME
-    else "" + REDIS_HOST + ":" + str(REDIS_PORT) + "/0"
+    "redis://"
+    + (REDIS_USERNAME + ":" + REDIS_PASSWORD + "@" if REDIS_USERNAME else "")
+    + REDIS_HOST
+    + ":"
+    + str(REDIS_PORT)
+    + "/0"
 )
 
 # Redis
@@ -364,11 +391,84 @@ CHANNEL_LAYERS = {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
             "hosts": [(REDIS_HOST, REDIS_PORT)],
+            # Room for a burst of uploads on the extraction worker's channel,
+            # jobs lost anyway are re-queued by `manage.py requeue_extractions`.
+            "channel_capacity": {
+                "chat-extraction": int(os.getenv("EXTRACTION_QUEUE_CAPACITY", 1000)),
+            },
         },
     },
 }
 
 
+# Dotted path of the LLM provider, "src.service.stub.StubProvider" answers
+# locally for load tests, after LLM_STUB_LATENCY seconds and then at
+# LLM_STUB_TOKENS_PER_SECOND.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "src.service.groq.GroqProvider")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3-8b-8192")
+LLM_STUB_LATENCY = float(os.getenv("LLM_STUB_LATENCY", 0.5))
+LLM_STUB_TOKENS_PER_SECOND = float(os.getenv("LLM_STUB_TOKENS_PER_SECOND", 200))
+LLM_STUB_REPLY_TOKENS = int(os.getenv("LLM_STUB_REPLY_TOKENS", 100))
+
+# Opt-in cache of LLM replies in Redis, keyed on the normalized prompt and the
+# conversation before it (uploaded documents included), so a reply is only
+# shared between conversations that are the same up to the question. A
+# LLM_RESPONSE_CACHE_SIMILARITY (cosine, e.g. 0.9) also serves replies to
+# near-duplicate prompts seen by the same process.
+LLM_RESPONSE_CACHE = is_true(os.getenv("LLM_RESPONSE_CACHE"))
+LLM_RESPONSE_CACHE_TTL = int(os.getenv("LLM_RESPONSE_CACHE_TTL", 60 * 60 * 24))  # 1 day
+LLM_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", 10000))
+LLM_RESPONSE_CACHE_SIMILARITY = float(os.getenv("LLM_RESPONSE_CACHE_SIMILARITY", 0))
+LLM_RESPONSE_CACHE_LOCAL_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_LOCAL_ENTRIES", 1000))
+
+# Limits on LLM calls across all processes, kept in Redis. At most
+# LLM_CONCURRENCY calls run at once and LLM_RATE_LIMIT_RPM start per minute
+# (0 for no rate limit); the rest wait in a fair queue of LLM_QUEUE_MAX calls,
+# LLM_USER_QUEUE_MAX per user, for up to LLM_QUEUE_TIMEOUT seconds.
+LLM_LIMITER = is_true(os.getenv("LLM_LIMITER", "true"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 16))
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", 0))
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", 10))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", 200))
+LLM_USER_QUEUE_MAX = int(os.getenv("LLM_USER_QUEUE_MAX", 3))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 60))  # seconds
+LLM_QUEUE_POLL_INTERVAL = float(os.getenv("LLM_QUEUE_POLL_INTERVAL", 0.1))  # seconds
+LLM_QUEUE_HEARTBEAT = float(os.getenv("LLM_QUEUE_HEARTBEAT", 10))  # seconds
+LLM_SLOT_LEASE = float(os.getenv("LLM_SLOT_LEASE", 300))  # seconds
+
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")  # None uses the public API
+
+# Connection pool of the process-wide LLM client, shared by all chat sockets.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))  # seconds
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))  # seconds
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))  # seconds
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+
+# LLM context window, in tokens. Requests are trimmed to fit
+# LLM_CONTEXT_TOKENS - LLM_MAX_TOKENS, and a single message (e.g. an OCR'd
+# document) never takes more than LLM_DOCUMENT_TOKENS of it.
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", 8192))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 1024))
+LLM_DOCUMENT_TOKENS = int(os.getenv("LLM_DOCUMENT_TOKENS", 3000))
+
+# Hard cap of the conversation history each chat socket keeps in memory.
+LLM_SESSION_MAX_TURNS = int(os.getenv("LLM_SESSION_MAX_TURNS", 100))
+LLM_SESSION_MAX_CHARS = int(os.getenv("LLM_SESSION_MAX_CHARS", 64 * 1024))
 
 OCR_API_BASE_URL = os.getenv("OCR_API_BASE_URL")
+
+# Connection pool and retries of the process-wide OCR client.
+OCR_MAX_CONNECTIONS = int(os.getenv("OCR_MAX_CONNECTIONS", 20))
+OCR_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OCR_MAX_KEEPALIVE_CONNECTIONS", 10))
+OCR_KEEPALIVE_EXPIRY = float(os.getenv("OCR_KEEPALIVE_EXPIRY", 60))  # seconds
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", 120))  # seconds, OCR of a long scan is slow
+OCR_CONNECT_TIMEOUT = float(os.getenv("OCR_CONNECT_TIMEOUT", 5))  # seconds
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", 2))
+OCR_RETRY_BACKOFF = float(os.getenv("OCR_RETRY_BACKOFF", 0.5))  # seconds, doubled on every retry
+
+# The OCR service mounts MEDIA_ROOT too (as its OCR_MEDIA_ROOT): files under it
+# are sent by path and hash rather than uploaded.
+OCR_SHARED_MEDIA = is_true(os.getenv("OCR_SHARED_MEDIA"))
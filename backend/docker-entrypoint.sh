@@ -13,6 +13,9 @@ fi
 wait-for-it -s "$REDIS_HOST:$REDIS_PORT" -t 60
 
 # You can comment out this line if you want to migrate manually
-su-exec "$USER" python manage.py migrate --noinput
+# Containers sharing the database of another one leave migrating to it
+if [ -z ${DJANGO_SKIP_MIGRATE+x} ]; then
+  su-exec "$USER" python manage.py migrate --noinput
+fi
 
 exec "$@"
@@ -0,0 +1,103 @@
+"""
+Small helpers shared by the ``bench_*`` management commands.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer
+
+
+def percentile(samples, pct):
+    """
+    Return the ``pct`` percentile of ``samples`` using the nearest-rank method.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """
+    Return count, p50, p99 and max of a list of millisecond samples.
+    """
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 50),
+        "p99": percentile(samples, 99),
+        "max": max(samples, default=0.0),
+    }
+
+
+def format_summary(label, samples):
+    stats = summarize(samples)
+    timings = f"p50={stats['p50']:.1f}ms p99={stats['p99']:.1f}ms max={stats['max']:.1f}ms"
+    return f"{label}: n={stats['count']} {timings}"
+
+
+@contextmanager
+def timer():
+    """
+    Measure the wall time of a block in milliseconds.
+
+    Usage::
+
+        with timer() as elapsed:
+            ...
+        print(elapsed())
+
+    """
+    start = time.perf_counter()
+    end = None
+
+    def elapsed():
+        return ((end or time.perf_counter()) - start) * 1000
+
+    try:
+        yield elapsed
+    finally:
+        end = time.perf_counter()
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Local HTTP server for benchmarking clients, counting the TCP connections it
+    accepts.
+
+    Usage::
+
+        with StubServer(Handler) as server:
+            httpx.post(server.url)
+        print(server.connections)
+
+    """
+
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs under a burst of new connections
+    request_queue_size = 1024
+
+    def __init__(self, handler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        super().__exit__(*args)
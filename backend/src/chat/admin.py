@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Chat, Message
+from .models import Blob, Chat, ExtractedText, Message
 
 
 class ChatAdmin(admin.ModelAdmin):
@@ -15,6 +15,22 @@ class MessageAdmin(admin.ModelAdmin):
     readonly_fields = ("uuid", "timestamp")
 
 
+class ExtractedTextAdmin(admin.ModelAdmin):
+    list_display = ("sha256", "timestamp")
+    search_fields = ("sha256",)
+    readonly_fields = ("sha256", "timestamp")
+
+
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ("sha256", "name", "size", "refcount", "updated")
+    search_fields = ("sha256",)
+    readonly_fields = ("sha256", "name", "size", "updated")
+
+
 admin.site.register(Chat, ChatAdmin)
 
 admin.site.register(Message, MessageAdmin)
+
+admin.site.register(ExtractedText, ExtractedTextAdmin)
+
+admin.site.register(Blob, BlobAdmin)
@@ -0,0 +1,112 @@
+"""
+Cache keys and counters of the chat app, stored in ``CACHES['default']``.
+"""
+
+import logging
+import uuid
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_TTL = 60 * 60 * 24 * 7  # 1 week
+EXTRACTION_HITS = "extraction:hits"
+EXTRACTION_MISSES = "extraction:misses"
+MESSAGES_PAGE_TTL = 60 * 10  # 10 minutes
+# Versions are kept for any chat UUID asked for, expiring bounds them, and only costs a page miss
+MESSAGES_VERSION_TTL = 60 * 60 * 24  # 1 day
+
+
+def extraction_key(sha256):
+    return f"extraction:{sha256}"
+
+
+def get_extraction(sha256):
+    """
+    Return the cached text extracted from the file hashed ``sha256``, or None on
+    a miss or if the cache is unavailable.
+    """
+    try:
+        return cache.get(extraction_key(sha256))
+    except Exception as e:
+        logger.warning("Error reading the cached extraction of %s: %s", sha256, e)
+        return None
+
+
+def set_extraction(sha256, text):
+    try:
+        cache.set(extraction_key(sha256), text, EXTRACTION_TTL)
+    except Exception as e:
+        logger.warning("Error caching the extraction of %s: %s", sha256, e)
+
+
+def incr_counter(key):
+    try:
+        # ``incr`` fails on a missing key, ``add`` is a no-op on an existing one.
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+    except Exception as e:
+        # Counters are statistics, losing a count beats failing what is counted
+        logger.warning("Error incrementing counter %s: %s", key, e)
+        return None
+
+
+def get_counters(*keys):
+    values = cache.get_many(keys)
+    return {key: values.get(key, 0) for key in keys}
+
+
+def messages_version_key(chat_uuid):
+    return f"messages:{chat_uuid}:version"
+
+
+def messages_page_key(chat_uuid, version, variant):
+    return f"messages:{chat_uuid}:{version}:{variant}"
+
+
+def get_messages_version(chat_uuid):
+    """
+    Return the version of a chat's messages, which changes whenever one of them
+    is saved.
+
+    None if the cache is unavailable, pages are then read from the database.
+
+    """
+    key = messages_version_key(chat_uuid)
+    try:
+        version = cache.get(key)
+        if version is None:
+            # Random rather than counted, an evicted or expired version must never be handed out again
+            cache.add(key, uuid.uuid4().hex, timeout=MESSAGES_VERSION_TTL)
+            version = cache.get(key)
+    except Exception as e:
+        logger.warning("Error reading the messages version of chat %s: %s", chat_uuid, e)
+        return None
+    return version
+
+
+def get_messages_page(key):
+    """
+    Return the cached message page under ``key``, or None on a miss or if the
+    cache is unavailable.
+    """
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning("Error reading cached messages page %s: %s", key, e)
+        return None
+
+
+def set_messages_page(key, data):
+    try:
+        cache.set(key, data, timeout=MESSAGES_PAGE_TTL)
+    except Exception as e:
+        logger.warning("Error caching messages page %s: %s", key, e)
+
+
+def bump_messages_version(chat_uuid):
+    try:
+        cache.set(messages_version_key(chat_uuid), uuid.uuid4().hex, timeout=MESSAGES_VERSION_TTL)
+    except Exception as e:
+        # The message is already committed, cached pages just stay stale until MESSAGES_PAGE_TTL
+        logger.warning("Error bumping the messages version of chat %s: %s", chat_uuid, e)
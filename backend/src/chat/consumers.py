@@ -1,23 +1,30 @@
+import asyncio
 import base64
-import json
 import uuid
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
 from django.core.files.base import ContentFile
-from django.db.models import Case, CharField, Value, When
-from src.service.groq import GroqService  # Import your GroqService
-from src.user.models import User
+from src import codec
+from src.service.limiter import QueueFull
+from src.service.llm import LLMService
+from src.user.cache import get_llm_user
 
 from .models import Chat, Message  # Import your models
-from .serializers import MessageSerializerNoRef
+from .uploads import INLINE_WRITE_MAX, ChunkedUpload, UploadError
+from .workers import EXTRACTION_CHANNEL, extraction_event, fail_extraction
 
 
-class ChatConsumer(WebsocketConsumer):
-    def connect(self):
+class ChatConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
+        new = self.room_name == "new"
 
-        if self.room_name == "new":
+        if new:
             # create a new room with a random name
             self.room_name = str(uuid.uuid4())
 
@@ -25,7 +32,7 @@ class ChatConsumer(WebsocketConsumer):
         try:
             uuid.UUID(self.room_name)
         except ValueError:
-            self.close(
+            await self.close(
                 code=400,
                 reason="Invalid room name",
             )
@@ -35,88 +42,309 @@ class ChatConsumer(WebsocketConsumer):
         user = self.scope["user"]
 
         if not user.is_authenticated:
-            self.close(
+            await self.close(
                 code=401,
                 reason="Unauthenticated",
             )
             return
 
-        self.llm = User.objects.get(username="llm")
-
-        # Create or get the chat room
-        chat, created = Chat.objects.get_or_create(name=self.room_name, user=user, uuid=self.room_name)
+        try:
+            messages = await self.load_chat(user, new)
+        except PermissionDenied:
+            # Checked before joining the group, which would relay the chat to this socket
+            await self.close(code=4003, reason="Forbidden")
+            return
 
         # Join room group
-        async_to_sync(self.channel_layer.group_add)(self.room_group_name, self.channel_name)
-
-        # Get all messages in the chat room.
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
-        messages = list(
-            Message.objects.annotate(
-                role=Case(
-                    When(user=self.llm, then=Value("assistant")),
-                    default=Value("user"),
-                    output_field=CharField(),
-                ),
-            )
-            .filter(chat=chat)
-            .order_by("-timestamp")
-            .values("role", "content")[:100]
-        )[::-1]
+        self.llm_service = LLMService(messages=messages, user=user.pk, on_queue=self.send_queue_position)
+        self.upload = None
+        # Chunks are written in order under the lock, in tasks so frames sent ahead of their ack are seen
+        self.upload_lock = asyncio.Lock()
+        self.upload_writes = set()
 
-        self.groq_service = GroqService(messages=messages)
+        await self.accept()
 
-        self.accept()
-
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         # Leave room group
-        async_to_sync(self.channel_layer.group_discard)(self.room_group_name, self.channel_name)
+        if hasattr(self, "room_group_name"):
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if getattr(self, "upload", None) is not None:
+            await self.discard_upload()
 
     # Receive message from WebSocket
-    def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            await self.receive_chunk(bytes_data)
+            return
+
+        text_data_json = codec.loads(text_data)
+        if text_data_json.get("type") == "upload.start":
+            await self.start_upload(text_data_json)
+            return
+
         message = text_data_json["message"]
         user = self.scope["user"]
         file_data = text_data_json.get("file")
 
+        upload = None
+        if "upload" in text_data_json:
+            async with self.upload_lock:
+                # Once its chunks are written
+                upload = self.upload
+            if upload is None or upload.id != text_data_json["upload"] or not upload.complete:
+                await self.send_upload_error("No finished upload with this id.")
+                return
+            self.upload = None
+
+        stream = bool(text_data_json.get("stream"))
+
         # Save message to the database
-        chat = Chat.objects.get(name=self.room_name)
-        message_instance = Message.objects.create(
-            chat=chat,
-            user=user,
-            content=message,
+        message_instance = await self.save_user_message(user, message, file_data, upload)
+
+        if message_instance.file:
+            # The file text is extracted by the worker, the reply follows in ``extraction_done``.
+            try:
+                await self.channel_layer.send(
+                    EXTRACTION_CHANNEL,
+                    extraction_event(message_instance, self.channel_name, stream=stream),
+                )
+            except ChannelFull:
+                await database_sync_to_async(fail_extraction)(message_instance)
+                # Answered without the file text, as when the extraction itself fails
+                await self.extraction_done({"message": str(message_instance.uuid), "stream": stream})
+            return
+
+        await self.reply(message_instance.complete_message, stream)
+
+    async def reply(self, message, stream=False):
+        """
+        Ask the LLM for a reply to ``message``, save it and broadcast it to the
+        room.
+        """
+        try:
+            if stream:
+                response = await self.stream_reply(message)
+            else:
+                response = await self.llm_service.complete_chat_message(message)
+        except QueueFull as e:
+            await self.send(text_data=codec.dumps_text({"type": "chat.busy", "detail": str(e)}))
+            return
+
+        message = await self.save_llm_message(response)
+
+        # Send message to room group
+        await self.broadcast(message)
+
+    async def stream_reply(self, message):
+        """
+        Forward completion deltas to this socket as they arrive and return the
+        assembled reply.
+        """
+        parts = []
+        async for delta in self.llm_service.stream_chat_message(message):
+            parts.append(delta)
+            await self.send(text_data=codec.dumps_text({"type": "chat.message.delta", "delta": delta}))
+        return "".join(parts)
+
+    async def start_upload(self, data):
+        """
+        Start receiving a file in binary frames, see ``src.chat.uploads``.
+        """
+        if self.upload is not None:
+            # One upload at a time, a new one replaces an unfinished one
+            await self.discard_upload()
+        try:
+            self.upload = ChunkedUpload(
+                data.get("name"), data.get("size"), validators=Message._meta.get_field("file").validators
+            )
+        except UploadError as e:
+            await self.send_upload_error(str(e))
+            return
+        await self.send(
+            text_data=codec.dumps_text(
+                {
+                    "type": "upload.ready",
+                    "upload": self.upload.id,
+                    "chunk_size": settings.CHAT_UPLOAD_CHUNK_SIZE,
+                    "window": settings.CHAT_UPLOAD_WINDOW,
+                }
+            )
         )
 
-        if file_data:
-            # If file data exists, handle file upload
-            file_content_base64 = file_data.get("data")
-            file_content = base64.b64decode(file_content_base64)
-            content_file = ContentFile(file_content, name=file_data["name"])
+    async def receive_chunk(self, frame):
+        upload = self.upload
+        if upload is None:
+            await self.send_upload_error("No upload in progress.")
+            return
+        if upload.unacked >= settings.CHAT_UPLOAD_WINDOW:
+            # The window is all that bounds the chunks a socket holds in memory, past it the client is not waiting
+            await self.discard_upload()
+            await self.close(code=4008, reason="Upload window exceeded")
+            return
+        upload.unacked += 1
+        task = asyncio.create_task(self.write_chunk(upload, frame))
+        self.upload_writes.add(task)
+        task.add_done_callback(self.upload_writes.discard)
 
-            message_instance.file.save(file_data["name"], content_file, save=True)
+    async def write_chunk(self, upload, frame):
+        async with self.upload_lock:
+            if upload is not self.upload:
+                # Discarded, or replaced by a new upload
+                return
+            try:
+                if len(frame) > INLINE_WRITE_MAX:
+                    # Off the event loop, the write may block on disk and the hash is CPU bound
+                    offset = await sync_to_async(upload.write, thread_sensitive=False)(frame)
+                else:
+                    offset = upload.write(frame)
+            except UploadError as e:
+                await self.send_upload_error(str(e), e.offset)
+                return
+            finally:
+                upload.unacked -= 1
+            await self.send(text_data=codec.dumps_text({"type": "upload.ack", "upload": upload.id, "offset": offset}))
 
-        response = self.groq_service.complete_chat_message(message_instance.complete_message)
+    async def discard_upload(self):
+        """
+        Drop the current upload once the chunk being written, if any, is.
+        """
+        upload, self.upload = self.upload, None
+        async with self.upload_lock:
+            upload.discard()
 
-        message_instance = Message.objects.create(
-            chat=chat,
-            user=self.llm,
-            content=response,
+    async def send_upload_error(self, detail, offset=None):
+        await self.send(text_data=codec.dumps_text({"type": "upload.error", "detail": detail, "offset": offset}))
+
+    async def send_queue_position(self, position):
+        await self.send(text_data=codec.dumps_text({"type": "chat.queue", "position": position}))
+
+    # Receive extraction result from the worker
+    async def extraction_done(self, event):
+        message_instance = await self.get_message(event["message"])
+        if message_instance is None:
+            # Deleted while its file was extracted
+            return
+
+        await self.broadcast(
+            {
+                "type": "chat.message.extracted",
+                "uuid": message_instance.uuid,
+                "extraction_status": message_instance.extraction_status,
+            }
         )
 
-        serialized_message = MessageSerializerNoRef(message_instance)
+        await self.reply(message_instance.complete_message, event.get("stream", False))
 
-        # Send message to room group
-        async_to_sync(self.channel_layer.group_send)(
+    async def broadcast(self, message):
+        """
+        Send ``message`` to every socket of the room, encoded once here rather
+        than by each receiver.
+        """
+        await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                "type": "chat.message",
-                "message": serialized_message.data,
-            },
+            {"type": "chat.message", "text": codec.dumps_text(message)},
         )
 
     # Receive message from room group
-    def chat_message(self, event):
-        message = event["message"]
+    async def chat_message(self, event):
+        # Send the already encoded message to WebSocket
+        await self.send(text_data=event["text"])
+
+    @database_sync_to_async
+    def load_chat(self, user, new=False):
+        """
+        Return the last 100 messages of the chat room as LLM context.
+
+        The room is created if it does not exist, except a ``new`` one,
+        created along with its first message, see ``get_chat``.
+
+        Raises:
+            PermissionDenied: If the room is another user's chat.
+
+        """
+        self.chat = None
+        if new:
+            return []
+
+        self.chat, created = Chat.objects.get_or_create(
+            uuid=self.room_name, defaults={"name": self.room_name, "user": user}
+        )
+        if self.chat.user_id != user.pk:
+            raise PermissionDenied
+        if created:
+            return []
 
-        # Send message to WebSocket
-        self.send(text_data=json.dumps(message))
+        messages = (
+            Message.objects.filter(chat=self.chat)
+            .order_by("-timestamp")
+            .values("role", "content", "extracted_text")[:100]
+        )
+        return [{"role": m["role"], "content": m["extracted_text"] or m["content"]} for m in reversed(messages)]
+
+    def get_chat(self):
+        """
+        Return the chat of the room, created by the first message of a new one.
+        """
+        if self.chat is None:
+            self.chat, _ = Chat.objects.get_or_create(
+                uuid=self.room_name, defaults={"name": self.room_name, "user": self.scope["user"]}
+            )
+        return self.chat
+
+    async def save_user_message(self, user, content, file_data=None, upload=None):
+        message_instance = Message(user=user, content=content)
+        if upload is not None or file_data:
+            # Moving (or copying) and hashing up to CHAT_UPLOAD_MAX_SIZE bytes would hold up every socket's queries
+            # on the shared database thread
+            await database_sync_to_async(self.store_file, thread_sensitive=False)(message_instance, file_data, upload)
+        return await self.save_message(message_instance)
+
+    def store_file(self, message_instance, file_data=None, upload=None):
+        """
+        Save the file of a new message into storage, without saving the message.
+        """
+        if upload is not None:
+            # Moved into storage, and already hashed for the extraction cache
+            try:
+                with upload.open() as file:
+                    message_instance.file.save(upload.name, file, save=False)
+            finally:
+                upload.discard()
+        else:
+            # Base64 inside the JSON frame, kept for older clients
+            file_content_base64 = file_data.get("data")
+            file_content = base64.b64decode(file_content_base64)
+            content_file = ContentFile(file_content, name=file_data["name"])
+
+            message_instance.file.save(file_data["name"], content_file, save=False)
+        message_instance.extraction_status = Message.ExtractionStatus.PENDING
+
+    @database_sync_to_async
+    def save_message(self, message_instance):
+        message_instance.chat = self.get_chat()
+        message_instance.save()
+        return message_instance
+
+    @database_sync_to_async
+    def get_message(self, message_uuid):
+        return Message.objects.filter(uuid=message_uuid).first()
+
+    @database_sync_to_async
+    def save_llm_message(self, content):
+        message_instance = Message.objects.create(
+            chat=self.get_chat(),
+            user=get_llm_user(),
+            role=Message.Role.ASSISTANT,
+            content=content,
+        )
+        # The fields of MessageSerializerNoRef, left as model values for the codec to encode
+        return {
+            "uuid": message_instance.uuid,
+            "role": message_instance.role,
+            "content": message_instance.content,
+            "timestamp": message_instance.timestamp,
+            "file": None,
+            "extraction_status": message_instance.extraction_status,
+        }
@@ -0,0 +1,116 @@
+"""
+Text extraction for uploaded PDFs.
+
+Most tax PDFs (IRS forms, payroll exports) are born-digital and already carry a
+text layer, so each page is read with pypdf first and only pages without a
+usable text layer are sent to the OCR service.
+
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+
+from pypdf import PdfReader
+from src.service.ocr_tesseract import ocr_pdf_pages
+
+logger = logging.getLogger(__name__)
+
+# A page needs at least this many visible characters to skip OCR.
+MIN_TEXT_CHARS = 20
+# Scanned pages often carry a short text stamp over the image, e.g. a page number.
+MIN_TEXT_CHARS_WITH_IMAGES = 200
+# Broken font mappings extract as symbol soup, require mostly letters and digits.
+MIN_ALNUM_RATIO = 0.5
+
+
+@dataclass
+class PageDecision:
+    page: int
+    method: str  # "text" or "ocr"
+    chars: int
+    seconds: float
+
+
+def has_images(page):
+    resources = page.get("/Resources")
+    if resources is None:
+        return False
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return False
+    return any(xobject.get_object().get("/Subtype") == "/Image" for xobject in xobjects.get_object().values())
+
+
+def has_text_layer(page, text):
+    """
+    Return whether ``text`` extracted from ``page`` is good enough to skip OCR.
+    """
+    visible = "".join(text.split())
+    if len(visible) < MIN_TEXT_CHARS:
+        return False
+    if sum(c.isalnum() for c in visible) / len(visible) < MIN_ALNUM_RATIO:
+        return False
+    return len(visible) >= MIN_TEXT_CHARS_WITH_IMAGES or not has_images(page)
+
+
+def extract_pdf_text(filepath, sha256=None):
+    """
+    Extract the text of a PDF, page by page.
+
+    Pages with a usable text layer are read with pypdf, the rest are OCR'd
+    in a single request to the OCR service. ``sha256`` is the hash the file
+    is stored under, if known, handed to the OCR service with its path.
+
+    Returns:
+        tuple[str, list[PageDecision]]: The document text and the per-page
+            decisions with their timings.
+
+    """
+    reader = PdfReader(filepath)
+    texts, decisions, ocr_pages = {}, {}, []
+    for number, page in enumerate(reader.pages, start=1):
+        start = time.perf_counter()
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            logger.warning("Error extracting text layer of page %s: %s", number, e)
+            text = ""
+        if has_text_layer(page, text):
+            texts[number] = text
+            decisions[number] = PageDecision(number, "text", len(text), time.perf_counter() - start)
+        else:
+            ocr_pages.append(number)
+
+    if ocr_pages:
+        start = time.perf_counter()
+        try:
+            ocr_texts = ocr_pdf_pages(filepath, ocr_pages, sha256=sha256) or {}
+        except Exception as e:
+            logger.warning("Error running OCR on pages %s: %s", ocr_pages, e)
+            ocr_texts = {}
+        # The OCR service handles the pages in one request, attribute its time evenly.
+        seconds = (time.perf_counter() - start) / len(ocr_pages)
+        for number in ocr_pages:
+            texts[number] = ocr_texts.get(number, "")
+            decisions[number] = PageDecision(number, "ocr", len(texts[number]), seconds)
+
+    report = [decisions[number] for number in sorted(decisions)]
+    for decision in report:
+        logger.info(
+            "%s page %s: %s, %s chars in %.3fs",
+            filepath,
+            decision.page,
+            decision.method,
+            decision.chars,
+            decision.seconds,
+        )
+    logger.info(
+        "%s: %s pages, %s from the text layer, %s OCR'd",
+        filepath,
+        len(report),
+        len(report) - len(ocr_pages),
+        len(ocr_pages),
+    )
+
+    return "\n".join(texts[number] for number in sorted(texts)), report
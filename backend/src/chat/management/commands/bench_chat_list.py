@@ -0,0 +1,87 @@
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from src.chat.models import Chat, Message
+from src.chat.views import ChatListCreateAPIView
+from src.user.models import User
+
+BENCH_USER = "bench-chats"
+
+
+class Command(BaseCommand):
+    help = "Time the chat list of a power user against the former JOIN + DISTINCT query, and count its queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chats", type=int, default=200, help="Chats of the power user.")
+        parser.add_argument("--messages", type=int, default=1000, help="Messages per chat.")
+        parser.add_argument("--empty", type=int, default=50, help="Extra chats without messages, never listed.")
+        parser.add_argument("--repeat", type=int, default=20, help="Fetches timed, the median is reported.")
+
+    @override_settings(ALLOWED_HOSTS=["testserver"])
+    def handle(self, *args, **options):
+        user = self.seed(options["chats"], options["messages"], options["empty"])
+
+        factory = APIRequestFactory()
+        view = ChatListCreateAPIView.as_view()
+
+        def fetch():
+            request = factory.get("/api/chat/")
+            force_authenticate(request, user=user)
+            response = view(request)
+            if response.status_code != 200:
+                raise CommandError(f"Chat list failed: {response.status_code} {response.data}")
+            return response
+
+        with CaptureQueriesContext(connection) as queries:
+            response = fetch()
+        listed = response.data["results"]
+
+        timings = []
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            fetch()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        def former_list():
+            # The query this endpoint used to run, paginated the same way
+            chats = Chat.objects.filter(user=user, messages__isnull=False).distinct()
+            chats.count()
+            return list(chats[:100])
+
+        former_timings = []
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            former_list()
+            former_timings.append((time.perf_counter() - start) * 1000)
+
+        elapsed, former = statistics.median(timings), statistics.median(former_timings)
+        self.stdout.write(f"{options['chats']} chats x {options['messages']} messages, {len(listed)} listed")
+        self.stdout.write(f"queries: {len(queries)}")
+        for query in queries:
+            self.stdout.write(f"  {query['sql']}")
+        self.stdout.write(f"list: {elapsed:.1f}ms, former JOIN + DISTINCT query alone: {former:.1f}ms")
+
+    def seed(self, chats, messages, empty):
+        user, _ = User.objects.get_or_create(username=BENCH_USER, defaults={"email": "bench-chats@example.com"})
+        existing = user.chats.count()
+        for i in range(existing, chats + empty):
+            chat = Chat.objects.create(name=f"chat {i}", user=user, uuid=uuid.uuid4())
+            if i >= chats:
+                continue
+            Message.objects.bulk_create(
+                [Message(chat=chat, user=user, content=f"message {j}") for j in range(messages)],
+                batch_size=10_000,
+            )
+            # bulk_create skips Message.save, which keeps these up to date
+            chat.message_count = messages
+            last = chat.messages.order_by("-timestamp").first()
+            chat.last_message_at, chat.last_message_preview = last.timestamp, last.preview
+            chat.save(update_fields=["message_count", "last_message_at", "last_message_preview"])
+            self.stdout.write(f"seeded {i + 1}/{chats} chats", ending="\r")
+        return user
@@ -0,0 +1,126 @@
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from src.chat.models import Message
+from src.chat.routing import websocket_urlpatterns
+from src.chat.uploads import HEADER
+from src.middlewares import TokenAuthMiddleware
+from src.user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload a PDF over the chat socket in binary chunks and as base64 in the JSON frame,"
+        " reporting throughput and peak memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, default=32, help="Size of the uploaded file.")
+        parser.add_argument("--timeout", type=float, default=60, help="Per-frame timeout in seconds.")
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username="bench", defaults={"email": "bench@example.com"})
+        token = str(AccessToken.for_user(user))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "upload.pdf")
+            with open(path, "wb") as f:
+                f.write(os.urandom(options["size_mb"] * 1024 * 1024))
+
+            in_memory_layer = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+            locmem_cache = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+            with override_settings(
+                CHANNEL_LAYERS=in_memory_layer,
+                CACHES=locmem_cache,
+                LLM_LIMITER=False,
+                FILE_UPLOAD_TEMP_DIR=directory,
+            ):
+                for mode in ("chunked", "base64"):
+                    start = time.perf_counter()
+                    message = self.upload(mode, token, path, options)
+                    elapsed = time.perf_counter() - start
+
+                    # Separate run, tracing allocations slows them down
+                    tracemalloc.start()
+                    try:
+                        self.upload(mode, token, path, options)
+                        peak = tracemalloc.get_traced_memory()[1]
+                    finally:
+                        tracemalloc.stop()
+
+                    self.stdout.write(
+                        f"{mode:<8} {options['size_mb']}MB in {elapsed:.2f}s "
+                        f"({options['size_mb'] / elapsed:.0f}MB/s), peak memory {peak / 2**20:.1f}MB, "
+                        f"sha256 {message.file_sha256[:12] or '-'}"
+                    )
+
+    def upload(self, mode, token, path, options):
+        # An empty storage every time, the same file would be deduplicated otherwise
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp(dir=os.path.dirname(path))):
+            message = async_to_sync(self.run)(mode, token, path, options)
+            if message.file.size != os.path.getsize(path):
+                raise CommandError(f"{mode}: stored {message.file.size} bytes.")
+        message.chat.delete()
+        return message
+
+    async def run(self, mode, token, path, options):
+        application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+        room = uuid.uuid4()
+        communicator = WebsocketCommunicator(application, f"/ws/chat/{room}/?token={token}")
+        connected, _ = await communicator.connect(timeout=options["timeout"])
+        if not connected:
+            raise CommandError("Could not connect.")
+
+        async def receive():
+            frame = json.loads(await communicator.receive_from(timeout=options["timeout"]))
+            if frame["type"] == "upload.error":
+                raise CommandError(frame["detail"])
+            return frame
+
+        if mode == "chunked":
+            await communicator.send_to(
+                text_data=json.dumps({"type": "upload.start", "name": "upload.pdf", "size": os.path.getsize(path)})
+            )
+            ready = await receive()
+            with open(path, "rb") as f:
+                offset, in_flight = 0, 0
+                while chunk := f.read(ready["chunk_size"]):
+                    await communicator.send_to(bytes_data=HEADER.pack(offset) + chunk)
+                    offset, in_flight = offset + len(chunk), in_flight + 1
+                    if in_flight == ready["window"]:
+                        await receive()
+                        in_flight -= 1
+                for _ in range(in_flight):
+                    await receive()
+            await communicator.send_to(text_data=json.dumps({"message": "", "upload": ready["upload"]}))
+        else:
+            # What the web client used to send
+            with open(path, "rb") as f:
+                data = base64.b64encode(f.read()).decode()
+            await communicator.send_to(
+                text_data=json.dumps({"message": "", "file": {"name": "upload.pdf", "data": data}})
+            )
+            del data
+
+        # The message is saved before the extraction is queued, no frame comes back until it is done
+        while (message := await self.get_message(room)) is None:
+            await asyncio.sleep(0.01)
+        await communicator.disconnect()
+        return message
+
+    @database_sync_to_async
+    def get_message(self, room):
+        return Message.objects.select_related("chat").filter(chat__uuid=room).exclude(file="").first()
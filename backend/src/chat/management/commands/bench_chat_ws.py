@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from src.bench import format_summary
+from src.chat.routing import websocket_urlpatterns
+from src.middlewares import TokenAuthMiddleware
+from src.service.stub import StubProvider
+from src.user.cache import LLM_USERNAME
+from src.user.models import User
+
+
+class RemoteSocket:
+    """
+    A chat socket of a running server, with the methods of
+    ``WebsocketCommunicator`` the benchmark uses.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.connection = None
+
+    async def connect(self, timeout):
+        import websockets
+
+        try:
+            self.connection = await websockets.connect(self.url, open_timeout=timeout)
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+            return False, None
+        return True, None
+
+    async def send_to(self, text_data):
+        await self.connection.send(text_data)
+
+    async def receive_from(self, timeout):
+        return await asyncio.wait_for(self.connection.recv(), timeout)
+
+    async def disconnect(self):
+        if self.connection is not None:
+            await self.connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Open N concurrent chat sockets against the stub LLM provider and report reply latency,"
+        " and the part of it spent outside the modelled LLM time. In process (in-memory channel layer,"
+        " local memory cache, no LLM limiter) unless --url points it at a running server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=200, help="Number of concurrent sockets.")
+        parser.add_argument("--messages", type=int, default=3, help="Messages sent per socket.")
+        parser.add_argument("--latency", type=float, default=500, help="Stub LLM time to first token in milliseconds.")
+        parser.add_argument("--tokens-per-second", type=float, default=200, help="Stub LLM generation speed.")
+        parser.add_argument("--reply-tokens", type=int, default=100, help="Stub LLM reply length in tokens.")
+        parser.add_argument("--timeout", type=float, default=120, help="Per-reply timeout in seconds.")
+        parser.add_argument(
+            "--stream", action="store_true", help="Request streamed replies and report time to first token."
+        )
+        parser.add_argument(
+            "--url",
+            help=(
+                "Base WebSocket URL of a running server (e.g. ws://localhost:8000) sharing this database and"
+                " SECRET_KEY, with LLM_PROVIDER=src.service.stub.StubProvider and the same stub settings."
+                " Needs requirements-dev.txt."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username="bench", defaults={"email": "bench@example.com"})
+        User.objects.get_or_create(username=LLM_USERNAME, defaults={"email": "llm@email.com"})
+        token = str(AccessToken.for_user(user))
+
+        stub = {
+            "LLM_PROVIDER": "src.service.stub.StubProvider",
+            "LLM_STUB_LATENCY": options["latency"] / 1000,
+            "LLM_STUB_TOKENS_PER_SECOND": options["tokens_per_second"],
+            "LLM_STUB_REPLY_TOKENS": options["reply_tokens"],
+        }
+        if options["url"]:
+            # Daphne, the channel layer, the cache and the limiter as the server is configured
+            with override_settings(**stub):
+                modelled = StubProvider().expected_seconds(settings.LLM_MAX_TOKENS) * 1000
+            url = f"{options['url'].rstrip('/')}/ws/chat/new/?token={token}"
+            latencies, first_tokens, elapsed = async_to_sync(self.run)(
+                [RemoteSocket(url) for _ in range(options["sockets"])], options
+            )
+            self.stdout.write(f"against {options['url']}")
+        else:
+            in_memory_layer = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+            locmem_cache = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+            with override_settings(CHANNEL_LAYERS=in_memory_layer, CACHES=locmem_cache, LLM_LIMITER=False, **stub):
+                modelled = StubProvider().expected_seconds(settings.LLM_MAX_TOKENS) * 1000
+                application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+                communicators = [
+                    WebsocketCommunicator(application, f"/ws/chat/new/?token={token}")
+                    for _ in range(options["sockets"])
+                ]
+                latencies, first_tokens, elapsed = async_to_sync(self.run)(communicators, options)
+            self.stdout.write("in process: in-memory channel layer, local memory cache, no LLM limiter")
+
+        total = options["sockets"] * options["messages"]
+        if first_tokens:
+            self.stdout.write(format_summary("first token", first_tokens))
+            self.stdout.write(format_summary("first token overhead", [t - options["latency"] for t in first_tokens]))
+        self.stdout.write(format_summary("reply latency", latencies))
+        self.stdout.write(format_summary("reply overhead", [t - modelled for t in latencies]))
+        self.stdout.write(
+            f"sockets={options['sockets']} replies={len(latencies)}/{total} "
+            f"wall={elapsed:.2f}s throughput={len(latencies) / elapsed:.1f} replies/s"
+        )
+
+    async def run(self, communicators, options):
+        connected = await asyncio.gather(*(c.connect(timeout=options["timeout"]) for c in communicators))
+        self.stdout.write(f"connected {sum(ok for ok, _ in connected)}/{len(communicators)} sockets")
+
+        latencies, first_tokens = [], []
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                self.converse(communicator, options, latencies, first_tokens)
+                for communicator, (ok, _) in zip(communicators, connected)
+                if ok
+            )
+        )
+        elapsed = time.perf_counter() - start
+
+        await asyncio.gather(*(c.disconnect() for c in communicators))
+        return latencies, first_tokens, elapsed
+
+    async def converse(self, communicator, options, latencies, first_tokens):
+        for i in range(options["messages"]):
+            sent = time.perf_counter()
+            first_token = None
+            await communicator.send_to(text_data=json.dumps({"message": f"question {i}", "stream": options["stream"]}))
+            try:
+                while True:
+                    frame = json.loads(await communicator.receive_from(timeout=options["timeout"]))
+                    if frame.get("type") == "chat.queue":
+                        continue
+                    if frame.get("type") != "chat.message.delta":
+                        break
+                    if first_token is None:
+                        first_token = (time.perf_counter() - sent) * 1000
+            except asyncio.TimeoutError:
+                return
+            latencies.append((time.perf_counter() - sent) * 1000)
+            if first_token is not None:
+                first_tokens.append(first_token)
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+
+import httpx
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from groq import AsyncGroq
+from src.bench import StubServer, format_summary
+from src.service.groq import get_async_client, http_limits, http_timeout
+
+COMPLETION = {
+    "id": "stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "llama3-8b-8192",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "stub reply"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+}
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request like the chat completions endpoint, keeping
+    connections alive.
+    """
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        body = json.dumps(COMPLETION).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Compare a client per chat socket against the shared LLM client on a local stub server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=200, help="Number of concurrent chat sockets.")
+        parser.add_argument("--messages", type=int, default=3, help="Messages sent per socket.")
+        parser.add_argument("--latency", type=float, default=50, help="Stub LLM latency in milliseconds.")
+        parser.add_argument("--max-connections", type=int, default=100, help="Pool size of the shared client.")
+
+    def handle(self, *args, **options):
+        CompletionHandler.latency = options["latency"] / 1000
+
+        for mode in ("per-socket", "shared"):
+            with (
+                StubServer(CompletionHandler) as server,
+                override_settings(
+                    GROQ_API_KEY="bench",
+                    GROQ_BASE_URL=server.url,
+                    LLM_MAX_CONNECTIONS=options["max_connections"],
+                    LLM_MAX_KEEPALIVE_CONNECTIONS=options["max_connections"],
+                ),
+            ):
+                latencies, elapsed = asyncio.run(self.run(mode, options))
+                connections = server.connections
+
+            total = options["sockets"] * options["messages"]
+            self.stdout.write(format_summary(f"{mode:<10} request latency", latencies))
+            self.stdout.write(
+                f"{mode:<10} requests={len(latencies)}/{total} connections={connections} "
+                f"wall={elapsed:.2f}s throughput={len(latencies) / elapsed:.1f} req/s"
+            )
+
+    async def run(self, mode, options):
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(self.converse(mode, options, latencies) for _ in range(options["sockets"])))
+        elapsed = time.perf_counter() - start
+        if mode == "shared":
+            await get_async_client().close()
+        return latencies, elapsed
+
+    async def converse(self, mode, options, latencies):
+        if mode == "shared":
+            client = get_async_client()
+        else:
+            # What every chat socket used to do on connect
+            client = AsyncGroq(
+                api_key="bench",
+                base_url=get_async_client().base_url,
+                http_client=httpx.AsyncClient(limits=http_limits(), timeout=http_timeout()),
+            )
+
+        for i in range(options["messages"]):
+            sent = time.perf_counter()
+            await client.chat.completions.create(
+                messages=[{"role": "user", "content": f"question {i}"}], model="llama3-8b-8192"
+            )
+            latencies.append((time.perf_counter() - sent) * 1000)
+
+        if mode != "shared":
+            await client.close()
@@ -0,0 +1,96 @@
+import statistics
+import time
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.test import override_settings
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIRequestFactory, force_authenticate
+from src.chat.models import Chat, Message
+from src.chat.pagination import MessageCursorPagination
+from src.chat.views import MessageListCreateAPIView
+from src.user.models import User
+
+BENCH_CHAT = "bench-pages"
+
+
+class Command(BaseCommand):
+    help = "Fetch message list pages at increasing depths of a large chat, with limit/offset and cursor pagination."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000, help="Messages in the benchmark chat.")
+        parser.add_argument("--page-size", type=int, default=100, help="Messages per page.")
+        parser.add_argument("--repeat", type=int, default=5, help="Fetches per depth, the median is reported.")
+        parser.add_argument("--batch-size", type=int, default=10_000, help="Rows per INSERT when seeding.")
+
+    # Without a cache every fetch reads the database, the page cache would serve all but the first of each depth
+    @override_settings(
+        ALLOWED_HOSTS=["testserver"],
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+    )
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username="bench", defaults={"email": "bench@example.com"})
+        chat = self.seed(user, options["messages"], options["batch_size"])
+        total = chat.messages.count()
+
+        factory = APIRequestFactory()
+        view = MessageListCreateAPIView.as_view()
+        url = f"/api/chat/{chat.uuid}/messages/"
+
+        def fetch(params):
+            timings = []
+            for _ in range(options["repeat"]):
+                request = factory.get(url, params)
+                force_authenticate(request, user=user)
+                start = time.perf_counter()
+                response = view(request, chat_uuid=chat.uuid)
+                timings.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, response.data
+                assert len(response.data["results"]) == options["page_size"], len(response.data["results"])
+            return statistics.median(timings)
+
+        paginator = MessageCursorPagination()
+        paginator.base_url = url
+        messages = chat.messages.order_by("-timestamp")
+
+        self.stdout.write(f"{total} messages, page size {options['page_size']}")
+        self.stdout.write(f"{'depth':>9} {'offset':>10} {'cursor':>10}")
+        last_page = total - options["page_size"]
+        depths = [depth for depth in (0, 10**3, 10**4, 10**5, 5 * 10**5) if depth < last_page] + [last_page]
+        for depth in depths:
+            offset_ms = fetch({"limit": options["page_size"], "offset": depth})
+
+            # The cursor a client paging from the top would hold at this depth
+            params = {"limit": options["page_size"]}
+            if depth:
+                position = messages.values_list("timestamp", flat=True)[depth - 1]
+                next_url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+                params["cursor"] = parse_qs(urlparse(next_url).query)["cursor"][0]
+            else:
+                params["pagination"] = "cursor"
+            cursor_ms = fetch(params)
+
+            self.stdout.write(f"{depth:>9} {offset_ms:>8.1f}ms {cursor_ms:>8.1f}ms")
+
+    def seed(self, user, count, batch_size):
+        chat = Chat.objects.filter(name=BENCH_CHAT, user=user).first()
+        if chat is None:
+            chat = Chat.objects.create(name=BENCH_CHAT, user=user, uuid=uuid.uuid4())
+
+        missing = count - chat.messages.count()
+        while missing > 0:
+            size = min(batch_size, missing)
+            Message.objects.bulk_create(
+                [Message(chat=chat, user=user, content=f"message {i}") for i in range(size)],
+                batch_size=batch_size,
+            )
+            missing -= size
+            self.stdout.write(f"seeded {count - missing}/{count} messages", ending="\r")
+
+        # bulk_create skips Message.save, which keeps these up to date
+        chat.message_count = chat.messages.count()
+        chat.last_message_at = chat.messages.aggregate(last=Max("timestamp"))["last"]
+        chat.save(update_fields=["message_count", "last_message_at"])
+        return chat
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework import renderers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from src.chat.models import Chat
+from src.chat.serializers import MessageSerializer, MessageValuesSerializer
+from src.renderers import JSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/sec of MessageSerializer + DRF's JSON renderer against MessageValuesSerializer + src.renderers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10_000, help="Messages serialized per run.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per path, the best is reported.")
+
+    @override_settings(ALLOWED_HOSTS=["testserver"])
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        chat = Chat.objects.filter(message_count__gte=rows).order_by("-message_count").first()
+        if chat is None:
+            raise CommandError(f"Needs a chat with {rows} messages, seed one with bench_message_pages first.")
+
+        context = {"request": Request(APIRequestFactory().get("/api/chat/"))}
+        messages = chat.messages.order_by("-timestamp")
+
+        def serialize_models():
+            return MessageSerializer(messages.select_related("user")[:rows], many=True, context=context).data
+
+        def serialize_values():
+            queryset = messages.values(*MessageValuesSerializer.fields)[:rows]
+            return MessageValuesSerializer(queryset, many=True, context=context).data
+
+        paths = (
+            ("MessageSerializer", serialize_models, renderers.JSONRenderer()),
+            ("MessageValuesSerializer", serialize_values, JSONRenderer()),
+        )
+
+        self.stdout.write(f"{rows} rows, best of {options['repeat']}, query included")
+        self.stdout.write(f"{'':<26} {'serialize':>16} {'serialize+render':>18} {'bytes':>10}")
+        baseline = None
+        for label, serialize, renderer in paths:
+            serialized, total, size = float("inf"), float("inf"), 0
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                data = serialize()
+                built = time.perf_counter()
+                body = renderer.render(data)
+                done = time.perf_counter()
+                serialized, total, size = min(serialized, built - start), min(total, done - start), len(body)
+
+            baseline = baseline or total
+            self.stdout.write(
+                f"{label:<26} {rows / serialized:>9.0f} rows/s {rows / total:>11.0f} rows/s {size:>10}"
+                f"  {baseline / total:.1f}x"
+            )
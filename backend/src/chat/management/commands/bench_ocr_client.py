@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import uvicorn
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from fastapi import FastAPI, File, UploadFile
+from fastapi.responses import JSONResponse
+from src.bench import format_summary
+from src.service import ocr_tesseract
+
+
+def stub_app(latency, media_root=None):
+    """
+    FastAPI stand-in for the OCR service, answering like its upload endpoints
+    after ``latency`` seconds.
+
+    With ``media_root``, also like its filepath endpoints, hashing the file from there as the service does.
+
+    """
+    app = FastAPI()
+    app.state.clients = set()
+    app.state.received = 0
+
+    @app.middleware("http")
+    async def count_connections(request, call_next):
+        # Every TCP connection comes from its own client port
+        app.state.clients.add(request.scope["client"])
+        app.state.received += int(request.headers.get("content-length", 0))
+        return await call_next(request)
+
+    @app.post("/ocr/pdf/")
+    async def ocr_pdf(file: UploadFile = File(...), pages: str | None = None):
+        # Read in chunks, the stub shares the process and its memory with the client
+        size = 0
+        while chunk := await file.read(1 << 16):
+            size += len(chunk)
+        await asyncio.sleep(latency)
+        return {"text": f"{size} bytes", "pages": {page: "text" for page in (pages or "").split(",") if page}}
+
+    @app.post("/ocr/pdf/filepath")
+    async def ocr_pdf_filepath(pdf_path: str, sha256: str | None = None, pages: str | None = None):
+        with (
+            open(os.path.join(media_root, pdf_path), "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m,
+        ):
+            # The service hashes every file it reads, to key its cache on
+            digest = hashlib.sha256(m).hexdigest()
+            if sha256 is not None and digest != sha256:
+                return JSONResponse({"error": "SHA-256 mismatch."}, status_code=409)
+            size = len(m)
+        await asyncio.sleep(latency)
+        return {"text": f"{size} bytes", "pages": {page: "text" for page in (pages or "").split(",") if page}}
+
+    return app
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_and_upload(path):
+    with open(path, "rb") as f:
+        return ocr_tesseract.ocr_pdf_from_bytes(f.read())
+
+
+class StubOCRServer:
+    """
+    Serves ``stub_app`` with uvicorn on a free local port, in a background
+    thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", backlog=1024))
+
+    @property
+    def url(self):
+        host, port = self.socket.getsockname()
+        return f"http://{host}:{port}"
+
+    @property
+    def connections(self):
+        return len(self.app.state.clients)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.socket]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *args):
+        self.server.should_exit = True
+        self.thread.join()
+        self.socket.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare a connection per OCR upload against the pooled sync and async OCR clients"
+        " on a local FastAPI stub, and the memory of streamed uploads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Uploads per mode.")
+        parser.add_argument("--concurrency", type=int, default=20, help="Uploads in flight at once.")
+        parser.add_argument("--latency", type=float, default=20, help="Stub OCR latency in milliseconds.")
+        parser.add_argument("--file-kb", type=int, default=256, help="Size of the uploaded PDF.")
+        parser.add_argument("--large-file-mb", type=int, default=32, help="Size of the PDF for the memory check.")
+
+    def handle(self, *args, **options):
+        self.concurrency = options["concurrency"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "upload.pdf")
+            with open(path, "wb") as f:
+                f.write(os.urandom(options["file_kb"] * 1024))
+
+            for mode in ("unpooled", "pooled", "pooled-async"):
+                with StubOCRServer(stub_app(options["latency"] / 1000)) as server, self.client_settings(server):
+                    latencies, elapsed = self.run(mode, path, options)
+                    connections = server.connections
+
+                self.stdout.write(format_summary(f"{mode:<12} upload latency", latencies))
+                self.stdout.write(
+                    f"{mode:<12} requests={len(latencies)}/{options['requests']} connections={connections} "
+                    f"wall={elapsed:.2f}s throughput={len(latencies) / elapsed:.1f} req/s"
+                )
+
+            large = os.path.join(directory, "large.pdf")
+            with open(large, "wb") as f:
+                f.write(os.urandom(options["large_file_mb"] * 1024 * 1024))
+            with StubOCRServer(stub_app(0)) as server, self.client_settings(server):
+                streamed = self.peak_memory(ocr_tesseract.ocr_pdf, large)
+                read = self.peak_memory(read_and_upload, large)
+            self.stdout.write(
+                f"{options['large_file_mb']}MB upload peak memory: streamed from disk={streamed / 2**20:.1f}MB "
+                f"read whole={read / 2**20:.1f}MB"
+            )
+
+            # The file in MEDIA_ROOT, on a volume the service mounts too
+            sha256 = file_sha256(large)
+            for shared in (False, True):
+                with StubOCRServer(stub_app(0, media_root=directory)) as server, self.client_settings(server):
+                    with override_settings(OCR_SHARED_MEDIA=shared, MEDIA_ROOT=directory):
+                        start = time.perf_counter()
+                        if ocr_tesseract.ocr_pdf(large, sha256) is None:
+                            raise CommandError("OCR request failed.")
+                        elapsed = time.perf_counter() - start
+                    received = server.app.state.received
+                mode = "shared path" if shared else "upload"
+                self.stdout.write(
+                    f"{options['large_file_mb']}MB {mode:<11} {elapsed * 1000:.0f}ms, {received / 2**20:.2f}MB sent"
+                )
+
+    def client_settings(self, server):
+        ocr_tesseract.get_client.cache_clear()
+        return override_settings(
+            OCR_API_BASE_URL=server.url,
+            OCR_MAX_CONNECTIONS=self.concurrency,
+            OCR_MAX_KEEPALIVE_CONNECTIONS=self.concurrency,
+        )
+
+    def run(self, mode, path, options):
+        if mode == "pooled-async":
+            return asyncio.run(self.run_async(path, options))
+
+        def upload(_):
+            sent = time.perf_counter()
+            if mode == "pooled":
+                result = ocr_tesseract.ocr_pdf(path)
+            else:
+                # What every OCR call used to do, a new connection and no timeout
+                with open(path, "rb") as f:
+                    result = httpx.post(f"{settings.OCR_API_BASE_URL}/ocr/pdf/", files={"file": f}).json()
+            if result is None:
+                raise CommandError("OCR upload failed.")
+            return (time.perf_counter() - sent) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options["concurrency"]) as pool:
+            latencies = list(pool.map(upload, range(options["requests"])))
+        return latencies, time.perf_counter() - start
+
+    async def run_async(self, path, options):
+        semaphore = asyncio.Semaphore(options["concurrency"])
+
+        async def upload():
+            async with semaphore:
+                sent = time.perf_counter()
+                if await ocr_tesseract.aocr_pdf(path) is None:
+                    raise CommandError("OCR upload failed.")
+                return (time.perf_counter() - sent) * 1000
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(upload() for _ in range(options["requests"])))
+        elapsed = time.perf_counter() - start
+        await ocr_tesseract.get_async_client().aclose()
+        return latencies, elapsed
+
+    def peak_memory(self, upload, path):
+        tracemalloc.start()
+        try:
+            upload(path)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
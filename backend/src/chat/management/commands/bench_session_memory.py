@@ -0,0 +1,53 @@
+import random
+import string
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from src.service.session import ChatSession
+
+
+def random_text(length):
+    return "".join(random.choices(string.ascii_letters + " ", k=length))
+
+
+class Command(BaseCommand):
+    help = "Measure the per-socket memory of the chat history held by open chats."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=10_000, help="Number of open chats.")
+        parser.add_argument("--turns", type=int, default=300, help="Turns exchanged on each chat.")
+        parser.add_argument("--chars", type=int, default=600, help="Average characters per turn.")
+        parser.add_argument("--document-chars", type=int, default=40_000, help="Size of one OCR'd document per chat.")
+
+    def handle(self, *args, **options):
+        # Share a pool of strings between chats so that generating them does not dominate the run.
+        pool = [random_text(random.randint(options["chars"] // 2, options["chars"] * 3 // 2)) for _ in range(1000)]
+        document = random_text(options["document_chars"])
+
+        def conversation():
+            yield "user", document[1:]
+            for i in range(options["turns"]):
+                # Slicing copies, so every chat owns its strings like real sockets do
+                yield ("user" if i % 2 else "assistant"), random.choice(pool)[1:]
+
+        bounded = self.measure(options, lambda: ChatSession(), lambda s, r, c: s.append(r, c), conversation)
+        unbounded = self.measure(options, lambda: [], lambda s, r, c: s.append({"role": r, "content": c}), conversation)
+
+        sockets = options["sockets"]
+        self.stdout.write(f"{sockets} chats, {options['turns']} turns each")
+        for label, used in (("ChatSession (capped)", bounded), ("list of dicts", unbounded)):
+            self.stdout.write(f"{label:<21} {used / 1024:8.1f} KiB per socket {used * sockets / 2**20:8.0f} MiB total")
+
+    def measure(self, options, new, append, conversation):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        sessions = []
+        for _ in range(options["sockets"]):
+            session = new()
+            for role, content in conversation():
+                append(session, role, content)
+            sessions.append(session)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del sessions
+        return used / options["sockets"]
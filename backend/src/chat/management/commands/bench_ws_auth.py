@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+from src.bench import format_summary
+from src.middlewares import TokenAuthMiddleware
+from src.user.models import User
+
+
+async def accept(scope, receive, send):
+    # Stands in for the chat consumer, the benchmark stops at authentication
+    return scope["user"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Authenticate a reconnect storm of sockets through TokenAuthMiddleware,"
+        " failing if it queries the database more than once per user."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="Distinct users reconnecting.")
+        parser.add_argument("--sockets", type=int, default=20, help="Sockets per user.")
+
+    def handle(self, *args, **options):
+        users = []
+        for i in range(options["users"]):
+            user, _ = User.objects.get_or_create(
+                username=f"bench-auth-{i}", defaults={"email": f"bench-auth-{i}@example.com"}
+            )
+            users.append(user)
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+
+        locmem_cache = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with override_settings(CACHES=locmem_cache), CaptureQueriesContext(connection) as queries:
+            timings, authenticated = async_to_sync(self.storm)(tokens, options["sockets"])
+
+        self.stdout.write(format_summary("handshake auth", timings))
+        self.stdout.write(
+            f"sockets={len(timings)} authenticated={authenticated} users={len(users)} queries={len(queries)}"
+        )
+        if authenticated != len(timings):
+            raise CommandError(f"Only {authenticated}/{len(timings)} sockets authenticated.")
+        if len(queries) > len(users):
+            raise CommandError(f"{len(queries)} queries for {len(users)} users, at most one each allowed.")
+        self.stdout.write(self.style.SUCCESS("OK"))
+
+    async def storm(self, tokens, sockets):
+        middleware = TokenAuthMiddleware(accept)
+
+        async def handshake(token):
+            start = time.perf_counter()
+            scope = {"type": "websocket", "query_string": f"other=1&token={token}".encode()}
+            user = await middleware(scope, None, None)
+            return (time.perf_counter() - start) * 1000, user.is_authenticated
+
+        results = await asyncio.gather(*(handshake(token) for _ in range(sockets) for token in tokens))
+        return [elapsed for elapsed, _ in results], sum(ok for _, ok in results)
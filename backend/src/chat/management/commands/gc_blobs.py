@@ -0,0 +1,78 @@
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from src.chat.models import Blob, Message
+from src.chat.storage import BLOBS_DIR, blob_sha256, message_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete content-addressed message files no message points to anymore,"
+        " and files left behind by interrupted uploads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace",
+            type=float,
+            default=3600,
+            help="Seconds a blob must have been unreferenced (or a stray file untouched) before it is deleted.",
+        )
+        parser.add_argument(
+            "--recount", action="store_true", help="Recompute every reference count from the messages first."
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted, delete nothing.")
+
+    def handle(self, *args, **options):
+        storage = message_storage()
+        cutoff = timezone.now() - timedelta(seconds=options["grace"])
+        dry_run = options["dry_run"]
+
+        if options["recount"] and not dry_run:
+            references = Message.objects.filter(file=OuterRef("name")).order_by().values("file").annotate(n=Count("pk"))
+            fixed = Blob.objects.update(refcount=Coalesce(Subquery(references.values("n")), 0))
+            self.stdout.write(f"recounted {fixed} blobs")
+
+        deleted, freed = 0, 0
+        for blob in Blob.objects.filter(refcount=0, updated__lt=cutoff).iterator():
+            with transaction.atomic():
+                # Counts are repaired here rather than trusted, a message may point to it still
+                references = Message.objects.filter(file=blob.name).count()
+                if references:
+                    if not dry_run:
+                        Blob.objects.filter(pk=blob.pk).update(refcount=references)
+                    continue
+                if not dry_run:
+                    # Only if no upload took a reference, or deduplicated into it, in the meantime
+                    if not Blob.objects.filter(pk=blob.pk, refcount=0, updated__lt=cutoff).delete()[0]:
+                        continue
+                    storage.delete(blob.name)
+            deleted, freed = deleted + 1, freed + blob.size
+
+        # Files without a row: blobs of messages never saved, and partial writes of a crashed upload
+        strays = 0
+        known = set(Blob.objects.values_list("name", flat=True))
+        root = storage.path(BLOBS_DIR)
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, storage.location).replace(os.sep, "/")
+                if name in known or os.path.getmtime(path) > time.time() - options["grace"]:
+                    continue
+                if blob_sha256(name) is not None and Message.objects.filter(file=name).exists():
+                    continue
+                size = os.path.getsize(path)
+                if not dry_run:
+                    storage.delete(name)
+                strays, freed = strays + 1, freed + size
+
+        verb = "would delete" if dry_run else "deleted"
+        self.stdout.write(
+            f"{verb} {deleted} unreferenced blobs and {strays} stray files, {freed / 2**20:.1f}MB",
+        )
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from src.chat.models import Message
+from src.chat.workers import queue_extraction
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue again the text extraction of message files left pending or processing,"
+        " by a worker restart or a job that expired in the channel layer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stale",
+            type=float,
+            default=900,
+            help="Seconds since the upload after which an unfinished extraction is queued again.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be queued, queue nothing.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["stale"])
+        stale = (
+            Message.objects.filter(
+                extraction_status__in=[Message.ExtractionStatus.PENDING, Message.ExtractionStatus.PROCESSING],
+                timestamp__lt=cutoff,
+            )
+            .exclude(file="")
+            .select_related("chat")
+            .order_by("timestamp")
+        )
+
+        queued = 0
+        for message in stale.iterator():
+            if not options["dry_run"] and not queue_extraction(message):
+                # Marked failed, the queue is full and the rest would be too
+                self.stderr.write(f"extraction queue full, marked message {message.uuid} failed")
+                break
+            queued += 1
+
+        verb = "would queue" if options["dry_run"] else "queued"
+        self.stdout.write(f"{verb} {queued} stale extractions")
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+def mark_existing_files_done(apps, schema_editor):
+    # Text of files uploaded before this migration was already saved into ``content``.
+    Message = apps.get_model("chat", "Message")
+    Message.objects.exclude(file="").exclude(file__isnull=True).update(extraction_status="done")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0002_remove_message_image"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="extracted_text",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="extraction_status",
+            field=models.CharField(
+                choices=[
+                    ("none", "No file"),
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                ],
+                default="none",
+                max_length=16,
+            ),
+        ),
+        migrations.RunPython(mark_existing_files_done, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0003_message_extracted_text_message_extraction_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExtractedText",
+            fields=[
+                ("sha256", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("text", models.TextField()),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="file_sha256",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
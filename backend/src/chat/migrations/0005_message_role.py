@@ -0,0 +1,27 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+def mark_assistant_messages(apps, schema_editor):
+    # Assistant messages used to be told apart by their author, the "llm" user.
+    Message = apps.get_model("chat", "Message")
+    Message.objects.filter(user__username="llm").update(role="assistant")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_extractedtext"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="role",
+            field=models.CharField(
+                choices=[("user", "User"), ("assistant", "Assistant")], default="user", max_length=16
+            ),
+        ),
+        migrations.RunPython(mark_assistant_messages, migrations.RunPython.noop),
+    ]
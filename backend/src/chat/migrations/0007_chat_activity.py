@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:53
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+
+
+def backfill_activity(apps, schema_editor):
+    Chat = apps.get_model("chat", "Chat")
+    Message = apps.get_model("chat", "Message")
+    messages = Message.objects.filter(chat=OuterRef("pk")).order_by().values("chat")
+    Chat.objects.filter(pk__in=Message.objects.values("chat")).update(
+        message_count=Subquery(messages.annotate(count=Count("pk")).values("count")),
+        last_message_at=Subquery(messages.annotate(last=Max("timestamp")).values("last")),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_message_chat_timestamp_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chat",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["user", "-last_message_at"], name="chat_chat_user_activity_idx"),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
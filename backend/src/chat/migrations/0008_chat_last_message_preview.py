@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Left
+
+
+def backfill_preview(apps, schema_editor):
+    Chat = apps.get_model("chat", "Chat")
+    Message = apps.get_model("chat", "Message")
+    latest = Message.objects.filter(chat=OuterRef("pk")).order_by("-timestamp").values("content")[:1]
+    Chat.objects.filter(last_message_at__isnull=False).update(last_message_preview=Left(Subquery(latest), 100))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_chat_activity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="last_message_preview",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+        migrations.RunPython(backfill_preview, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-18 09:12
+
+import django.core.validators
+import src.chat.models
+import src.chat.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_chat_last_message_preview"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                ("sha256", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=255)),
+                ("size", models.PositiveBigIntegerField(default=0)),
+                ("refcount", models.PositiveIntegerField(default=0)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="file",
+            field=models.FileField(
+                blank=True,
+                null=True,
+                storage=src.chat.storage.message_storage,
+                upload_to=src.chat.models.message_file_upload_path,
+                validators=[django.core.validators.FileExtensionValidator(allowed_extensions=["pdf"])],
+            ),
+        ),
+    ]
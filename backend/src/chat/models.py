@@ -1,20 +1,38 @@
-import os
+import hashlib
+import logging
 import uuid
 
 from django.core.validators import FileExtensionValidator
-from django.db import models
-from pypdf import PdfReader
-from src.service.ocr_tesseract import ocr_pdf
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Now
 from src.user.models import User
 
+from .cache import (
+    EXTRACTION_HITS,
+    EXTRACTION_MISSES,
+    bump_messages_version,
+    get_extraction,
+    incr_counter,
+    set_extraction,
+)
+from .extraction import extract_pdf_text
+from .storage import blob_sha256, message_storage
+
+logger = logging.getLogger(__name__)
+
 
 def message_file_upload_path(instance, filename):
     """
     Generate file path for message uploads.
+
+    Only its extension is kept, ``ContentAddressedStorage`` names the file by its hash.
+
     """
-    salt = uuid.uuid4().hex[:10]  # Generate a random salt
-    base_filename, file_extension = os.path.splitext(filename)
-    return f"message_uploads/{salt}_{base_filename}{file_extension}"
+    return f"message_uploads/{filename}"
+
+
+PREVIEW_CHARS = 100
 
 
 class Chat(models.Model):
@@ -28,12 +46,31 @@ class Chat(models.Model):
     description = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chats")
+    # Denormalized from the messages, see ``Message.save`` and ``signals.message_deleted``
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=PREVIEW_CHARS, blank=True, default="")
 
     class Meta:
         ordering = ["-timestamp"]
+        indexes = [
+            # Sidebar: a user's chats with messages, most recently active first
+            models.Index(fields=["user", "-last_message_at"], name="chat_chat_user_activity_idx"),
+        ]
 
 
 class Message(models.Model):
+    class Role(models.TextChoices):
+        USER = "user", "User"
+        ASSISTANT = "assistant", "Assistant"
+
+    class ExtractionStatus(models.TextChoices):
+        NONE = "none", "No file"
+        PENDING = "pending", "Pending"
+        PROCESSING = "processing", "Processing"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
     uuid = models.UUIDField(
         editable=False,
         db_index=True,
@@ -42,68 +79,248 @@ class Message(models.Model):
     )
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name="messages")
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="messages")
+    role = models.CharField(max_length=16, choices=Role.choices, default=Role.USER)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     file = models.FileField(
         upload_to=message_file_upload_path,
+        storage=message_storage,
         null=True,
         blank=True,
         validators=[FileExtensionValidator(allowed_extensions=["pdf"])],
     )
+    extracted_text = models.TextField(blank=True, default="")
+    extraction_status = models.CharField(
+        max_length=16,
+        choices=ExtractionStatus.choices,
+        default=ExtractionStatus.NONE,
+    )
+    file_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
 
     class Meta:
         ordering = ["-timestamp"]
+        indexes = [
+            # Chat history, newest first, and keyset pagination over it
+            models.Index(fields=["chat", "timestamp"], name="chat_message_chat_ts_idx"),
+        ]
+
+    # Name of the file as last loaded or saved, None if it was deferred
+    _stored_file = ""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_file = (instance.file.name or "") if "file" in field_names else None
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or "file" in fields:
+            self._stored_file = self.file.name or ""
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get("update_fields")
+        file_saved = update_fields is None or "file" in update_fields
+        if file_saved:
+            if not adding and self._stored_file is None:
+                self._stored_file = Message.objects.values_list("file", flat=True).get(pk=self.pk) or ""
+            if self.file and not self.file._committed:
+                # As FileField.pre_save would, but first, so the row is written with the name storage picked
+                self.file.save(self.file.name, self.file.file, save=False)
+            # Known from the name of a content-addressed file, extraction then needs not read it
+            sha256 = blob_sha256(self.file.name) if self.file else ""
+            if sha256 is not None and sha256 != self.file_sha256:
+                self.file_sha256 = sha256
+                if update_fields is not None:
+                    kwargs["update_fields"] = {*update_fields, "file_sha256"}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            name = self.file.name or ""
+            if file_saved and name != self._stored_file:
+                if self._stored_file:
+                    Blob.release(self._stored_file)
+                if name:
+                    Blob.acquire(name, self.file.size)
+                self._stored_file = name
+            if adding:
+                # Concurrent inserts may commit out of order, never move the activity back
+                newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=self.timestamp)
+                Chat.objects.filter(pk=self.chat_id).update(
+                    message_count=F("message_count") + 1,
+                    last_message_at=Case(When(newer, then=Value(self.timestamp)), default=F("last_message_at")),
+                    last_message_preview=Case(When(newer, then=Value(self.preview)), default=F("last_message_preview")),
+                )
+            self.invalidate_chat_cache()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            stored = self.file.name if self._stored_file is None else self._stored_file
+            if stored:
+                Blob.release(stored)
+            return super().delete(*args, **kwargs)
+
+    def invalidate_chat_cache(self):
+        """
+        Bump the version of the cached message pages of the chat, once the
+        change is committed.
+        """
+        if Message.chat.is_cached(self):
+            chat_uuid = self.chat.uuid
+        else:
+            chat_uuid = Chat.objects.values_list("uuid", flat=True).get(pk=self.chat_id)
+        # Bumping before the commit would let a reader cache the old rows under the new version
+        transaction.on_commit(lambda: bump_messages_version(chat_uuid))
+
+    @property
+    def preview(self):
+        return " ".join(self.content.split())[:PREVIEW_CHARS]
 
     @property
     def complete_message(self):
         """
         Return the complete message content.
 
-        With file and image text if available.
+        With the extracted file text if available.
 
         """
-        message_content = self.content
-        if self.file:
-            file_text = self.extract_text_from_pdf_ocr(self.file.path)
-            if file_text:
-                return file_text
-            file_text = self.extract_text_from_pdf(self.file.path)
-            if file_text:
-                return file_text
-        return message_content
+        return self.extracted_text or self.content
 
-    def save(self, *args, **kwargs):
+    def extract_file_text(self):
         """
-        Override the save method to extract text from PDF file.
+        Extract the text of the attached file and store it on the message.
+
+        This is slow (an OCR round-trip and a full PDF pass), so it runs in the
+        extraction worker rather than in the request or socket that uploaded the
+        file.
+
         """
-        self.content = self.complete_message
+        if not self.file:
+            return
+
+        Message.objects.filter(pk=self.pk).update(extraction_status=self.ExtractionStatus.PROCESSING)
+        self.invalidate_chat_cache()
+
+        if not self.file_sha256:
+            self.file_sha256 = self.hash_file(self.file)
+
+        file_text = ExtractedText.lookup(self.file_sha256)
+        if file_text is None:
+            file_text = self.extract_text_from_pdf(self.file.path, self.file_sha256)
+            if file_text:
+                ExtractedText.store(self.file_sha256, file_text)
 
-        super().save(*args, **kwargs)
+        self.extracted_text = file_text or ""
+        self.extraction_status = self.ExtractionStatus.DONE if file_text else self.ExtractionStatus.FAILED
+        self.save(update_fields=["extracted_text", "extraction_status", "file_sha256"])
 
     @staticmethod
-    def extract_text_from_pdf_ocr(filepath):
+    def hash_file(file):
         """
-        Extract text from PDF file using OCR.
+        Return the SHA-256 hex digest of a stored file, read in chunks.
         """
-        try:
-            with open(filepath, "rb") as f:
-                return ocr_pdf(f.read())
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return ""
+        digest = hashlib.sha256()
+        with file.open("rb") as f:
+            for chunk in f.chunks():
+                digest.update(chunk)
+        return digest.hexdigest()
 
     @staticmethod
-    def extract_text_from_pdf(filepath):
+    def extract_text_from_pdf(filepath, sha256=None):
         """
-        Extract text from PDF file using pypdf library.
+        Extract text from PDF file, OCR'ing only the pages without a text layer.
         """
         try:
-            with open(filepath, "rb") as f:
-                reader = PdfReader(f)
-                full_text = ""
-                for page in reader.pages:
-                    full_text += page.extract_text()
-                return full_text
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
+            text, _ = extract_pdf_text(filepath, sha256)
+            return text
+        except Exception:
+            logger.exception("Error extracting text from PDF %s", filepath)
             return ""
+
+
+class ExtractedText(models.Model):
+    """
+    Text extracted from an uploaded file, keyed by the SHA-256 of its bytes.
+
+    Rows are fronted by ``CACHES['default']``, so the same document uploaded
+    again (by any user) is never extracted twice.
+
+    """
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    text = models.TextField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def lookup(cls, sha256):
+        """
+        Return the stored text for ``sha256``, or ``None`` on a miss.
+        """
+        text = get_extraction(sha256)
+        if text is None:
+            text = cls.objects.filter(sha256=sha256).values_list("text", flat=True).first()
+            if text is not None:
+                set_extraction(sha256, text)
+
+        incr_counter(EXTRACTION_MISSES if text is None else EXTRACTION_HITS)
+        return text
+
+    @classmethod
+    def store(cls, sha256, text):
+        cls.objects.update_or_create(sha256=sha256, defaults={"text": text})
+        set_extraction(sha256, text)
+
+
+class Blob(models.Model):
+    """
+    A file of ``ContentAddressedStorage`` and the number of messages pointing to
+    it.
+
+    Counts are kept by ``Message.save`` and ``Message.delete``, and for whole
+    chats by a ``pre_delete`` receiver. Blobs without references are deleted
+    by ``python manage.py gc_blobs``, which also repairs counts that drifted.
+
+    """
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    # Last time the count changed, gc_blobs only deletes blobs unreferenced for a while
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def acquire(cls, name, size):
+        sha256 = blob_sha256(name)
+        if sha256 is None:
+            return
+        _, created = cls.objects.get_or_create(sha256=sha256, defaults={"name": name, "size": size, "refcount": 1})
+        if not created:
+            cls.objects.filter(pk=sha256).update(refcount=F("refcount") + 1, updated=Now())
+
+    @classmethod
+    def release(cls, name):
+        sha256 = blob_sha256(name)
+        if sha256 is not None:
+            cls.objects.filter(pk=sha256, refcount__gt=0).update(refcount=F("refcount") - 1, updated=Now())
+
+    @classmethod
+    def release_chat(cls, chat):
+        """
+        Release the blobs of all messages of ``chat``, in one query.
+        """
+        references = (
+            Message.objects.filter(chat=chat, file=OuterRef("name"))
+            .order_by()
+            .values("file")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        cls.objects.filter(name__in=Message.objects.filter(chat=chat).values("file")).update(
+            # Never below zero, the count is a positive integer
+            refcount=Case(
+                When(refcount__gt=Subquery(references), then=F("refcount") - Subquery(references)),
+                default=Value(0),
+            ),
+            updated=Now(),
+        )
@@ -0,0 +1,39 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class MessageCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the ``(chat, timestamp)`` index.
+
+    Each page starts from the timestamp encoded in the cursor instead of
+    skipping rows, so page N costs the same as page 1.
+
+    """
+
+    ordering = "-timestamp"
+    page_size_query_param = "limit"
+    max_page_size = 1000
+
+
+class ChatCursorPagination(CursorPagination):
+    """
+    Chats by most recent activity, without the ``COUNT(*)`` of limit/offset.
+    """
+
+    ordering = "-last_message_at"
+    page_size_query_param = "limit"
+    max_page_size = 1000
+
+
+def get_message_paginator(request):
+    """
+    Return the paginator of a message list request.
+
+    Limit/offset stays the default, ``?pagination=cursor`` (or a ``cursor``
+    from a previous page) switches to keyset pagination.
+
+    """
+    params = request.query_params if request is not None else {}
+    if params.get("pagination") == "cursor" or "cursor" in params:
+        return MessageCursorPagination()
+    return LimitOffsetPagination()
@@ -7,7 +7,8 @@ from .models import Chat, Message
 class MessageSerializerNoRef(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ["uuid", "content", "timestamp", "file"]
+        fields = ["uuid", "role", "content", "timestamp", "file", "extraction_status"]
+        read_only_fields = ["role", "extraction_status"]
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -15,13 +16,57 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ["uuid", "user", "content", "timestamp", "file"]
+        fields = ["uuid", "user", "role", "content", "timestamp", "file", "extraction_status"]
+        read_only_fields = ["role", "extraction_status"]
+
+
+class MessageValuesSerializer(serializers.BaseSerializer):
+    """
+    Read-only fast path of ``MessageSerializer`` over
+    ``.values(*MessageValuesSerializer.fields)`` rows.
+
+    Skips model instances and per-field serializer objects, and projects the
+    author down to its id and username.
+
+    """
+
+    fields = ("uuid", "user_id", "user__username", "role", "content", "timestamp", "file", "extraction_status")
+
+    # Formats like the ModelSerializer field, ISO 8601 in the current time zone
+    timestamp_field = serializers.DateTimeField()
+
+    def to_representation(self, row):
+        file = row["file"]
+        if file:
+            file = Message._meta.get_field("file").storage.url(file)
+            request = self.context.get("request")
+            if request is not None:
+                file = request.build_absolute_uri(file)
+        return {
+            "uuid": str(row["uuid"]),
+            "user": {"id": row["user_id"], "username": row["user__username"]},
+            "role": row["role"],
+            "content": row["content"],
+            "timestamp": self.timestamp_field.to_representation(row["timestamp"]),
+            "file": file or None,
+            "extraction_status": row["extraction_status"],
+        }
 
 
 class ChatSerializerNoRef(serializers.ModelSerializer):
     class Meta:
         model = Chat
-        fields = ["id", "uuid", "name", "description", "timestamp"]
+        fields = [
+            "id",
+            "uuid",
+            "name",
+            "description",
+            "timestamp",
+            "message_count",
+            "last_message_at",
+            "last_message_preview",
+        ]
+        read_only_fields = ["message_count", "last_message_at", "last_message_preview"]
 
 
 class ChatSerializer(serializers.ModelSerializer):
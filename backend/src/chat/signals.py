@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .cache import bump_messages_version
+from .models import Blob, Chat, Message
+
+
+@receiver(pre_delete, sender=Chat)
+def chat_deleted(sender, instance, **kwargs):
+    # Messages go along with their chat, in bulk and without Message.delete
+    Blob.release_chat(instance)
+    chat_uuid = instance.uuid
+    transaction.on_commit(lambda: bump_messages_version(chat_uuid))
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    # Sent for querysets too, unlike Message.delete
+    if isinstance(origin, Chat):
+        # Deleted along with the chat, see chat_deleted
+        return
+    # The activity moves back to the latest message left, if the deleted one was newer
+    latest = (
+        Message.objects.filter(chat_id=instance.chat_id).only("timestamp", "content").order_by("-timestamp").first()
+    )
+    if latest is None:
+        activity = {"last_message_at": None, "last_message_preview": ""}
+    else:
+        was_latest = Q(last_message_at__gt=latest.timestamp)
+        activity = {
+            "last_message_at": Case(When(was_latest, then=Value(latest.timestamp)), default=F("last_message_at")),
+            "last_message_preview": Case(
+                When(was_latest, then=Value(latest.preview)), default=F("last_message_preview")
+            ),
+        }
+    Chat.objects.filter(pk=instance.chat_id).update(
+        # Never below zero, the count is a positive integer
+        message_count=Case(When(message_count__gt=0, then=F("message_count") - 1), default=Value(0)),
+        **activity,
+    )
+    instance.invalidate_chat_cache()
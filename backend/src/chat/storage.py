@@ -0,0 +1,82 @@
+"""
+Content-addressed storage of message files.
+
+A file is stored once under ``MEDIA_ROOT/blobs/ab/cd/<sha256><ext>``, named
+by the SHA-256 of its bytes and sharded by the first two byte pairs of it, so
+the same W-2 uploaded ten times takes the space of one. References are
+counted on ``Blob`` rows and ``python manage.py gc_blobs`` deletes blobs no
+message points to anymore.
+
+"""
+
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db.models.functions import Now
+
+BLOBS_DIR = "blobs"
+BLOB_NAME = re.compile(rf"^{BLOBS_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/(?P<sha256>[0-9a-f]{{64}})(\.\w+)?$")
+
+
+def blob_name(sha256, ext=""):
+    return f"{BLOBS_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext.lower()}"
+
+
+def blob_sha256(name):
+    """
+    Return the SHA-256 a stored file is named by, or None if it is not a blob
+    (e.g. an upload from before).
+    """
+    match = BLOB_NAME.match(name or "")
+    return match["sha256"] if match else None
+
+
+def content_sha256(content):
+    """
+    Return the SHA-256 of ``content``, known from the upload when it was hashed
+    on the fly.
+    """
+    sha256 = getattr(content, "sha256", None)
+    if sha256:
+        return sha256
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    ``FileSystemStorage`` saving each distinct content once, under its hash.
+
+    Files already in storage are opened, served and deleted like before.
+
+    """
+
+    def _save(self, name, content):
+        name = blob_name(content_sha256(content), os.path.splitext(name)[1])
+        path = self.path(name)
+        if os.path.exists(path):
+            # Deduplicated, refresh its age so gc_blobs leaves it to the message about to point at it. The row
+            # update also waits out a gc_blobs deleting it, the file is then gone and written again below.
+            from .models import Blob  # The models import this module
+
+            Blob.objects.filter(name=name).update(updated=Now())
+            try:
+                os.utime(path)
+                return name
+            except FileNotFoundError:
+                pass
+
+        # Written aside and renamed, concurrent uploads of the same content all end up with a whole blob
+        partial = super()._save(f"{name}.{uuid.uuid4().hex}.partial", content)
+        os.replace(self.path(partial), path)
+        return name
+
+
+def message_storage():
+    return ContentAddressedStorage()
@@ -0,0 +1,529 @@
+import hashlib
+import importlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from src import codec
+from src.user.cache import LLM_USERNAME
+from src.user.models import User
+
+from .cache import get_messages_version
+from .models import Blob, Chat, ExtractedText, Message
+from .routing import websocket_urlpatterns
+from .storage import message_storage
+from .uploads import HEADER, ChunkedUpload, UploadError
+from .workers import ExtractionConsumer, extraction_event
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+# A Redis nobody listens on
+UNREACHABLE_CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:1/0",
+        "OPTIONS": {"SOCKET_CONNECT_TIMEOUT": 0.1},
+    }
+}
+START = datetime(2024, 4, 15, tzinfo=timezone.utc)
+
+
+def create_message(chat, content, minutes):
+    """
+    Create a message of ``chat`` sent ``minutes`` after ``START``.
+    """
+    with mock.patch("django.utils.timezone.now", return_value=START + timedelta(minutes=minutes)):
+        return Message.objects.create(chat=chat, user=chat.user, content=content)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="alice", email="alice@example.com")
+        cls.other = User.objects.create(username="bob", email="bob@example.com")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_chat(self, name, user=None):
+        return Chat.objects.create(name=name, user=user or self.user, uuid=uuid.uuid4())
+
+
+class ChatListTests(ChatTestCase):
+    url = reverse("chat-list-create")
+
+    def test_lists_chats_by_latest_activity(self):
+        old, recent, busy = self.create_chat("old"), self.create_chat("recent"), self.create_chat("busy")
+        self.create_chat("empty")
+        create_message(self.create_chat("not mine", self.other), "hi", 10)
+        create_message(busy, "first", 1)
+        create_message(old, "only", 2)
+        create_message(recent, "only", 3)
+        create_message(busy, "last", 4)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([chat["name"] for chat in response.data["results"]], ["busy", "recent", "old"])
+
+    def test_cursor_pages_follow_activity(self):
+        for minutes in range(5):
+            create_message(self.create_chat(f"chat {minutes}"), "hi", minutes)
+
+        names, url = [], f"{self.url}?limit=2"
+        while url:
+            response = self.client.get(url)
+            names += [chat["name"] for chat in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(names, [f"chat {minutes}" for minutes in reversed(range(5))])
+
+    def test_list_takes_one_query(self):
+        for minutes in range(3):
+            chat = self.create_chat(f"chat {minutes}")
+            create_message(chat, "question", minutes)
+            create_message(chat, "answer", minutes)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_deleted_messages_are_uncounted(self):
+        chat = self.create_chat("chat")
+        for minutes in range(3):
+            create_message(chat, "hi", minutes)
+
+        Message.objects.filter(chat=chat).first().delete()
+        Message.objects.filter(chat=chat).delete()
+
+        chat.refresh_from_db()
+        self.assertEqual(chat.message_count, 0)
+
+    def test_deleting_the_latest_message_moves_activity_back(self):
+        older, newer = self.create_chat("older"), self.create_chat("newer")
+        create_message(older, "first", 0)
+        create_message(newer, "second", 1)
+        create_message(older, "third", 2)
+
+        Message.objects.get(content="third").delete()
+
+        response = self.client.get(self.url)
+        self.assertEqual([chat["name"] for chat in response.data["results"]], ["newer", "older"])
+        self.assertEqual(response.data["results"][1]["last_message_preview"], "first")
+
+        Message.objects.filter(content="first").delete()
+
+        older.refresh_from_db()
+        self.assertEqual((older.last_message_at, older.last_message_preview), (None, ""))
+        self.assertEqual([chat["name"] for chat in self.client.get(self.url).data["results"]], ["newer"])
+
+    def test_messages_keep_count_and_preview(self):
+        chat = self.create_chat("chat")
+        create_message(chat, "first", 0)
+        last = create_message(chat, "  what is\n box 12?  " + "x" * 200, 1)
+
+        response = self.client.get(self.url)
+
+        (listed,) = response.data["results"]
+        self.assertEqual(listed["message_count"], 2)
+        self.assertEqual(listed["last_message_preview"], last.preview)
+        self.assertTrue(listed["last_message_preview"].startswith("what is box 12? xx"))
+        self.assertEqual(len(listed["last_message_preview"]), 100)
+
+
+class MessageListTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chat = self.create_chat("chat")
+        self.url = reverse("message-list-create", kwargs={"chat_uuid": self.chat.uuid})
+
+    def test_cursor_pages_are_newest_first(self):
+        for minutes in range(7):
+            create_message(self.chat, f"message {minutes}", minutes)
+
+        contents, url = [], f"{self.url}?pagination=cursor&limit=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            contents += [message["content"] for message in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(contents, [f"message {minutes}" for minutes in reversed(range(7))])
+
+    def test_other_users_chat_is_empty(self):
+        create_message(self.chat, "secret", 0)
+        self.client.force_authenticate(self.other)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data["results"], [])
+
+    def test_unchanged_page_is_not_modified(self):
+        create_message(self.chat, "hi", 0)
+        etag = self.client.get(self.url)["ETag"]
+
+        for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            with self.subTest(if_none_match=if_none_match), self.assertNumQueries(0):
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'{etag[:-3]}"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_message_changes_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            create_message(self.chat, "hi", 0)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual([message["content"] for message in response.data["results"]], ["hi"])
+
+    def test_deleted_messages_change_etag(self):
+        kept = create_message(self.chat, "kept", 0)
+        create_message(self.chat, "deleted", 1)
+        create_message(self.chat, "deleted too", 2)
+
+        for delete in (
+            lambda: Message.objects.get(content="deleted").delete(),
+            lambda: Message.objects.filter(content="deleted too").delete(),
+        ):
+            etag = self.client.get(self.url)["ETag"]
+            with self.captureOnCommitCallbacks(execute=True):
+                delete()
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual([message["uuid"] for message in response.data["results"]], [str(kept.uuid)])
+
+    def test_lists_from_database_without_cache(self):
+        create_message(self.chat, "hi", 0)
+
+        with self.settings(CACHES=UNREACHABLE_CACHES), self.assertLogs("src.chat", "WARNING"):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertEqual([message["content"] for message in response.data["results"]], ["hi"])
+
+
+class MessageFileTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chat = self.create_chat("chat")
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+    def create_message(self, content=b"%PDF-1.4 w2"):
+        return Message.objects.create(
+            chat=self.chat, user=self.user, content="w2", file=SimpleUploadedFile("w2.pdf", content)
+        )
+
+    def refcounts(self):
+        return dict(Blob.objects.values_list("sha256", "refcount"))
+
+    def test_hash_is_saved_with_the_stored_name(self):
+        sha256 = hashlib.sha256(b"%PDF-1.4 w2").hexdigest()
+
+        message = self.create_message()
+
+        self.assertTrue(message.file.name.endswith(f"/{sha256}.pdf"))
+        self.assertEqual(Message.objects.get(pk=message.pk).file_sha256, sha256)
+        self.assertEqual(self.refcounts(), {sha256: 1})
+
+    def test_replacing_or_clearing_the_file_moves_its_reference(self):
+        first, second = hashlib.sha256(b"%PDF-1.4 w2").hexdigest(), hashlib.sha256(b"%PDF-1.4 1099").hexdigest()
+        message = Message.objects.get(pk=self.create_message().pk)
+
+        message.file = SimpleUploadedFile("1099.pdf", b"%PDF-1.4 1099")
+        message.save()
+        self.assertEqual(self.refcounts(), {first: 0, second: 1})
+        self.assertEqual(Message.objects.get(pk=message.pk).file_sha256, second)
+
+        message.file = None
+        message.save(update_fields=["file"])
+        self.assertEqual(self.refcounts(), {first: 0, second: 0})
+        self.assertEqual(Message.objects.get(pk=message.pk).file_sha256, "")
+
+    def test_gc_keeps_a_blob_deduplicated_into(self):
+        message = self.create_message()
+        name = message.file.name
+        message.delete()
+        Blob.objects.update(updated=START)
+
+        # Stored by an upload whose message is not saved yet
+        message_storage().save("w2.pdf", ContentFile(b"%PDF-1.4 w2"))
+        call_command("gc_blobs", grace=60, stdout=io.StringIO())
+
+        self.assertTrue(message_storage().exists(name))
+        self.assertEqual(Blob.objects.get().name, name)
+
+    def test_deleting_releases_the_stored_file(self):
+        message = Message.objects.only("pk", "chat").get(pk=self.create_message().pk)
+
+        message.delete()
+
+        self.assertEqual(list(self.refcounts().values()), [0])
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.enterContext(override_settings(FILE_UPLOAD_TEMP_DIR=temp_dir, CHAT_UPLOAD_CHUNK_SIZE=4))
+
+    def start(self, size, name="w2.pdf"):
+        upload = ChunkedUpload(name, size)
+        self.addCleanup(upload.discard)
+        return upload
+
+    def test_chunks_are_appended_and_hashed(self):
+        upload = self.start(6)
+
+        self.assertEqual(upload.write(HEADER.pack(0) + b"%PDF"), 4)
+        self.assertFalse(upload.complete)
+        self.assertEqual(upload.write(HEADER.pack(4) + b"w2"), 6)
+
+        self.assertTrue(upload.complete)
+        self.assertEqual(upload.sha256, hashlib.sha256(b"%PDFw2").hexdigest())
+        with upload.open() as file:
+            self.assertEqual(file.read(), b"%PDFw2")
+            self.assertEqual(file.sha256, upload.sha256)
+
+    def test_chunks_out_of_order_are_refused_with_the_offset_to_resume_from(self):
+        upload = self.start(8)
+        upload.write(HEADER.pack(0) + b"%PDF")
+
+        for offset in (0, 2, 8):
+            with self.subTest(offset=offset), self.assertRaises(UploadError) as raised:
+                upload.write(HEADER.pack(offset) + b"w2")
+            self.assertEqual(raised.exception.offset, 4)
+        self.assertEqual(upload.received, 4)
+
+    def test_chunks_past_the_chunk_or_file_size_are_refused(self):
+        upload = self.start(6)
+
+        for frame in (HEADER.pack(0) + b"%PDF-", HEADER.pack(0), b"\0"):
+            with self.subTest(frame=frame), self.assertRaises(UploadError):
+                upload.write(frame)
+
+        upload.write(HEADER.pack(0) + b"%PDF")
+        with self.assertRaises(UploadError):
+            upload.write(HEADER.pack(4) + b"w2x")
+        self.assertEqual(upload.received, 4)
+
+    def test_uploads_are_checked_before_any_chunk(self):
+        with self.settings(CHAT_UPLOAD_MAX_SIZE=10):
+            for name, size in (("", 1), ("w2.pdf", 0), ("w2.pdf", "1"), ("w2.pdf", 11)):
+                with self.subTest(name=name, size=size), self.assertRaises(UploadError):
+                    ChunkedUpload(name, size)
+
+        self.assertEqual(self.start(1, name="../../w2.pdf").name, "w2.pdf")
+
+    def test_discard_deletes_the_temporary_file(self):
+        upload = self.start(4)
+        upload.write(HEADER.pack(0) + b"%PD")
+
+        upload.discard()
+
+        self.assertFalse(os.path.exists(upload.file.name))
+
+
+class CodecTests(TestCase):
+    value = {
+        "uuid": uuid.UUID(int=1),
+        "timestamp": START,
+        "date": START.date(),
+        "content": "Schedule C — €",
+        1: [None, True, 1.5],
+    }
+    encoded = {
+        "uuid": "00000000-0000-0000-0000-000000000001",
+        "timestamp": "2024-04-15T00:00:00Z",
+        "date": "2024-04-15",
+        "content": "Schedule C — €",
+        "1": [None, True, 1.5],
+    }
+
+    def test_encodes_model_values_like_drf(self):
+        self.assertEqual(codec.loads(codec.dumps(self.value)), self.encoded)
+        self.assertIsInstance(codec.dumps_text(self.value), str)
+        self.assertIn("€", codec.dumps_text(self.value))
+
+    def test_standard_library_fallback_encodes_the_same(self):
+        try:
+            with mock.patch.dict(sys.modules, {"orjson": None}):
+                importlib.reload(codec)
+            self.assertIsNone(codec.orjson)
+            self.assertEqual(codec.loads(codec.dumps(self.value)), self.encoded)
+        finally:
+            importlib.reload(codec)
+        self.assertIsNotNone(codec.orjson)
+
+
+class ExtractedTextTests(TestCase):
+    def test_lookup_reads_the_database_without_cache(self):
+        ExtractedText.objects.create(sha256="a" * 64, text="box 1")
+
+        with self.settings(CACHES=UNREACHABLE_CACHES), self.assertLogs("src.chat", "WARNING"):
+            self.assertEqual(ExtractedText.lookup("a" * 64), "box 1")
+            self.assertIsNone(ExtractedText.lookup("b" * 64))
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ExtractionWorkerTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chat = self.create_chat("chat")
+        self.message = Message.objects.create(
+            chat=self.chat, user=self.user, content="w2", extraction_status=Message.ExtractionStatus.PENDING
+        )
+        self.consumer = ExtractionConsumer()
+        self.consumer.channel_layer = get_channel_layer()
+        async_to_sync(self.consumer.channel_layer.group_add)(f"chat_{self.chat.uuid}", "socket")
+
+    def extracted_frame(self):
+        event = async_to_sync(self.consumer.channel_layer.receive)("socket")
+        return codec.loads(event["text"])
+
+    def test_failed_extraction_is_sent_and_invalidates_pages(self):
+        version = get_messages_version(self.chat.uuid)
+
+        with mock.patch.object(Message, "extract_file_text", side_effect=OSError):
+            with self.captureOnCommitCallbacks(execute=True), self.assertLogs("src.chat.workers", "ERROR"):
+                self.consumer.extract_text(extraction_event(self.message))
+
+        self.assertEqual(self.extracted_frame()["extraction_status"], Message.ExtractionStatus.FAILED)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.extraction_status, Message.ExtractionStatus.FAILED)
+        self.assertNotEqual(get_messages_version(self.chat.uuid), version)
+
+    def test_deleted_message_is_sent_as_failed(self):
+        event = extraction_event(self.message, reply_channel="socket")
+        self.message.delete()
+
+        with self.assertLogs("src.chat.workers", "WARNING"):
+            self.consumer.extract_text(event)
+
+        frame = self.extracted_frame()
+        self.assertEqual(frame["uuid"], str(self.message.uuid))
+        self.assertEqual(frame["extraction_status"], Message.ExtractionStatus.FAILED)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    LLM_LIMITER=False,
+    LLM_PROVIDER="src.service.stub.StubProvider",
+    LLM_STUB_LATENCY=0,
+    LLM_STUB_REPLY_TOKENS=3,
+)
+class SocketTestCase(ChatTestCase):
+    async def connect(self, room="new"):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{room}/")
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator, type):
+        """
+        Return the next frame of ``type``, skipping the others.
+        """
+        while (frame := await communicator.receive_json_from())["type"] != type:
+            pass
+        return frame
+
+
+class UploadSocketTests(SocketTestCase):
+    async def test_chunks_past_the_window_close_the_socket(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({"type": "upload.start", "name": "w2.pdf", "size": 1024})
+        ready = await self.receive(communicator, "upload.ready")
+
+        def slow_write(upload, frame):
+            time.sleep(0.05)
+            return write(upload, frame)
+
+        write = ChunkedUpload.write
+        with (
+            mock.patch("src.chat.consumers.INLINE_WRITE_MAX", 0),
+            mock.patch.object(ChunkedUpload, "write", slow_write),
+        ):
+            for offset in range(ready["window"] + 1):
+                await communicator.send_to(bytes_data=HEADER.pack(offset) + b"x")
+            while (output := await communicator.receive_output())["type"] != "websocket.close":
+                pass
+
+        self.assertEqual(output["code"], 4008)
+
+
+class ChatSocketTests(SocketTestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.create(username=LLM_USERNAME, email="llm@example.com")
+
+    async def receive_reply(self, communicator):
+        """
+        Return the deltas streamed before the next reply, and the reply.
+        """
+        deltas = []
+        # Replies are broadcast as bare messages, without a type
+        while "type" in (frame := await communicator.receive_json_from()):
+            if frame["type"] == "chat.message.delta":
+                deltas.append(frame["delta"])
+        return deltas, frame
+
+    async def test_reply_is_saved_and_broadcast_to_the_room(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({"message": "What is box 1?"})
+
+        deltas, reply = await self.receive_reply(communicator)
+        await communicator.disconnect()
+
+        self.assertEqual(deltas, [])
+        self.assertEqual(reply["role"], Message.Role.ASSISTANT)
+        self.assertEqual(len(reply["content"].split()), 3)
+        contents = [message.content async for message in Message.objects.order_by("timestamp")]
+        self.assertEqual(contents, ["What is box 1?", reply["content"]])
+
+    async def test_streamed_reply_is_sent_in_deltas(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({"message": "What is box 1?", "stream": True})
+
+        deltas, reply = await self.receive_reply(communicator)
+        await communicator.disconnect()
+
+        self.assertEqual(len(deltas), 3)
+        self.assertEqual("".join(deltas), reply["content"])
+        self.assertEqual(await Message.objects.filter(role=Message.Role.ASSISTANT).acount(), 1)
+
+    async def test_other_users_chat_is_refused(self):
+        chat = await Chat.objects.acreate(name="bob's", user=self.other, uuid=uuid.uuid4())
+
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{chat.uuid}/")
+        communicator.scope["user"] = self.user
+        connected, code = await communicator.connect()
+
+        self.assertEqual((connected, code), (False, 4003))
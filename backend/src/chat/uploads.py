@@ -0,0 +1,125 @@
+"""
+Chunked file uploads over the chat socket.
+
+The client announces a file with a ``{"type": "upload.start", "name", "size"}``
+text frame and sends it in binary frames of at most ``chunk_size`` bytes, each
+prefixed with its offset as an 8-byte big-endian integer. Every chunk is
+acknowledged with ``{"type": "upload.ack", "offset"}``, and at most
+``window`` chunks may be waiting for their ack, so memory per upload stays
+bounded by ``window * chunk_size``. A socket sending more is closed. Once the last chunk is acknowledged, the
+chat message refers to the file with ``"upload": id``.
+
+Chunks are appended to a temporary file in ``FILE_UPLOAD_TEMP_DIR`` and
+hashed as they arrive. The finished file is moved into storage, a rename when
+the temporary directory is on the same filesystem as ``MEDIA_ROOT``.
+
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+
+HEADER = struct.Struct(">Q")
+HEADER_SIZE = HEADER.size
+# Larger chunks are written and hashed in a thread, smaller ones cost less than the hop
+INLINE_WRITE_MAX = 64 * 1024
+
+
+class UploadError(Exception):
+    """
+    A chunked upload was rejected, ``offset`` is where the client may resume
+    from.
+    """
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class UploadedFile(File):
+    """
+    A finished upload, moved rather than copied by ``FileSystemStorage``.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class ChunkedUpload:
+    def __init__(self, name, size, validators=()):
+        if not isinstance(name, str) or not name or not isinstance(size, int) or size <= 0:
+            raise UploadError("An upload needs a file name and a positive size.")
+        if size > settings.CHAT_UPLOAD_MAX_SIZE:
+            raise UploadError(f"Files are limited to {settings.CHAT_UPLOAD_MAX_SIZE} bytes.")
+        name = os.path.basename(name)
+        try:
+            for validator in validators:
+                validator(File(None, name=name))
+        except ValidationError as e:
+            raise UploadError(" ".join(e.messages))
+
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.size = size
+        self.received = 0
+        # Chunks received and not acknowledged yet, see ``ChatConsumer.receive_chunk``
+        self.unacked = 0
+        self.digest = hashlib.sha256()
+        self.file = tempfile.NamedTemporaryFile(
+            prefix="upload-", suffix=".part", dir=settings.FILE_UPLOAD_TEMP_DIR, delete=False
+        )
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    @property
+    def sha256(self):
+        return self.digest.hexdigest()
+
+    def write(self, frame):
+        """
+        Append the chunk of a binary ``frame``, returning the offset of the next
+        one.
+        """
+        if len(frame) <= HEADER_SIZE:
+            raise UploadError("Empty upload chunk.", self.received)
+        (offset,) = HEADER.unpack_from(frame)
+        if offset != self.received:
+            raise UploadError(f"Expected the chunk at offset {self.received}.", self.received)
+        # A view, slicing the frame would copy the chunk
+        chunk = memoryview(frame)[HEADER_SIZE:]
+        if len(chunk) > settings.CHAT_UPLOAD_CHUNK_SIZE or self.received + len(chunk) > self.size:
+            raise UploadError("Upload chunk too large.", self.received)
+
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.received += len(chunk)
+        if self.complete:
+            self.file.close()
+        return self.received
+
+    def open(self):
+        """
+        Return the finished upload as a ``File`` to save into a ``FileField``.
+        """
+        file = UploadedFile(open(self.file.name, "rb"), name=self.name)
+        # Spares ContentAddressedStorage hashing it again
+        file.sha256 = self.sha256
+        return file
+
+    def discard(self):
+        """
+        Close and delete the temporary file, if it was not moved into storage.
+        """
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except FileNotFoundError:
+            pass
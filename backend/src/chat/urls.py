@@ -15,4 +15,14 @@ urlpatterns = [
         views.MessageListCreateAPIView.as_view(),
         name="message-list-create",
     ),
+    path(
+        "extraction-cache/",
+        views.ExtractionCacheStatsAPIView.as_view(),
+        name="extraction-cache-stats",
+    ),
+    path(
+        "llm-queue/",
+        views.LLMQueueStatsAPIView.as_view(),
+        name="llm-queue-stats",
+    ),
 ]
@@ -1,9 +1,39 @@
+import hashlib
+
 from django.shortcuts import render
-from rest_framework import generics
+from django.utils.http import parse_etags
+from rest_framework import generics, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from src import permissions
+from src.service.limiter import get_limiter
+
+from .cache import (
+    EXTRACTION_HITS,
+    EXTRACTION_MISSES,
+    get_counters,
+    get_messages_page,
+    get_messages_version,
+    messages_page_key,
+    set_messages_page,
+)
+from .models import Chat, ExtractedText, Message
+from .pagination import ChatCursorPagination, get_message_paginator
+from .serializers import (
+    ChatSerializerNoRef,
+    MessageSerializer,
+    MessageValuesSerializer,
+)
+from .workers import queue_extraction
+
 
-from .models import Chat, Message
-from .serializers import ChatSerializerNoRef, MessageSerializer
+def etag_matches(etag, if_none_match):
+    """
+    Tell whether ``etag`` is one of the tags of an ``If-None-Match`` header,
+    compared weakly as the header requires.
+    """
+    etags = [tag.removeprefix("W/") for tag in parse_etags(if_none_match)]
+    return "*" in etags or etag.removeprefix("W/") in etags
 
 
 def index(request):
@@ -17,9 +47,11 @@ def room(request, room_name):
 class ChatListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = ChatSerializerNoRef
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ChatCursorPagination
 
     def get_queryset(self):
-        return Chat.objects.filter(user=self.request.user, messages__isnull=False).distinct()
+        # One query on the (user, -last_message_at) index, chats without messages have no activity
+        return Chat.objects.filter(user=self.request.user, last_message_at__isnull=False)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -29,11 +61,86 @@ class MessageListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            self._paginator = get_message_paginator(getattr(self, "request", None))
+        return self._paginator
+
     def get_queryset(self):
         chat_uuid = self.kwargs["chat_uuid"]
         return Message.objects.filter(chat__uuid=chat_uuid, chat__user=self.request.user).select_related("user")
 
+    def list(self, request, *args, **kwargs):
+        """
+        List a page of messages, from the cache while the chat is unchanged.
+
+        Pages are cached per chat version, which changes whenever one of its
+        messages is saved, so they never need to be invalidated one by one.
+        The version is also the ``ETag``, a client sending it back in
+        ``If-None-Match`` gets a 304 without any query or serialization.
+
+        """
+        chat_uuid = self.kwargs["chat_uuid"]
+        version = get_messages_version(chat_uuid)
+        if version is None:
+            # The cache is unavailable, nothing to validate an ETag against
+            return Response(self.list_values().data, headers={"Cache-Control": "private, no-cache"})
+
+        # The page depends on who asks, and on the query string and host the pagination links are built from
+        variant = hashlib.sha256(f"{request.user.pk}:{request.build_absolute_uri()}".encode()).hexdigest()
+        etag = f'"{version}-{variant[:16]}"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+        if etag_matches(etag, request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        key = messages_page_key(chat_uuid, version, variant)
+        data = get_messages_page(key)
+        if data is None:
+            data = self.list_values().data
+            set_messages_page(key, data)
+        return Response(data, headers=headers)
+
+    def list_values(self):
+        """
+        Paginate and serialize the messages as ``.values()`` rows, see
+        ``MessageValuesSerializer``.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).values(*MessageValuesSerializer.fields)
+        page = self.paginate_queryset(queryset)
+        serializer = MessageValuesSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
     def perform_create(self, serializer):
         chat_uuid = self.kwargs["chat_uuid"]
         chat = Chat.objects.get(uuid=chat_uuid)
-        serializer.save(chat=chat, user=self.request.user)
+        if serializer.validated_data.get("file"):
+            message = serializer.save(
+                chat=chat, user=self.request.user, extraction_status=Message.ExtractionStatus.PENDING
+            )
+            queue_extraction(message)
+        else:
+            serializer.save(chat=chat, user=self.request.user)
+
+
+class ExtractionCacheStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        counters = get_counters(EXTRACTION_HITS, EXTRACTION_MISSES)
+        return Response(
+            {
+                "hits": counters[EXTRACTION_HITS],
+                "misses": counters[EXTRACTION_MISSES],
+                "entries": ExtractedText.objects.count(),
+            }
+        )
+
+
+class LLMQueueStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        limiter = get_limiter()
+        return Response(limiter.stats() if limiter else {})
@@ -0,0 +1,110 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.consumer import SyncConsumer
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from src import codec
+
+from .cache import bump_messages_version
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# Channel the extraction worker listens on, run it with
+# ``python manage.py runworker chat-extraction``.
+EXTRACTION_CHANNEL = "chat-extraction"
+
+
+def queue_extraction(message, reply_channel=None, **extra):
+    """
+    Queue text extraction of ``message.file`` on the extraction worker.
+
+    When ``reply_channel`` is given, the worker sends an ``extraction.done``
+    event to it once the text is stored; ``extra`` is passed back unchanged.
+
+    Returns False, with the extraction marked failed, if the queue is full.
+
+    """
+    try:
+        async_to_sync(get_channel_layer().send)(
+            EXTRACTION_CHANNEL,
+            extraction_event(message, reply_channel, **extra),
+        )
+    except ChannelFull:
+        fail_extraction(message)
+        return False
+    return True
+
+
+def extraction_event(message, reply_channel=None, **extra):
+    return {
+        "type": "extract.text",
+        "message": str(message.uuid),
+        "chat": str(message.chat.uuid),
+        "reply_channel": reply_channel,
+        **extra,
+    }
+
+
+def fail_extraction(message):
+    """
+    Mark the extraction of ``message`` failed, it could not be queued.
+    """
+    logger.warning("Extraction queue full, not extracting the file of message %s", message.uuid)
+    message.extraction_status = Message.ExtractionStatus.FAILED
+    Message.objects.filter(pk=message.pk).update(extraction_status=message.extraction_status)
+    message.invalidate_chat_cache()
+
+
+class ExtractionConsumer(SyncConsumer):
+    """
+    Background worker that extracts text from uploaded message files.
+    """
+
+    def extract_text(self, event):
+        message = Message.objects.select_related("chat").filter(uuid=event["message"]).first()
+        if message is None:
+            self.extraction_lost(event)
+            return
+
+        try:
+            message.extract_file_text()
+        except Exception:
+            logger.exception("Error extracting text from message %s", message.uuid)
+            message.extraction_status = Message.ExtractionStatus.FAILED
+            Message.objects.filter(pk=message.pk).update(extraction_status=message.extraction_status)
+            message.invalidate_chat_cache()
+
+        if event.get("reply_channel"):
+            async_to_sync(self.channel_layer.send)(
+                event["reply_channel"],
+                {**event, "type": "extraction.done"},
+            )
+        else:
+            # Nobody waits on it (an API upload, or re-queued), still update the open sockets of the room
+            self.send_extracted(message.chat.uuid, message.uuid, message.extraction_status)
+
+    def extraction_lost(self, event):
+        """
+        Tell the room that the message of ``event`` is gone, deleted since it
+        was queued, so its sockets stop waiting on the extraction.
+        """
+        logger.warning("Message %s to extract the file of does not exist", event["message"])
+        chat_uuid = event.get("chat")
+        if chat_uuid is None:
+            # Queued before events carried their chat
+            return
+        bump_messages_version(chat_uuid)
+        self.send_extracted(chat_uuid, event["message"], Message.ExtractionStatus.FAILED)
+
+    def send_extracted(self, chat_uuid, message_uuid, extraction_status):
+        frame = {
+            "type": "chat.message.extracted",
+            "uuid": message_uuid,
+            "extraction_status": extraction_status,
+        }
+        async_to_sync(self.channel_layer.group_send)(
+            f"chat_{chat_uuid}",
+            {"type": "chat.message", "text": codec.dumps_text(frame)},
+        )
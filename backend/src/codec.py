@@ -0,0 +1,47 @@
+"""
+JSON encoding shared by the REST API and the chat sockets.
+
+Backed by orjson when it is installed, by the standard library otherwise.
+Both encode UUIDs, datetimes (``Z`` for UTC, like DRF), dates and times
+natively, and hand any other type to DRF's encoder, so ``serializer.data``
+and plain model values can be dumped as they are.
+
+"""
+
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+if orjson is not None:
+
+    def dumps(obj):
+        """
+        Encode ``obj`` to UTF-8 JSON bytes.
+        """
+        return orjson.dumps(obj, default=_encoder.default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+
+else:
+
+    def dumps(obj):
+        """
+        Encode ``obj`` to UTF-8 JSON bytes.
+        """
+        return _encoder.encode(obj).encode()
+
+    loads = json.loads
+
+
+def dumps_text(obj):
+    """
+    Encode ``obj`` to a JSON string, for WebSocket text frames.
+    """
+    return dumps(obj).decode()
@@ -1,28 +1,59 @@
+from urllib.parse import unquote_plus
+
 import jwt
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from django.contrib.auth.models import AnonymousUser
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ValidationError
+from src.user import cache
 from src.user.models import User
 
 from backend.settings import SECRET_KEY, SIMPLE_JWT
 
 
-@database_sync_to_async
-def get_user(token_key):
+def query_param(query_string, name):
+    """
+    Return the first value of ``name`` in a raw ASGI query string, or None.
+
+    Only the matching pair is decoded, ``a=1&token=x%2By&b`` gives ``x+y`` for ``token``.
+
+    """
+    name = name.encode()
+    for pair in query_string.split(b"&"):
+        key, _, value = pair.partition(b"=")
+        if key == name:
+            return unquote_plus(value.decode("latin-1"))
+    return None
+
+
+async def get_user(token_key):
+    """
+    Return the active user ``token_key`` was issued to, or an anonymous user.
+
+    Users come from ``src.user.cache``, so reconnecting sockets of a known
+    user do not query the database.
+
+    """
     try:
-        user_id: int = jwt.decode(token_key, SECRET_KEY, algorithms=[SIMPLE_JWT["ALGORITHM"]]).get(
+        user_id = jwt.decode(token_key, SECRET_KEY, algorithms=[SIMPLE_JWT["ALGORITHM"]]).get(
             SIMPLE_JWT["USER_ID_CLAIM"]
         )
-    except jwt.exceptions.DecodeError:
+        # The claim may be a string, cache entries are keyed by the pk itself
+        user_id = None if user_id is None else User._meta.pk.to_python(user_id)
+    except (jwt.exceptions.InvalidTokenError, ValidationError):
         return AnonymousUser()
-    except jwt.exceptions.ExpiredSignatureError:
-        return AnonymousUser()
-    try:
-        return AnonymousUser() if user_id is None else User.objects.get(id=user_id)
-    except ObjectDoesNotExist:
+    if user_id is None:
         return AnonymousUser()
 
+    user = cache.get_local_user(user_id)
+    if user is None:
+        try:
+            user = await database_sync_to_async(cache.get_user)(user_id)
+        except User.DoesNotExist:
+            return AnonymousUser()
+    # Like simplejwt's default USER_AUTHENTICATION_RULE
+    return user if user.is_active else AnonymousUser()
+
 
 class TokenAuthMiddleware(BaseMiddleware):
     def __init__(self, inner):
@@ -30,9 +61,6 @@ class TokenAuthMiddleware(BaseMiddleware):
 
     async def __call__(self, scope, receive, send):
         if "user" not in scope or scope["user"].is_anonymous:
-            try:
-                token_key = (dict((x.split("=") for x in scope["query_string"].decode().split("&")))).get("token", None)
-            except ValueError:
-                token_key = None
-            scope["user"] = AnonymousUser() if token_key is None else await get_user(token_key)
+            token_key = query_param(scope["query_string"], "token")
+            scope["user"] = AnonymousUser() if not token_key else await get_user(token_key)
         return await super().__call__(scope, receive, send)
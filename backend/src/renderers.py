@@ -0,0 +1,20 @@
+from rest_framework import renderers
+from src import codec
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer on top of ``src.codec``, several times faster than DRF's with
+    orjson installed.
+
+    Indented output, asked for with ``; indent=`` in the ``Accept`` header or by
+    the browsable API, is left to DRF's renderer.
+
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return codec.dumps(data)
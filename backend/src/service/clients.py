@@ -0,0 +1,54 @@
+"""
+Shared clients of the external services.
+
+Sharing one client shares its connection pool, so the TLS handshake to a service
+is paid once per connection instead of once per caller.
+
+"""
+
+import asyncio
+import functools
+import threading
+import weakref
+
+
+def process_client(factory):
+    """
+    Turn ``factory`` into a function returning the one client it builds for the
+    whole process.
+
+    The function's ``cache_clear`` drops the client, so the next call builds a
+    new one.
+
+    """
+    cached = functools.cache(factory)
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get():
+        # Alone, functools.cache lets every thread racing for the first call build its own client
+        with lock:
+            return cached()
+
+    get.cache_clear = cached.cache_clear
+    return get
+
+
+def loop_client(factory):
+    """
+    Turn ``factory`` into a function returning the client it builds for the
+    running event loop, shared by everything running on it.
+    """
+    # httpx async pools are bound to the event loop they were opened on
+    clients = weakref.WeakKeyDictionary()
+
+    @functools.wraps(factory)
+    def get():
+        loop = asyncio.get_running_loop()
+        client = clients.get(loop)
+        if client is None:
+            client = clients[loop] = factory()
+        return client
+
+    get.cache_clear = clients.clear
+    return get
@@ -0,0 +1,105 @@
+import math
+
+from django.conf import settings
+
+# Chat templates wrap every message in a few special tokens.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+TRUNCATION_MARKER = "\n[... {omitted} characters omitted ...]\n"
+
+
+def truncate_text(text, max_chars):
+    """
+    Cut ``text`` to about ``max_chars`` characters, keeping its head and tail.
+
+    Tax forms carry most of their data up front, so two thirds of the budget go
+    to the head.
+
+    """
+    if len(text) <= max_chars:
+        return text
+    head_end = max_chars * 2 // 3
+    tail_start = len(text) - (max_chars - head_end)
+    return text[:head_end] + TRUNCATION_MARKER.format(omitted=tail_start - head_end) + text[tail_start:]
+
+
+class TokenEstimator:
+    """
+    Estimate token counts from character counts.
+
+    Starts from the usual ~4 characters per token of Llama tokenizers on
+    English text and is calibrated against the ``prompt_tokens`` reported by
+    the API, since OCR'd forms full of numbers tokenize much denser.
+
+    """
+
+    def __init__(self, chars_per_token=4.0, smoothing=0.2):
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+
+    def count(self, text):
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count_message(self, message):
+        return self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def calibrate(self, messages, prompt_tokens):
+        """
+        Move the ratio towards the one observed for a prompt of
+        ``prompt_tokens``.
+        """
+        chars = sum(len(message["content"]) for message in messages)
+        tokens = prompt_tokens - MESSAGE_OVERHEAD_TOKENS * len(messages)
+        if chars <= 0 or tokens <= 0:
+            return
+        observed = chars / tokens
+        self.chars_per_token += self.smoothing * (observed - self.chars_per_token)
+
+
+# Shared by all sessions, calibration is a property of the model, not of a chat.
+estimator = TokenEstimator()
+
+
+class ContextWindow:
+    """
+    Fit a conversation into a token budget.
+
+    The system prompt is always kept. Any message longer than
+    ``document_tokens`` (typically a whole OCR'd document) is cut down to its
+    head and tail, then the most recent messages are kept until the budget is
+    spent.
+
+    """
+
+    def __init__(self, budget=None, document_tokens=None, estimator=estimator):
+        self.budget = budget or settings.LLM_CONTEXT_TOKENS - settings.LLM_MAX_TOKENS
+        self.document_tokens = document_tokens or settings.LLM_DOCUMENT_TOKENS
+        self.estimator = estimator
+
+    def truncate(self, text, tokens):
+        """
+        Cut ``text`` to about ``tokens`` tokens, keeping its head and tail.
+        """
+        return truncate_text(text, int(tokens * self.estimator.chars_per_token))
+
+    def fit(self, messages):
+        """
+        Return the messages to send, ``messages[0]`` being the system prompt.
+        """
+        system, history = messages[0], messages[1:]
+        remaining = self.budget - self.estimator.count_message(system)
+
+        fitted = []
+        for message in reversed(history):
+            message = {**message, "content": self.truncate(message["content"], self.document_tokens)}
+            tokens = self.estimator.count_message(message)
+            if tokens > remaining:
+                if fitted:
+                    break
+                # Always send the latest message, cut down to whatever is left
+                message["content"] = self.truncate(message["content"], max(remaining - MESSAGE_OVERHEAD_TOKENS, 0))
+                tokens = remaining
+            fitted.append(message)
+            remaining -= tokens
+
+        return [system] + fitted[::-1]
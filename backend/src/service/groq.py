@@ -1,53 +1,84 @@
-# flake8: noqa E501
-
+import httpx
 from django.conf import settings
-from groq import Groq
-
-
-class GroqService:
-    messages = [
-        {
-            "role": "system",
-            "content": "You are a large language model trained on a massive dataset of tax documents and financial information."
-            + " You can access and process anonymized W2 data to answer user queries about their income, taxes withheld, and other relevant details."
-            + " You can understand natural language questions and respond in a clear, concise, and informative way."
-            + " You prioritize data privacy and security, ensuring that no sensitive information is revealed in your responses."
-            + " You should hide any sensitive information such as social security numbers, addresses, or other personal details.",
-        }
-    ]
-
-    def __init__(self, messages=[]):
-        self.client = Groq(
-            api_key=settings.GROQ_API_KEY,
-        )
+from groq import AsyncGroq, Groq
+
+from .clients import loop_client, process_client
+from .llm import Completion, LLMProvider
+
+
+def http_limits():
+    return httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+
 
-        self.messages = self.messages + messages
+def http_timeout():
+    return httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
 
-    def complete_chat_message(self, message):
-        """
-        Completes a chat message using Groq.
 
-        Args:
-            message_content (str): The content of the chat message.
+@process_client
+def get_client():
+    """
+    Return the process-wide Groq client.
+    """
+    return Groq(
+        api_key=settings.GROQ_API_KEY,
+        base_url=settings.GROQ_BASE_URL,
+        timeout=http_timeout(),
+        max_retries=settings.LLM_MAX_RETRIES,
+        http_client=httpx.Client(limits=http_limits(), timeout=http_timeout()),
+    )
 
-        Returns:
-            str: The completion message generated by Groq.
 
-        """
-        self.messages.append({"role": "user", "content": message})
+@loop_client
+def get_async_client():
+    """
+    Return the async Groq client shared by all consumers of the running event
+    loop.
+    """
+    return AsyncGroq(
+        api_key=settings.GROQ_API_KEY,
+        base_url=settings.GROQ_BASE_URL,
+        timeout=http_timeout(),
+        max_retries=settings.LLM_MAX_RETRIES,
+        http_client=httpx.AsyncClient(limits=http_limits(), timeout=http_timeout()),
+    )
 
-        chat_completion = self.client.chat.completions.create(
-            messages=self.messages,
-            model="llama3-8b-8192",
+
+class GroqProvider(LLMProvider):
+    """
+    Chat completions from the Groq API, through the shared client of the running
+    loop.
+    """
+
+    async def complete(self, messages, max_tokens):
+        chat_completion = await get_async_client().chat.completions.create(
+            messages=messages,
+            model=self.model,
             temperature=1,
-            max_tokens=1024,
+            max_tokens=max_tokens,
             top_p=1,
             stop=None,
             stream=False,
         )
 
-        completion_message = chat_completion.choices[0].message.content
+        usage = chat_completion.usage
+        return Completion(chat_completion.choices[0].message.content, usage.prompt_tokens if usage else None)
 
-        self.messages.append({"role": "assistant", "content": completion_message})
+    async def stream(self, messages, max_tokens):
+        stream = await get_async_client().chat.completions.create(
+            messages=messages,
+            model=self.model,
+            temperature=1,
+            max_tokens=max_tokens,
+            top_p=1,
+            stop=None,
+            stream=True,
+        )
 
-        return completion_message
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
@@ -0,0 +1,320 @@
+"""
+Process-independent limits on LLM calls, kept in Redis.
+
+Every call takes a slot of a global semaphore (``LLM_CONCURRENCY``) and a
+token of a global token bucket (``LLM_RATE_LIMIT_RPM``), so all Daphne
+processes together stay under the provider's limits. Calls that cannot run
+yet wait in a bounded queue ordered by start-time fair queuing: each user's
+n-th waiting call is scheduled n steps after the last granted one, so one
+user sending a burst of messages cannot push everyone else back.
+
+Slots and waiters are leases, a crashed process loses its place after
+``LLM_SLOT_LEASE`` or ``LLM_QUEUE_HEARTBEAT`` seconds.
+
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+WAIT_SAMPLES = 1000
+
+# KEYS: queue, waiting, heartbeats, user_last, vclock, seq
+# ARGV: ticket, user, now_ms, queue_max, user_queue_max, heartbeat_ms
+ENQUEUE = """
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then return -1 end
+if tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or '0') >= tonumber(ARGV[5]) then return -2 end
+local vclock = tonumber(redis.call('GET', KEYS[5]) or '0')
+local last = tonumber(redis.call('HGET', KEYS[4], ARGV[2]) or '0')
+local seq = redis.call('INCR', KEYS[6]) % 100000000
+local score = math.floor(math.max(vclock, last)) + 1
+redis.call('HSET', KEYS[4], ARGV[2], score)
+redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+redis.call('ZADD', KEYS[1], score + seq / 1000000000, ARGV[1])
+redis.call('ZADD', KEYS[3], tonumber(ARGV[3]) + tonumber(ARGV[6]), ARGV[1])
+return redis.call('ZRANK', KEYS[1], ARGV[1])
+"""
+
+# Shared by LEAVE and ACQUIRE: drop a waiter, forgetting its user once it has none left.
+DEQUEUE = """
+local function dequeue(ticket)
+  redis.call('ZREM', KEYS[3], ticket)
+  if redis.call('ZREM', KEYS[1], ticket) == 0 then return end
+  local user = string.match(ticket, '^(.-):')
+  if redis.call('HINCRBY', KEYS[2], user, -1) <= 0 then
+    redis.call('HDEL', KEYS[2], user)
+    redis.call('HDEL', KEYS[4], user)
+  end
+end
+"""
+
+# KEYS: queue, waiting, heartbeats, user_last
+# ARGV: ticket
+LEAVE = DEQUEUE + "dequeue(ARGV[1])"
+
+# KEYS: queue, waiting, heartbeats, user_last, vclock, holders, bucket
+# ARGV: ticket, now_ms, concurrency, lease_ms, heartbeat_ms, tokens_per_ms, burst
+# Returns {granted, rank, retry_ms}, rank is -1 once the waiter lease expired.
+ACQUIRE = (
+    DEQUEUE
+    + """
+local now = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[6], '-inf', now)
+for _, ticket in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+  dequeue(ticket)
+end
+
+local rank = redis.call('ZRANK', KEYS[1], ARGV[1])
+if not rank then return {0, -1, 0} end
+redis.call('ZADD', KEYS[3], now + tonumber(ARGV[5]), ARGV[1])
+
+if rank >= tonumber(ARGV[3]) - redis.call('ZCARD', KEYS[6]) then return {0, rank, 0} end
+
+local rate = tonumber(ARGV[6])
+if rate > 0 then
+  local burst = tonumber(ARGV[7])
+  local bucket = redis.call('HMGET', KEYS[7], 'tokens', 'ts')
+  local tokens = tonumber(bucket[1]) or burst
+  tokens = math.min(burst, tokens + (now - (tonumber(bucket[2]) or now)) * rate)
+  redis.call('HSET', KEYS[7], 'tokens', tostring(tokens), 'ts', now)
+  if tokens < 1 then return {0, rank, math.ceil((1 - tokens) / rate)} end
+  redis.call('HSET', KEYS[7], 'tokens', tostring(tokens - 1))
+end
+
+redis.call('SET', KEYS[5], redis.call('ZSCORE', KEYS[1], ARGV[1]))
+dequeue(ARGV[1])
+redis.call('ZADD', KEYS[6], now + tonumber(ARGV[4]), ARGV[1])
+return {1, rank, 0}
+"""
+)
+
+
+class QueueFull(Exception):
+    """
+    The LLM queue is full, or the wait for a slot timed out.
+    """
+
+
+class LLMLimiter:
+    """
+    Fair, bounded queue in front of a Redis semaphore and token bucket.
+
+    Usage::
+
+        async with limiter.slot(user.pk, on_wait=report_position):
+            await provider.complete(...)
+
+    """
+
+    def __init__(self):
+        self.concurrency = settings.LLM_CONCURRENCY
+        self.tokens_per_ms = settings.LLM_RATE_LIMIT_RPM / 60_000
+        self.burst = settings.LLM_RATE_LIMIT_BURST
+        self.queue_max = settings.LLM_QUEUE_MAX
+        self.user_queue_max = settings.LLM_USER_QUEUE_MAX
+        self.timeout = settings.LLM_QUEUE_TIMEOUT
+        self.lease_ms = int(settings.LLM_SLOT_LEASE * 1000)
+        self.heartbeat_ms = int(settings.LLM_QUEUE_HEARTBEAT * 1000)
+        self.poll_interval = settings.LLM_QUEUE_POLL_INTERVAL
+
+        self.keys = {
+            name: cache.make_key(f"llm:limiter:{name}")
+            for name in (
+                "queue",
+                "waiting",
+                "heartbeats",
+                "user_last",
+                "vclock",
+                "seq",
+                "holders",
+                "bucket",
+                "waits",
+                "granted",
+                "rejected",
+            )
+        }
+
+        redis = get_redis_connection("default")
+        self._enqueue = redis.register_script(ENQUEUE)
+        self._leave = redis.register_script(LEAVE)
+        self._acquire = redis.register_script(ACQUIRE)
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    def _keys(self, *names):
+        return [self.keys[name] for name in names]
+
+    def enqueue(self, ticket, user):
+        """
+        Queue ``ticket``, returning its rank or -1 (queue full) or -2 (user
+        queue full).
+        """
+        return self._enqueue(
+            keys=self._keys("queue", "waiting", "heartbeats", "user_last", "vclock", "seq"),
+            args=[ticket, user, int(time.time() * 1000), self.queue_max, self.user_queue_max, self.heartbeat_ms],
+        )
+
+    def acquire(self, ticket):
+        """
+        Try to turn the queued ``ticket`` into a slot.
+
+        Returns ``(granted, rank, retry_ms)``.
+
+        """
+        return self._acquire(
+            keys=self._keys("queue", "waiting", "heartbeats", "user_last", "vclock", "holders", "bucket"),
+            args=[
+                ticket,
+                int(time.time() * 1000),
+                self.concurrency,
+                self.lease_ms,
+                self.heartbeat_ms,
+                self.tokens_per_ms,
+                self.burst,
+            ],
+        )
+
+    def leave(self, ticket):
+        self._leave(keys=self._keys("queue", "waiting", "heartbeats", "user_last"), args=[ticket])
+
+    def release(self, ticket):
+        self.redis.zrem(self.keys["holders"], ticket)
+
+    def record_wait(self, wait_ms):
+        pipeline = self.redis.pipeline()
+        pipeline.lpush(self.keys["waits"], round(wait_ms, 1))
+        pipeline.ltrim(self.keys["waits"], 0, WAIT_SAMPLES - 1)
+        pipeline.incr(self.keys["granted"])
+        pipeline.execute()
+
+    def record_rejection(self):
+        self.redis.incr(self.keys["rejected"])
+
+    def stats(self):
+        """
+        Return the current load and the queue wait times of the last calls, in
+        milliseconds.
+        """
+        pipeline = self.redis.pipeline()
+        pipeline.zcard(self.keys["holders"])
+        pipeline.zcard(self.keys["queue"])
+        pipeline.lrange(self.keys["waits"], 0, -1)
+        pipeline.get(self.keys["granted"])
+        pipeline.get(self.keys["rejected"])
+        in_flight, queued, waits, granted, rejected = pipeline.execute()
+
+        waits = sorted(float(wait) for wait in waits)
+
+        def rank(pct):
+            return waits[max(1, math.ceil(pct / 100 * len(waits))) - 1] if waits else 0.0
+
+        return {
+            "in_flight": in_flight,
+            "queued": queued,
+            "granted": int(granted or 0),
+            "rejected": int(rejected or 0),
+            "wait_p50": rank(50),
+            "wait_p99": rank(99),
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+    @asynccontextmanager
+    async def slot(self, user, on_wait=None):
+        """
+        Wait for a slot for ``user``, calling ``on_wait(position)`` whenever the
+        queue position changes.
+
+        Fails open: while Redis is unavailable, calls run without a slot
+        rather than failing.
+
+        Raises:
+            QueueFull: If the queue is full or the wait exceeded ``LLM_QUEUE_TIMEOUT``.
+
+        """
+        ticket = f"{user}:{uuid.uuid4().hex}"
+        call = functools.partial(sync_to_async, thread_sensitive=False)
+
+        try:
+            wait_ms = await self.wait(ticket, user, on_wait)
+        except RedisError as e:
+            # Scripts flushed by a restart are reloaded by redis-py, this is Redis being down
+            logger.warning("LLM limiter unavailable, calling the LLM without a slot: %r", e)
+            wait_ms = None
+
+        if wait_ms is None:
+            yield 0.0
+            return
+
+        try:
+            yield wait_ms
+        finally:
+            try:
+                await call(self.release)(ticket)
+            except RedisError as e:
+                logger.warning("Could not release LLM slot %s, it expires with its lease: %r", ticket, e)
+
+    async def wait(self, ticket, user, on_wait=None):
+        """
+        Queue ``ticket`` and wait until it holds a slot, returning the wait in
+        milliseconds.
+        """
+        call = functools.partial(sync_to_async, thread_sensitive=False)
+        start = time.perf_counter()
+
+        rank = await call(self.enqueue)(ticket, user)
+        if rank < 0:
+            await call(self.record_rejection)()
+            raise QueueFull("Too many of your messages are waiting." if rank == -2 else "The assistant is busy.")
+
+        position = None
+        try:
+            while True:
+                granted, rank, retry_ms = await call(self.acquire)(ticket)
+                if granted:
+                    break
+                if rank < 0 or time.perf_counter() - start > self.timeout:
+                    await call(self.record_rejection)()
+                    raise QueueFull("The assistant is busy.")
+                if on_wait is not None and rank + 1 != position:
+                    position = rank + 1
+                    await on_wait(position)
+                await asyncio.sleep(max(retry_ms / 1000, self.poll_interval))
+        except BaseException:
+            try:
+                await call(self.leave)(ticket)
+            except RedisError as e:
+                # Not in place of what is being raised (e.g. a cancellation), the waiter lease expires
+                logger.warning("Could not leave the LLM queue: %r", e)
+            raise
+
+        wait_ms = (time.perf_counter() - start) * 1000
+        try:
+            await call(self.record_wait)(wait_ms)
+        except RedisError as e:
+            # The slot is held, losing a statistic is no reason to give it up
+            logger.warning("Could not record LLM queue wait: %r", e)
+        if position is not None:
+            logger.info("LLM slot for user %s after %.0fms in the queue", user, wait_ms)
+        return wait_ms
+
+
+@functools.cache
+def get_limiter():
+    """
+    Return the process-wide LLM limiter, or None unless ``LLM_LIMITER`` is on.
+    """
+    return LLMLimiter() if settings.LLM_LIMITER else None
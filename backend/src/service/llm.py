@@ -0,0 +1,158 @@
+# flake8: noqa E501
+
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .context import ContextWindow
+from .limiter import get_limiter
+from .response_cache import get_response_cache
+from .session import ChatSession
+
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a large language model trained on a massive dataset of tax documents and financial information."
+    + " You can access and process anonymized W2 data to answer user queries about their income, taxes withheld, and other relevant details."
+    + " You can understand natural language questions and respond in a clear, concise, and informative way."
+    + " You prioritize data privacy and security, ensuring that no sensitive information is revealed in your responses."
+    + " You should hide any sensitive information such as social security numbers, addresses, or other personal details.",
+}
+
+
+class Completion(NamedTuple):
+    content: str
+    prompt_tokens: int | None = None
+
+
+class LLMProvider(ABC):
+    """
+    Interface of the chat completion backends.
+
+    ``settings.LLM_PROVIDER`` holds the dotted path of the implementation,
+    ``settings.LLM_MODEL`` the model it is asked for.
+
+    """
+
+    def __init__(self, model=None):
+        self.model = model or settings.LLM_MODEL
+
+    @abstractmethod
+    async def complete(self, messages, max_tokens):
+        """
+        Return the ``Completion`` of ``messages``.
+        """
+
+    @abstractmethod
+    async def stream(self, messages, max_tokens):
+        """
+        Yield the completion of ``messages`` as text deltas.
+        """
+
+
+def get_provider():
+    return import_string(settings.LLM_PROVIDER)()
+
+
+class LLMService:
+    """
+    Conversation of a single chat socket with the configured LLM provider.
+
+    Provider calls wait for a slot of the LLM limiter on behalf of ``user``,
+    ``on_queue(position)`` is awaited while they are queued.
+
+    """
+
+    __slots__ = ("provider", "session", "context", "cache", "limiter", "user", "on_queue")
+
+    def __init__(self, messages=(), provider=None, user=None, on_queue=None):
+        self.provider = provider or get_provider()
+        self.session = ChatSession(messages)
+        self.context = ContextWindow()
+        self.cache = get_response_cache()
+        self.limiter = get_limiter()
+        self.user = user
+        self.on_queue = on_queue
+
+    def slot(self):
+        if self.limiter is None:
+            return nullcontext()
+        return self.limiter.slot(self.user, self.on_queue)
+
+    async def cached_reply(self, message, history):
+        if self.cache is None:
+            return None
+        return await sync_to_async(self.cache.get, thread_sensitive=False)(message, history)
+
+    async def cache_reply(self, message, history, reply):
+        if self.cache is not None and reply:
+            await sync_to_async(self.cache.set, thread_sensitive=False)(message, history, reply)
+
+    async def complete_chat_message(self, message):
+        """
+        Completes a chat message.
+
+        Args:
+            message (str): The content of the chat message.
+
+        Returns:
+            str: The completion message generated by the LLM.
+
+        """
+        # Replies may draw on any earlier turn, the cache is keyed on all of them
+        history = self.session.messages()
+        self.session.append("user", message)
+
+        reply = await self.cached_reply(message, history)
+        if reply is not None:
+            self.session.append("assistant", reply)
+            return reply
+
+        messages = self.context.fit([SYSTEM_MESSAGE] + self.session.messages())
+
+        async with self.slot():
+            completion = await self.provider.complete(messages, max_tokens=settings.LLM_MAX_TOKENS)
+
+        if completion.prompt_tokens:
+            self.context.estimator.calibrate(messages, completion.prompt_tokens)
+
+        self.session.append("assistant", completion.content)
+        await self.cache_reply(message, history, completion.content)
+
+        return completion.content
+
+    async def stream_chat_message(self, message):
+        """
+        Streams a chat message completion.
+
+        Args:
+            message (str): The content of the chat message.
+
+        Yields:
+            str: Completion deltas as the LLM produces them. The assembled
+                message is added to the history once the stream ends.
+
+        """
+        history = self.session.messages()
+        self.session.append("user", message)
+
+        reply = await self.cached_reply(message, history)
+        if reply is not None:
+            self.session.append("assistant", reply)
+            yield reply
+            return
+
+        messages = self.context.fit([SYSTEM_MESSAGE] + self.session.messages())
+
+        parts = []
+        async with self.slot():
+            async for delta in self.provider.stream(messages, max_tokens=settings.LLM_MAX_TOKENS):
+                parts.append(delta)
+                yield delta
+
+        reply = "".join(parts)
+        self.session.append("assistant", reply)
+        await self.cache_reply(message, history, reply)
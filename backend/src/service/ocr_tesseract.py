@@ -1,44 +1,265 @@
-import requests
+"""
+Client of the OCR service.
+
+All calls share one connection pool per process (and per event loop for the
+``a``-prefixed async variants), so consecutive uploads reuse kept-alive
+connections. Files given by path are streamed from disk in chunks rather
+than read whole, or with ``OCR_SHARED_MEDIA``, not sent at all when they are
+under ``MEDIA_ROOT``: the service reads them from the media volume it shares
+with the backend. Connection errors, timeouts and 429/5xx responses are
+retried ``OCR_MAX_RETRIES`` times with exponential backoff and full jitter.
+
+Every call returns None when the service answers with an error.
+
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import ExitStack
+
+import httpx
 from django.conf import settings
 
-OCR_API_BASE_URL = settings.OCR_API_BASE_URL
+from .clients import loop_client, process_client
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Query parameter of the filepath endpoint of each upload endpoint
+SHARED_PATH_PARAMS = {"/ocr/image/": "file_path", "/ocr/pdf/": "pdf_path"}
+# Answers of the filepath endpoints to a file they cannot read, or that changed, where uploading it still works
+SHARED_FALLBACK_STATUSES = {403, 404, 409}
+
+
+def http_limits():
+    return httpx.Limits(
+        max_connections=settings.OCR_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OCR_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OCR_KEEPALIVE_EXPIRY,
+    )
+
+
+def http_timeout():
+    return httpx.Timeout(settings.OCR_TIMEOUT, connect=settings.OCR_CONNECT_TIMEOUT)
+
+
+@process_client
+def get_client():
+    """
+    Return the process-wide OCR client.
+    """
+    return httpx.Client(base_url=settings.OCR_API_BASE_URL, limits=http_limits(), timeout=http_timeout())
+
+
+@loop_client
+def get_async_client():
+    """
+    Return the async OCR client shared by everything running on the current
+    event loop.
+    """
+    return httpx.AsyncClient(base_url=settings.OCR_API_BASE_URL, limits=http_limits(), timeout=http_timeout())
 
 
-def ocr_image(image_path):
-    url = f"{OCR_API_BASE_URL}/ocr/image/filepath"
-    files = {"file": open(image_path, "rb")}
-    response = requests.post(url, files=files)
-    if response.status_code == 200:
-        return response.json()["text"]
-    else:
+def retry_delay(attempt):
+    """
+    Return the seconds to wait before retry ``attempt`` (0-based), drawn
+    uniformly up to an exponential cap.
+    """
+    return random.uniform(0, settings.OCR_RETRY_BACKOFF * 2**attempt)
+
+
+def _files(stack, file, filename, content_type):
+    """
+    Multipart ``files`` for ``file``, bytes or a path opened into ``stack`` so
+    httpx streams it.
+    """
+    if file is None:
         return None
+    if isinstance(file, (str, os.PathLike)):
+        filename = os.path.basename(file)
+        file = stack.enter_context(open(file, "rb"))
+    return {"file": (filename, file, content_type)}
+
+
+def _should_retry(response, attempt):
+    return response.status_code in RETRY_STATUSES and attempt < settings.OCR_MAX_RETRIES
 
 
-def ocr_pdf(pdf_path):
-    url = f"{OCR_API_BASE_URL}/ocr/pdf/filepath"
-    files = {"pdf_path": open(pdf_path, "rb")}
-    response = requests.post(url, files=files)
-    if response.status_code == 200:
-        return response.json()["text"]
-    else:
+def _result(response):
+    if response.status_code != 200:
+        logger.warning("OCR service answered %s %s: %s", response.status_code, response.url, response.text[:200])
         return None
+    return response.json()
 
 
-def ocr_pdf_from_bytes(pdf_bytes):
-    url = f"{OCR_API_BASE_URL}/ocr/pdf/"
-    files = {"file": ("pdf_file.pdf", pdf_bytes)}
-    response = requests.post(url, files=files)
-    if response.status_code == 200:
-        return response.json()["text"]
-    else:
+def shared_params(path, file, sha256=None):
+    """
+    Query referring the filepath variant of ``path`` to ``file`` on the shared
+    media volume.
+
+    None if ``OCR_SHARED_MEDIA`` is off or ``file`` is not a path under ``MEDIA_ROOT``.
+
+    """
+    if not settings.OCR_SHARED_MEDIA or not isinstance(file, (str, os.PathLike)) or not settings.MEDIA_ROOT:
+        return None
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    file = os.path.realpath(file)
+    if os.path.commonpath([root, file]) != root:
         return None
 
+    params = {SHARED_PATH_PARAMS[path]: os.path.relpath(file, root).replace(os.sep, "/")}
+    if sha256:
+        params["sha256"] = sha256
+    return params
+
+
+def send(path, file=None, filename=None, content_type=None, params=None):
+    """
+    POST ``file`` (a path, bytes or None for no body) to ``path`` of the OCR
+    service, returning the response.
+
+    Raises:
+        httpx.TransportError: If the service could not be reached, after all retries.
+
+    """
+    for attempt in range(settings.OCR_MAX_RETRIES + 1):
+        # Reopened on every attempt, a retried upload streams the file from its start
+        with ExitStack() as stack:
+            files = _files(stack, file, filename, content_type)
+            try:
+                response = get_client().post(path, files=files, params=params)
+            except httpx.TransportError as e:
+                if attempt == settings.OCR_MAX_RETRIES:
+                    raise
+                logger.info("Retrying OCR request to %s after %r", path, e)
+            else:
+                if not _should_retry(response, attempt):
+                    return response
+                logger.info("Retrying OCR request to %s after %s", path, response.status_code)
+        time.sleep(retry_delay(attempt))
+
+
+async def asend(path, file=None, filename=None, content_type=None, params=None):
+    """
+    Async ``send``.
+    """
+    for attempt in range(settings.OCR_MAX_RETRIES + 1):
+        with ExitStack() as stack:
+            files = _files(stack, file, filename, content_type)
+            try:
+                response = await get_async_client().post(path, files=files, params=params)
+            except httpx.TransportError as e:
+                if attempt == settings.OCR_MAX_RETRIES:
+                    raise
+                logger.info("Retrying OCR request to %s after %r", path, e)
+            else:
+                if not _should_retry(response, attempt):
+                    return response
+                logger.info("Retrying OCR request to %s after %s", path, response.status_code)
+        await asyncio.sleep(retry_delay(attempt))
+
+
+def _shared_failed(response, params):
+    if response.status_code not in SHARED_FALLBACK_STATUSES:
+        return False
+    logger.warning(
+        "OCR service could not read %s from the shared media (%s: %s), uploading it",
+        params,
+        response.status_code,
+        response.text[:200],
+    )
+    return True
+
+
+def post(path, file, filename, content_type, params=None, sha256=None):
+    """
+    Send ``file`` (a path or bytes) to ``path`` of the OCR service, returning
+    the JSON answer or None.
+
+    Files on the shared media volume are referred to by path (and ``sha256``,
+    which the service checks them against), and uploaded only if the service
+    cannot read them.
+
+    Raises:
+        httpx.TransportError: If the service could not be reached, after all retries.
+
+    """
+    shared = shared_params(path, file, sha256)
+    if shared is not None:
+        response = send(f"{path}filepath", params={**(params or {}), **shared})
+        if not _shared_failed(response, shared):
+            return _result(response)
+    return _result(send(path, file, filename, content_type, params))
+
+
+async def apost(path, file, filename, content_type, params=None, sha256=None):
+    """
+    Async ``post``.
+    """
+    shared = shared_params(path, file, sha256)
+    if shared is not None:
+        response = await asend(f"{path}filepath", params={**(params or {}), **shared})
+        if not _shared_failed(response, shared):
+            return _result(response)
+    return _result(await asend(path, file, filename, content_type, params))
+
+
+def _text(result):
+    return None if result is None else result["text"]
+
+
+def _pages(result):
+    return None if result is None else {int(page): text for page, text in result["pages"].items()}
+
+
+def _pages_param(pages):
+    return {"pages": ",".join(map(str, pages))}
+
+
+def ocr_image(image_path, sha256=None):
+    return _text(post("/ocr/image/", image_path, None, "application/octet-stream", sha256=sha256))
+
+
+def ocr_pdf(pdf_path, sha256=None):
+    return _text(post("/ocr/pdf/", pdf_path, None, "application/pdf", sha256=sha256))
+
+
+def ocr_pdf_from_bytes(pdf_bytes):
+    return _text(post("/ocr/pdf/", pdf_bytes, "pdf_file.pdf", "application/pdf"))
+
 
 def ocr_image_from_bytes(image_bytes):
-    url = f"{OCR_API_BASE_URL}/ocr/image/"
-    files = {"file": ("image_file.jpg", image_bytes)}
-    response = requests.post(url, files=files)
-    if response.status_code == 200:
-        return response.json()["text"]
-    else:
-        return None
+    return _text(post("/ocr/image/", image_bytes, "image_file.jpg", "image/jpeg"))
+
+
+def ocr_pdf_pages(pdf_path, pages, sha256=None):
+    """
+    OCR only the given 1-based ``pages`` of the PDF at ``pdf_path``, returns a
+    ``{page: text}`` dict.
+    """
+    return _pages(post("/ocr/pdf/", pdf_path, None, "application/pdf", params=_pages_param(pages), sha256=sha256))
+
+
+def ocr_pdf_pages_from_bytes(pdf_bytes, pages):
+    """
+    OCR only the given 1-based ``pages`` of a PDF, returns a ``{page: text}``
+    dict.
+    """
+    return _pages(post("/ocr/pdf/", pdf_bytes, "pdf_file.pdf", "application/pdf", params=_pages_param(pages)))
+
+
+async def aocr_image(image_path, sha256=None):
+    return _text(await apost("/ocr/image/", image_path, None, "application/octet-stream", sha256=sha256))
+
+
+async def aocr_pdf(pdf_path, sha256=None):
+    return _text(await apost("/ocr/pdf/", pdf_path, None, "application/pdf", sha256=sha256))
+
+
+async def aocr_pdf_pages(pdf_path, pages, sha256=None):
+    params = _pages_param(pages)
+    return _pages(await apost("/ocr/pdf/", pdf_path, None, "application/pdf", params=params, sha256=sha256))
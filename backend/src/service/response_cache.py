@@ -0,0 +1,212 @@
+"""
+Opt-in cache of LLM replies, shared by all chats through Redis.
+
+Replies are keyed on the normalized prompt and a hash of every earlier turn
+of the conversation, uploaded documents included, so the same first question
+about the same W2 (or about no document at all) is answered once, while a
+reply drawing on what a user said before is only ever served to the same
+conversation. Entries expire after
+``LLM_RESPONSE_CACHE_TTL`` and the least recently used ones are evicted past
+``LLM_RESPONSE_CACHE_MAX_ENTRIES``.
+
+With ``LLM_RESPONSE_CACHE_SIMILARITY`` set, each process also keeps the
+embeddings of recent prompts, so a rephrased question close enough to a
+cached one gets its reply too.
+
+"""
+
+import functools
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+PUNCTUATION = re.compile(r"[^\w\s]")
+EMBEDDING_BUCKETS = 1 << 16
+
+
+def normalize_prompt(text):
+    """
+    Lowercase ``text`` and drop punctuation and repeated whitespace.
+    """
+    return " ".join(PUNCTUATION.sub(" ", text.lower()).split())
+
+
+def context_hash(history):
+    """
+    Hash the ``{"role", "content"}`` turns of ``history``.
+    """
+    digest = hashlib.sha256()
+    for message in history:
+        digest.update(message["role"].encode())
+        digest.update(b"\0")
+        digest.update(message["content"].encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def embed(text):
+    """
+    Embed ``text`` as a unit sparse vector of hashed words and word pairs.
+
+    A cheap local stand-in for a sentence embedding: it does not know
+    synonyms, but it is robust to word order changes and filler words,
+    which is what most rephrased tax questions differ by.
+
+    """
+    words = text.split()
+    vector = {}
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        bucket = zlib.crc32(feature.encode()) % EMBEDDING_BUCKETS
+        vector[bucket] = vector.get(bucket, 0) + 1
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    return {bucket: value / norm for bucket, value in vector.items()} if norm else {}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(bucket, 0) for bucket, value in a.items())
+
+
+class SimilarityIndex:
+    """
+    Bounded, per-process LRU of prompt embeddings pointing at cached replies.
+    """
+
+    def __init__(self, threshold, max_entries):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # reply key -> (context hash, embedding)
+        self.lock = threading.Lock()
+
+    def add(self, key, context, vector):
+        with self.lock:
+            self.entries[key] = (context, vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def search(self, context, vector):
+        """
+        Return the key of the most similar prompt asked after the same turns, if
+        similar enough.
+        """
+        best_key, best_score = None, self.threshold
+        with self.lock:
+            for key, (entry_context, entry_vector) in self.entries.items():
+                if entry_context != context:
+                    continue
+                score = cosine(vector, entry_vector)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is not None:
+                self.entries.move_to_end(best_key)
+        return best_key
+
+
+class ResponseCache:
+    """
+    LLM replies in Redis, with a TTL per entry and LRU eviction through a sorted
+    set of access times.
+    """
+
+    def __init__(self, ttl=None, max_entries=None, similarity=None, local_entries=None):
+        self.ttl = ttl or settings.LLM_RESPONSE_CACHE_TTL
+        self.max_entries = max_entries or settings.LLM_RESPONSE_CACHE_MAX_ENTRIES
+        similarity = settings.LLM_RESPONSE_CACHE_SIMILARITY if similarity is None else similarity
+        local_entries = local_entries or settings.LLM_RESPONSE_CACHE_LOCAL_ENTRIES
+        self.index = SimilarityIndex(similarity, local_entries) if similarity else None
+        # Raw Redis keys, prefixed like the rest of CACHES["default"]
+        self.lru_key = cache.make_key("llm:response:lru")
+        self.hits_key = cache.make_key("llm:response:hits")
+        self.misses_key = cache.make_key("llm:response:misses")
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    def key(self, prompt, context):
+        digest = hashlib.sha256(f"{prompt}\0{context}".encode()).hexdigest()
+        return cache.make_key(f"llm:response:{digest}")
+
+    def get(self, prompt, history=()):
+        """
+        Return the cached reply to ``prompt`` asked after the turns of
+        ``history``, or None.
+        """
+        prompt, context = normalize_prompt(prompt), context_hash(history)
+        key = self.key(prompt, context)
+
+        try:
+            reply = self._get(key)
+            if reply is None and self.index is not None:
+                similar = self.index.search(context, embed(prompt))
+                if similar is not None and similar != key:
+                    reply = self._get(similar)
+                    if reply is None:
+                        self.index.discard(similar)
+
+            self.redis.incr(self.misses_key if reply is None else self.hits_key)
+        except RedisError as e:
+            # A miss, the reply is asked of the LLM
+            logger.warning("Error reading the response cache: %s", e)
+            return None
+        logger.debug("Response cache %s for %r", "miss" if reply is None else "hit", prompt[:64])
+        return reply
+
+    def _get(self, key):
+        pipeline = self.redis.pipeline()
+        pipeline.get(key)
+        pipeline.zadd(self.lru_key, {key: time.time()}, xx=True)
+        reply, _ = pipeline.execute()
+        if reply is None:
+            # Expired, drop it from the LRU set too
+            self.redis.zrem(self.lru_key, key)
+            return None
+        return reply.decode()
+
+    def set(self, prompt, history, reply):
+        prompt, context = normalize_prompt(prompt), context_hash(history)
+        key = self.key(prompt, context)
+
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.set(key, reply, ex=self.ttl)
+            pipeline.zadd(self.lru_key, {key: time.time()})
+            pipeline.zcard(self.lru_key)
+            *_, entries = pipeline.execute()
+
+            if entries > self.max_entries:
+                evicted = [member for member, _ in self.redis.zpopmin(self.lru_key, entries - self.max_entries)]
+                self.redis.delete(*evicted)
+        except RedisError as e:
+            logger.warning("Error caching a reply: %s", e)
+            return
+
+        if self.index is not None:
+            self.index.add(key, context, embed(prompt))
+
+
+@functools.cache
+def get_response_cache():
+    """
+    Return the process-wide response cache, or None unless
+    ``LLM_RESPONSE_CACHE`` is on.
+    """
+    return ResponseCache() if settings.LLM_RESPONSE_CACHE else None
@@ -0,0 +1,50 @@
+from collections import deque
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .context import truncate_text
+
+
+class Turn(NamedTuple):
+    role: str
+    content: str
+
+
+class ChatSession:
+    """
+    Conversation turns of a single chat socket.
+
+    Turns live in a ring buffer bounded both by count and by total
+    characters, so a long-lived socket can never hold more than
+    ``max_chars`` of history. The oldest turns are dropped first, and a
+    single oversized turn (a whole OCR'd document) is cut to its head and
+    tail on the way in, so it never takes more than half of the buffer.
+
+    """
+
+    __slots__ = ("turns", "max_chars", "chars")
+
+    def __init__(self, messages=(), max_turns=None, max_chars=None):
+        self.turns = deque(maxlen=max_turns or settings.LLM_SESSION_MAX_TURNS)
+        self.max_chars = max_chars or settings.LLM_SESSION_MAX_CHARS
+        self.chars = 0
+        for message in messages:
+            self.append(message["role"], message["content"])
+
+    def __len__(self):
+        return len(self.turns)
+
+    def append(self, role, content):
+        content = truncate_text(content, self.max_chars // 2)
+
+        if len(self.turns) == self.turns.maxlen:
+            self.chars -= len(self.turns[0].content)
+        self.turns.append(Turn(role, content))
+        self.chars += len(content)
+
+        while self.chars > self.max_chars:
+            self.chars -= len(self.turns.popleft().content)
+
+    def messages(self):
+        return [{"role": turn.role, "content": turn.content} for turn in self.turns]
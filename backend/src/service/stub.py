@@ -0,0 +1,53 @@
+import asyncio
+import zlib
+
+from django.conf import settings
+
+from .llm import Completion, LLMProvider
+
+VOCABULARY = (
+    "your wages tips and other compensation are reported in box 1 of the W2 while federal income tax withheld "
+    "is in box 2 social security and medicare wages follow in boxes 3 and 5 state amounts are further down"
+).split()
+
+
+class StubProvider(LLMProvider):
+    """
+    Local, deterministic stand-in for an LLM, for load tests.
+
+    Replies take ``latency`` seconds to the first token, then come at
+    ``tokens_per_second``, so the time spent in our own code can be told
+    apart from the modelled time of the model. The same prompt always gets
+    the same reply.
+
+    """
+
+    def __init__(self, model=None, latency=None, tokens_per_second=None, reply_tokens=None):
+        super().__init__(model)
+        self.latency = settings.LLM_STUB_LATENCY if latency is None else latency
+        self.tokens_per_second = tokens_per_second or settings.LLM_STUB_TOKENS_PER_SECOND
+        self.reply_tokens = reply_tokens or settings.LLM_STUB_REPLY_TOKENS
+
+    def expected_seconds(self, max_tokens):
+        """
+        Return the modelled duration of a full reply.
+        """
+        return self.latency + min(self.reply_tokens, max_tokens) / self.tokens_per_second
+
+    def tokens(self, messages, max_tokens):
+        seed = zlib.crc32(messages[-1]["content"].encode())
+        count = min(self.reply_tokens, max_tokens)
+        return [VOCABULARY[(seed + i) % len(VOCABULARY)] + " " for i in range(count)]
+
+    async def complete(self, messages, max_tokens):
+        tokens = self.tokens(messages, max_tokens)
+        await asyncio.sleep(self.latency + len(tokens) / self.tokens_per_second)
+        return Completion("".join(tokens))
+
+    async def stream(self, messages, max_tokens):
+        loop = asyncio.get_running_loop()
+        start = loop.time() + self.latency
+        for i, token in enumerate(self.tokens(messages, max_tokens), start=1):
+            # Sleep to a schedule so slow consumers do not stretch the modelled rate
+            await asyncio.sleep(max(start + i / self.tokens_per_second - loop.time(), 0))
+            yield token
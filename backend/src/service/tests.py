@@ -0,0 +1,269 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase, override_settings
+
+from .context import (
+    MESSAGE_OVERHEAD_TOKENS,
+    TRUNCATION_MARKER,
+    ContextWindow,
+    TokenEstimator,
+    truncate_text,
+)
+from .limiter import LLMLimiter, QueueFull
+from .session import ChatSession
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+NOW = 1_713_139_200_000  # ms
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    LLM_CONCURRENCY=1,
+    LLM_RATE_LIMIT_RPM=0,
+    LLM_QUEUE_MAX=5,
+    LLM_USER_QUEUE_MAX=3,
+    LLM_QUEUE_TIMEOUT=0.2,
+    LLM_QUEUE_HEARTBEAT=10,
+    LLM_QUEUE_POLL_INTERVAL=0.01,
+)
+class LimiterTestCase(SimpleTestCase):
+    """
+    Limiters on a fake Redis running the Lua scripts, at a clock moved by
+    ``self.now``.
+    """
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.now = NOW
+        for patcher in (
+            mock.patch(
+                "src.service.limiter.get_redis_connection",
+                lambda alias: fakeredis.FakeRedis(server=self.server),
+            ),
+            mock.patch(
+                "src.service.limiter.time",
+                SimpleNamespace(time=lambda: self.now / 1000, perf_counter=time.perf_counter),
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.limiter = LLMLimiter()
+
+    def queue(self):
+        return [ticket.decode() for ticket in self.limiter.redis.zrange(self.limiter.keys["queue"], 0, -1)]
+
+
+class LimiterScriptTests(LimiterTestCase):
+    def test_users_are_queued_fairly(self):
+        for ticket in ("1:a", "1:b", "1:c", "2:a"):
+            self.limiter.enqueue(ticket, ticket[0])
+
+        # The second user's first call goes right after the first user's first one
+        self.assertEqual(self.queue(), ["1:a", "2:a", "1:b", "1:c"])
+
+    def test_queue_and_user_bounds_are_enforced(self):
+        for ticket in ("1:a", "1:b", "1:c"):
+            self.assertGreaterEqual(self.limiter.enqueue(ticket, "1"), 0)
+        self.assertEqual(self.limiter.enqueue("1:d", "1"), -2)
+
+        self.limiter.enqueue("2:a", "2")
+        self.limiter.enqueue("3:a", "3")
+        self.assertEqual(self.limiter.enqueue("4:a", "4"), -1)
+
+    def test_slots_are_granted_in_queue_order(self):
+        self.limiter.enqueue("1:a", "1")
+        self.limiter.enqueue("2:a", "2")
+
+        self.assertEqual(self.limiter.acquire("2:a"), [0, 1, 0])
+        self.assertEqual(self.limiter.acquire("1:a"), [1, 0, 0])
+        # The only slot is held
+        self.assertEqual(self.limiter.acquire("2:a"), [0, 0, 0])
+
+        self.limiter.release("1:a")
+        self.assertEqual(self.limiter.acquire("2:a"), [1, 0, 0])
+        self.assertEqual(self.queue(), [])
+
+    def test_granted_calls_move_the_virtual_clock(self):
+        self.limiter.enqueue("1:a", "1")
+        self.limiter.acquire("1:a")
+        self.limiter.release("1:a")
+
+        # Queued after the call granted last, not back at its score
+        self.limiter.enqueue("1:b", "1")
+        self.limiter.enqueue("2:a", "2")
+        self.limiter.enqueue("1:c", "1")
+
+        self.assertEqual(self.queue(), ["1:b", "2:a", "1:c"])
+
+    def test_leaving_forgets_users_without_waiters(self):
+        self.limiter.enqueue("1:a", "1")
+        self.limiter.enqueue("1:b", "1")
+
+        self.limiter.leave("1:a")
+        self.assertEqual(self.limiter.redis.hget(self.limiter.keys["waiting"], "1"), b"1")
+        self.limiter.leave("1:b")
+
+        self.assertEqual(self.queue(), [])
+        self.assertFalse(self.limiter.redis.hexists(self.limiter.keys["waiting"], "1"))
+        self.assertFalse(self.limiter.redis.hexists(self.limiter.keys["user_last"], "1"))
+
+    def test_waiters_without_heartbeat_lose_their_place(self):
+        self.limiter.enqueue("1:a", "1")
+        self.limiter.enqueue("2:a", "2")
+
+        self.now += self.limiter.heartbeat_ms + 1
+        self.assertEqual(self.limiter.acquire("1:a")[1], -1)
+        self.assertEqual(self.queue(), [])
+
+    def test_expired_slots_are_freed(self):
+        self.limiter.enqueue("1:a", "1")
+        self.limiter.acquire("1:a")
+        self.limiter.enqueue("2:a", "2")
+
+        self.now += self.limiter.lease_ms + 1
+        self.limiter.redis.zadd(self.limiter.keys["heartbeats"], {"2:a": self.now + 1})
+
+        self.assertEqual(self.limiter.acquire("2:a"), [1, 0, 0])
+
+    def test_rate_limit_has_calls_retry_for_a_token(self):
+        with self.settings(LLM_CONCURRENCY=2, LLM_RATE_LIMIT_RPM=60, LLM_RATE_LIMIT_BURST=1):
+            limiter = LLMLimiter()
+        limiter.enqueue("1:a", "1")
+        limiter.enqueue("2:a", "2")
+
+        self.assertEqual(limiter.acquire("1:a"), [1, 0, 0])
+        self.assertEqual(limiter.acquire("2:a"), [0, 0, 1000])
+
+        self.now += 1000
+        self.assertEqual(limiter.acquire("2:a"), [1, 0, 0])
+
+
+class LimiterSlotTests(LimiterTestCase):
+    async def test_waiters_report_their_position_until_granted(self):
+        positions = []
+
+        async def on_wait(position):
+            positions.append(position)
+            if len(positions) == 1:
+                self.limiter.release("1:held")
+
+        self.limiter.enqueue("1:held", "1")
+        self.limiter.acquire("1:held")
+
+        with self.assertLogs("src.service.limiter", "INFO"):
+            async with self.limiter.slot("2", on_wait=on_wait):
+                self.assertEqual(self.limiter.stats()["in_flight"], 1)
+
+        self.assertEqual(positions, [1])
+        self.assertEqual(self.limiter.stats()["in_flight"], 0)
+        self.assertEqual(self.limiter.stats()["granted"], 1)
+
+    async def test_wait_times_out_and_leaves_the_queue(self):
+        self.limiter.enqueue("1:held", "1")
+        self.limiter.acquire("1:held")
+
+        with self.assertRaises(QueueFull):
+            async with self.limiter.slot("2"):
+                pass
+
+        self.assertEqual(self.queue(), [])
+        self.assertEqual(self.limiter.stats()["rejected"], 1)
+
+    async def test_calls_run_without_a_slot_while_redis_is_down(self):
+        self.server.connected = False
+
+        with self.assertLogs("src.service.limiter", "WARNING"):
+            async with self.limiter.slot("1") as wait_ms:
+                self.assertEqual(wait_ms, 0.0)
+
+
+class ContextWindowTests(SimpleTestCase):
+    def setUp(self):
+        # One character per token keeps budgets readable
+        self.estimator = TokenEstimator(chars_per_token=1)
+
+    def messages(self, *contents):
+        return [{"role": "system", "content": "s" * 10}] + [
+            {"role": "user", "content": content} for content in contents
+        ]
+
+    def test_everything_fitting_the_budget_is_sent(self):
+        messages = self.messages("a" * 10, "b" * 10)
+        window = ContextWindow(budget=100, document_tokens=50, estimator=self.estimator)
+
+        self.assertEqual(window.fit(messages), messages)
+
+    def test_oldest_messages_are_dropped_first(self):
+        messages = self.messages("a" * 20, "b" * 20, "c" * 20)
+        # The system prompt and two messages, with their overhead
+        window = ContextWindow(
+            budget=10 + 2 * 20 + 3 * MESSAGE_OVERHEAD_TOKENS, document_tokens=50, estimator=self.estimator
+        )
+
+        self.assertEqual(window.fit(messages), [messages[0], messages[2], messages[3]])
+
+    def test_documents_are_cut_to_their_head_and_tail(self):
+        document = "head" + "x" * 200 + "tail"
+        window = ContextWindow(budget=1000, document_tokens=60, estimator=self.estimator)
+
+        fitted = window.fit(self.messages(document, "question"))
+
+        self.assertEqual(
+            fitted[1]["content"], "head" + "x" * 36 + TRUNCATION_MARKER.format(omitted=148) + "x" * 16 + "tail"
+        )
+        self.assertEqual(fitted[2]["content"], "question")
+
+    def test_latest_message_is_always_sent(self):
+        messages = self.messages("a" * 10, "b" * 100)
+        window = ContextWindow(budget=40, document_tokens=500, estimator=self.estimator)
+
+        fitted = window.fit(messages)
+
+        # What is left after the system prompt and the overhead of both messages
+        self.assertEqual(fitted, [messages[0], {"role": "user", "content": truncate_text("b" * 100, 22)}])
+
+    def test_estimator_calibrates_towards_reported_usage(self):
+        estimator = TokenEstimator(chars_per_token=4, smoothing=0.5)
+        messages = [{"role": "user", "content": "1" * 200}]
+
+        estimator.calibrate(messages, prompt_tokens=100 + MESSAGE_OVERHEAD_TOKENS)
+
+        self.assertEqual(estimator.chars_per_token, 3)
+        self.assertEqual(estimator.count("1" * 30), 10)
+
+
+class ChatSessionTests(SimpleTestCase):
+    def test_oldest_turns_are_dropped_past_max_turns(self):
+        session = ChatSession(max_turns=2, max_chars=100)
+        for content in ("a", "b", "c"):
+            session.append("user", content)
+
+        self.assertEqual([message["content"] for message in session.messages()], ["b", "c"])
+        self.assertEqual(session.chars, 2)
+
+    def test_oldest_turns_are_dropped_past_max_chars(self):
+        session = ChatSession(max_turns=10, max_chars=10)
+        for content in ("a" * 4, "b" * 4, "c" * 4):
+            session.append("user", content)
+
+        self.assertEqual([message["content"] for message in session.messages()], ["b" * 4, "c" * 4])
+        self.assertEqual(session.chars, 8)
+
+    def test_oversized_turns_take_at_most_half_the_buffer(self):
+        session = ChatSession(max_turns=10, max_chars=100)
+        session.append("user", "a" * 10)
+
+        document = "head" + "x" * 1000 + "tail"
+        session.append("user", document)
+
+        self.assertEqual(len(session), 2)
+        self.assertEqual(session.messages()[1]["content"], truncate_text(document, 50))
+        self.assertEqual(session.chars, sum(len(message["content"]) for message in session.messages()))
+
+    def test_sessions_start_from_the_chat_history(self):
+        history = [{"role": "user", "content": "What is box 1?"}, {"role": "assistant", "content": "Wages."}]
+
+        self.assertEqual(ChatSession(history, max_turns=10, max_chars=100).messages(), history)
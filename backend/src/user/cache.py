@@ -0,0 +1,121 @@
+"""
+Caches of users looked up on hot paths.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+LLM_USERNAME = "llm"
+LLM_USER_TTL = 5 * 60  # Bounds staleness in other processes, signals only reach this one
+
+USER_TTL = 5 * 60  # In Redis, where the signals drop changed users for every process
+USER_LOCAL_TTL = 30  # In process memory, bounds staleness in other processes
+USER_LOCAL_MAX_ENTRIES = 10_000
+# All the sockets need, the password hash and personal details stay out of Redis
+USER_FIELDS = ("id", "username", "is_active", "is_staff")
+
+_llm_user = None
+_llm_user_expires = 0.0
+
+_users = OrderedDict()  # pk -> (expires, user)
+_users_lock = threading.Lock()
+
+
+def get_llm_user():
+    """
+    Return the user the assistant's messages are saved as.
+    """
+    global _llm_user, _llm_user_expires
+    if _llm_user is None or time.monotonic() > _llm_user_expires:
+        _llm_user = User.objects.get(username=LLM_USERNAME)
+        _llm_user_expires = time.monotonic() + LLM_USER_TTL
+    return _llm_user
+
+
+def invalidate_llm_user(user):
+    """
+    Drop the cached LLM user if ``user`` is, or was, the LLM user.
+    """
+    global _llm_user
+    # A rename away from LLM_USERNAME must invalidate too, hence the pk check
+    if user.username == LLM_USERNAME or (_llm_user is not None and _llm_user.pk == user.pk):
+        _llm_user = None
+
+
+def user_key(pk):
+    return f"user-fields:{pk}"
+
+
+def get_local_user(pk):
+    """
+    Return user ``pk`` if this process has it cached, without touching Redis or
+    the database.
+    """
+    with _users_lock:
+        entry = _users.get(pk)
+        if entry is None:
+            return None
+        if time.monotonic() > entry[0]:
+            del _users[pk]
+            return None
+        _users.move_to_end(pk)
+        return entry[1]
+
+
+def get_user(pk):
+    """
+    Return user ``pk`` from process memory, Redis or the database, in that
+    order.
+
+    The user is rebuilt from ``USER_FIELDS`` only and must not be saved, the
+    other fields hold their defaults.
+
+    Raises:
+        User.DoesNotExist: If there is no such user.
+
+    """
+    user = get_local_user(pk)
+    if user is not None:
+        return user
+
+    key = user_key(pk)
+    fields = None
+    try:
+        fields = cache.get(key)
+    except Exception as e:
+        logger.warning("Error reading user %s from the cache: %s", pk, e)
+    if fields is None:
+        fields = User.objects.values(*USER_FIELDS).get(pk=pk)
+        try:
+            cache.set(key, fields, timeout=USER_TTL)
+        except Exception as e:
+            logger.warning("Error caching user %s: %s", pk, e)
+    user = User(**fields)
+
+    with _users_lock:
+        _users[pk] = (time.monotonic() + USER_LOCAL_TTL, user)
+        _users.move_to_end(pk)
+        while len(_users) > USER_LOCAL_MAX_ENTRIES:
+            _users.popitem(last=False)
+    return user
+
+
+def invalidate_user(user):
+    """
+    Drop ``user`` from this process' cache and from Redis.
+    """
+    with _users_lock:
+        _users.pop(user.pk, None)
+    try:
+        cache.delete(user_key(user.pk))
+    except Exception as e:
+        # Other processes keep the old user until USER_TTL
+        logger.warning("Error dropping user %s from the cache: %s", user.pk, e)
@@ -0,0 +1,27 @@
+from django.core.cache import cache as default_cache
+from django.test import TestCase, override_settings
+
+from . import cache
+from .models import User
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class UserCacheTests(TestCase):
+    def setUp(self):
+        cache._users.clear()
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password="secret")
+
+    def test_caches_only_user_fields(self):
+        cache.get_user(self.user.pk)
+
+        self.assertEqual(set(default_cache.get(cache.user_key(self.user.pk))), set(cache.USER_FIELDS))
+
+    def test_rebuilds_user_from_cache(self):
+        cache.get_user(self.user.pk)
+        cache._users.clear()
+
+        with self.assertNumQueries(0):
+            user = cache.get_user(self.user.pk)
+
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, "alice", True))
+        self.assertEqual(user.password, "")
@@ -22,6 +22,20 @@ type Message = {
   isNew?: boolean;
 };
 
+const STREAMING_ID = "streaming";
+
+// Header of binary upload frames: the chunk offset as a big-endian uint64
+const UPLOAD_HEADER_BYTES = 8;
+
+type Upload = {
+  file: File;
+  id: string;
+  chunkSize: number;
+  window: number;
+  sent: number;
+  sending: Promise<void>;
+};
+
 function Chat() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [message, setMessage] = useState("");
@@ -29,6 +43,7 @@ function Chat() {
   const scrollRef = useRef<HTMLDivElement | null>(null);
   const { toast } = useToast();
   const ws = useRef<WebSocket | null>(null);
+  const upload = useRef<Upload | null>(null);
   const token = localStorage.getItem("accessToken");
 
   const urlParams = new URLSearchParams(window.location.search);
@@ -56,17 +71,89 @@ function Chat() {
 
     ws.current.onmessage = (event) => {
       const messageData = JSON.parse(event.data);
-      setMessages((prev) => [
-        ...prev,
-        {
-          id: messageData.uuid,
-          message: messageData.content,
-          file: messageData.file,
-          timestamp: messageData.timestamp,
-          isUser: false,
-          isNew: true,
-        },
-      ]);
+      if (messageData.type === "chat.message.delta") {
+        // Grow the in-flight reply until the saved message arrives
+        setMessages((prev) => {
+          const last = prev[prev.length - 1];
+          if (last && last.id === STREAMING_ID) {
+            return [
+              ...prev.slice(0, -1),
+              { ...last, message: last.message + messageData.delta },
+            ];
+          }
+          return [
+            ...prev,
+            { id: STREAMING_ID, message: messageData.delta, isUser: false },
+          ];
+        });
+        setLoading(false);
+        return;
+      }
+      if (messageData.type === "chat.message.extracted") {
+        // The file text is ready, the reply to it follows
+        return;
+      }
+      if (messageData.type === "upload.ready") {
+        const current = upload.current;
+        if (!current) return;
+        current.id = messageData.upload;
+        current.chunkSize = messageData.chunk_size;
+        current.window = messageData.window;
+        // Fill the window, every ack then lets one more chunk go
+        for (let i = 0; i < current.window; i++) {
+          sendNextChunk(current);
+        }
+        return;
+      }
+      if (messageData.type === "upload.ack") {
+        const current = upload.current;
+        if (!current || current.id !== messageData.upload) return;
+        if (messageData.offset === current.file.size) {
+          upload.current = null;
+          ws.current?.send(
+            JSON.stringify({ message: "", upload: current.id, stream: true })
+          );
+        } else {
+          sendNextChunk(current);
+        }
+        return;
+      }
+      if (messageData.type === "upload.error") {
+        upload.current = null;
+        toast({
+          title: "Upload failed",
+          description: messageData.detail,
+        });
+        setLoading(false);
+        return;
+      }
+      if (messageData.type === "chat.queue") {
+        // Still loading, the assistant is busy with other users
+        console.log("Queued for the assistant at position", messageData.position);
+        return;
+      }
+      if (messageData.type === "chat.busy") {
+        toast({
+          title: "The assistant is busy",
+          description: messageData.detail,
+        });
+        setLoading(false);
+        return;
+      }
+      setMessages((prev) => {
+        const streamed = prev.some((m) => m.id === STREAMING_ID);
+        return [
+          ...prev.filter((m) => m.id !== STREAMING_ID),
+          {
+            id: messageData.uuid,
+            message: messageData.content,
+            file: messageData.file,
+            timestamp: messageData.timestamp,
+            isUser: false,
+            isNew: !streamed,
+          },
+        ];
+      });
       setLoading(false);
     };
 
@@ -117,41 +204,52 @@ function Chat() {
     if (message.trim() !== "") {
       setMessages((prev) => [...prev, { id: idGen(), isUser: true, message }]);
       if (ws.current && ws.current.readyState === WebSocket.OPEN) {
-        ws.current.send(JSON.stringify({ message: message }));
+        ws.current.send(JSON.stringify({ message: message, stream: true }));
       }
       setMessage("");
     }
   }
 
+  function sendNextChunk(current: Upload) {
+    if (current.sent >= current.file.size) return;
+    const offset = current.sent;
+    const end = Math.min(offset + current.chunkSize, current.file.size);
+    current.sent = end;
+    // Chained, so frames leave in offset order however long each read takes
+    current.sending = current.sending.then(async () => {
+      // Only this chunk is read into memory, not the whole file
+      const chunk = await current.file.slice(offset, end).arrayBuffer();
+      const frame = new Uint8Array(UPLOAD_HEADER_BYTES + chunk.byteLength);
+      new DataView(frame.buffer).setBigUint64(0, BigInt(offset));
+      frame.set(new Uint8Array(chunk), UPLOAD_HEADER_BYTES);
+      ws.current?.send(frame);
+    });
+  }
+
   function handleFileUpload(file: File) {
+    if (!ws.current || ws.current.readyState !== WebSocket.OPEN) return;
     setLoading(true);
-    const reader = new FileReader();
-    reader.onloadend = () => {
-      const fileData = {
-        name: file.name,
-        mime: file.type,
-        data:
-          typeof reader.result === "string" ? reader.result.split(",")[1] : "", // Add null check before accessing result
-      };
-      console.log(fileData);
-      setMessages((prev) => [
-        ...prev,
-        {
-          id: idGen(),
-          isUser: true,
-          file: {
-            name: file.name,
-            type: file.type,
-            data: (reader.result as string)?.split(",")[1], // Extracting base64 data
-          },
-          message: "Uploaded a file",
-        },
-      ]);
-      if (ws.current && ws.current.readyState === WebSocket.OPEN) {
-        ws.current.send(JSON.stringify({ message: "", file: fileData }));
-      }
+    setMessages((prev) => [
+      ...prev,
+      {
+        id: idGen(),
+        isUser: true,
+        file: { name: file.name, type: file.type },
+        message: "Uploaded a file",
+      },
+    ]);
+    // Sent in binary chunks once the server is ready, see src/chat/uploads.py
+    upload.current = {
+      file,
+      id: "",
+      chunkSize: 0,
+      window: 0,
+      sent: 0,
+      sending: Promise.resolve(),
     };
-    reader.readAsDataURL(file);
+    ws.current.send(
+      JSON.stringify({ type: "upload.start", name: file.name, size: file.size })
+    );
   }
 
   function handleFileInputChange(e: React.ChangeEvent<HTMLInputElement>) {
@@ -45,6 +45,9 @@ type Chat = {
   id: number;
   name: string;
   uuid: string;
+  message_count: number;
+  last_message_at: string | null;
+  last_message_preview: string;
 };
 
 export default function Menu({ clear }: { clear: () => void }) {
@@ -190,8 +193,11 @@ export default function Menu({ clear }: { clear: () => void }) {
                 }}
                 passHref
               >
-                <div className="flex flex-row items-center gap-2 hover:bg-gray-800 dark:hover:text-inherit hover:text-white py-3 px-3 rounded-lg cursor-pointer">
-                  <span>{chat.name}</span>
+                <div className="flex flex-col gap-1 hover:bg-gray-800 dark:hover:text-inherit hover:text-white py-3 px-3 rounded-lg cursor-pointer">
+                  <span className="truncate">{chat.name}</span>
+                  <span className="truncate text-xs opacity-70">
+                    {chat.last_message_preview}
+                  </span>
                 </div>
               </Link>
             ))}
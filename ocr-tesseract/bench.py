@@ -0,0 +1,80 @@
+"""
+Measure OCR throughput (pages/sec) of the process pool against its size.
+
+Usage::
+
+    python bench.py                          # synthetic 24 page document
+    python bench.py w2_bundle.pdf --workers 1 2 4 8
+
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import resource
+import time
+
+from pdf2image import pdfinfo_from_bytes
+from PIL import Image, ImageDraw
+from services.ocr import OCREngine
+
+
+def synthetic_pdf(pages: int) -> bytes:
+    """
+    Build a scanned-looking PDF of ``pages`` identical letter pages full of
+    text.
+    """
+    image = Image.new("RGB", (1700, 2200), "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(60):
+        draw.text((100, 100 + line * 33), f"Line {line + 1}: Wages, tips, other compensation 12345.67", fill="black")
+
+    # Reusing one image keeps the benchmark's own memory out of the peak RSS figure
+    buffer = io.BytesIO()
+    image.save(buffer, format="PDF", save_all=True, append_images=[image] * (pages - 1))
+    return buffer.getvalue()
+
+
+async def run(pdf_data: bytes, workers: int) -> float:
+    engine = OCREngine(workers=workers)
+    engine.start()
+    try:
+        start = time.perf_counter()
+        await engine.ocr_pdf(pdf_data)
+        return time.perf_counter() - start
+    finally:
+        engine.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", help="PDF to OCR, a synthetic document is used when omitted.")
+    parser.add_argument("--pages", type=int, default=24, help="Pages of the synthetic document.")
+    parser.add_argument("--workers", type=int, nargs="+", help="Pool sizes to try, defaults to 1, 2, 4 ... CPUs.")
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as file:
+            pdf_data = file.read()
+    else:
+        pdf_data = synthetic_pdf(args.pages)
+
+    pages = pdfinfo_from_bytes(pdf_data)["Pages"]
+    cpus = os.cpu_count() or 1
+    workers = args.workers or sorted({1, *(2**i for i in range(1, cpus.bit_length()) if 2**i <= cpus), cpus})
+
+    print(f"{pages} pages, {cpus} CPUs")
+    baseline = None
+    for size in workers:
+        elapsed = asyncio.run(run(pdf_data, size))
+        baseline = baseline or elapsed
+        print(f"workers={size:<3} {elapsed:7.2f}s {pages / elapsed:7.2f} pages/s  speedup={baseline / elapsed:.2f}x")
+
+    # Pages are rendered to disk a window at a time, so this should not grow with --pages
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak RSS of the engine process: {peak_rss:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,14 @@ class Config(BaseSettings):
 
     APP_VERSION: str = "0.1.0"
 
+    # Number of OCR worker processes, defaults to the number of CPUs
+    OCR_WORKERS: int | None = None
+    # Pages rasterized per poppler call, bounds the pages held on disk at once
+    OCR_RASTER_WINDOW: int = 4
+    OCR_DPI: int = 200
+    # The backend's MEDIA_ROOT as mounted here, the filepath endpoints read files under it only
+    OCR_MEDIA_ROOT: Path | None = None
+
     @property
     def REDIS_URL(self) -> RedisDsn:
         return RedisDsn.build(
@@ -1,48 +1,34 @@
-import io
-import os
+import asyncio
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
 from hashlib import sha256
 
-import cv2
-import numpy as np
-import pytesseract
 from config import app_configs, settings
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, Query, UploadFile
 from fastapi.responses import JSONResponse
-from pdf2image import convert_from_bytes
-from PIL import Image
-from services.redis import get_key, set_key_async
+from services.media import MediaPathError, file_sha256, resolve_media_path
+from services.ocr import OCREngine, join_pages, parse_pages
+from services.redis import get_key_async, set_key_async
 from starlette.middleware.cors import CORSMiddleware
 
-app = FastAPI(**app_configs)
-
-
-async def process_image(image_data: bytes):
-    image = Image.open(io.BytesIO(image_data))
-    image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
-    gray = cv2.medianBlur(gray, 3)
-
-    text = pytesseract.image_to_string(Image.fromarray(gray))
+engine = OCREngine(
+    workers=settings.OCR_WORKERS,
+    window=settings.OCR_RASTER_WINDOW,
+    dpi=settings.OCR_DPI,
+)
 
-    return text
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    engine.start()
+    yield
+    engine.shutdown()
 
-async def ocr_pdf(pdf_data: bytes):
-    # Convert PDF to images
-    images = convert_from_bytes(pdf_data)
 
-    # Process each image using OCR
-    ocr_text = ""
-    for image in images:
-        image_data = np.array(image)
-        gray = cv2.cvtColor(image_data, cv2.COLOR_RGB2GRAY)
-        gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
-        gray = cv2.medianBlur(gray, 3)
-        text = pytesseract.image_to_string(Image.fromarray(gray))
-        ocr_text += text + "\n"
+app = FastAPI(**app_configs, lifespan=lifespan)
 
-    return ocr_text
+# Hash the backend stored a shared file under, see the filepath endpoints
+SHA256_QUERY = Query(None, pattern="^[0-9a-f]{64}$")
 
 
 app.add_middleware(
@@ -62,86 +48,124 @@ async def ping() -> dict[str, str]:
     }
 
 
-@app.post("/ocr/image/")
-async def upload_file(file: UploadFile = File(...)):
-    image_data = await file.read()
+async def cached_image_ocr(image_hash: str, ocr: Callable[[], Awaitable[str]]) -> JSONResponse:
+    text = await get_key_async(image_hash)
+    if not text:
+        text = await ocr()
+        await set_key_async(image_hash, text)
 
-    image_hash = sha256(image_data).hexdigest()
-    text = get_key(image_hash)
-    if text:
-        return JSONResponse(content={"text": text})
+    return JSONResponse(content={"text": text})
 
-    text = await process_image(image_data)
 
-    await set_key_async(image_hash, text)
+async def cached_pdf_ocr(
+    pdf_hash: str, page_list: list[int] | None, ocr: Callable[[list[int] | None], Awaitable[list[str]]]
+) -> JSONResponse:
+    if page_list:
+        cache_key = f"{pdf_hash}:pages={','.join(map(str, page_list))}"
+        cached_pages = await get_key_async(cache_key)
+        if not isinstance(cached_pages, dict):
+            texts = await ocr(page_list)
+            cached_pages = {str(page): text for page, text in zip(page_list, texts)}
+            await set_key_async(cache_key, cached_pages)
+        return JSONResponse(content={"text": join_pages(cached_pages.values()), "pages": cached_pages})
 
-    return JSONResponse(content={"text": text})
+    # Check if OCR text for this PDF is already cached
+    cached_text = await get_key_async(pdf_hash)
+    if cached_text:
+        return JSONResponse(content={"text": cached_text})
+
+    # Perform OCR on the PDF
+    ocr_text = join_pages(await ocr(None))
 
+    # Cache the OCR text
+    await set_key_async(pdf_hash, ocr_text)
 
-@app.post("/ocr/image/filepath")
-async def process_file_path(file_path: str):
-    if not os.path.isfile(file_path):
+    return JSONResponse(content={"text": ocr_text})
+
+
+async def shared_file_ocr(file_path: str, file_hash: str | None, cached_ocr, ocr) -> JSONResponse:
+    """
+    Run ``cached_ocr`` on a file of the shared media volume, resolved from the
+    media-relative ``file_path``.
+
+    The file is never read whole: it is hashed from a memory map, and handed
+    to the OCR workers by path. Results are cached under the hash of the file
+    as read here, ``file_hash`` (the one the backend stored it under) only
+    being checked against it, so a caller cannot get the text cached for
+    another file.
+
+    """
+    try:
+        path = resolve_media_path(file_path)
+    except MediaPathError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=403)
+    except FileNotFoundError:
         return JSONResponse(content={"error": "File not found."}, status_code=404)
 
-    with open(file_path, "rb") as file:
-        image_data = file.read()
+    path_hash = await asyncio.to_thread(file_sha256, path)
+    if file_hash is not None and file_hash != path_hash:
+        return JSONResponse(content={"error": f"{path.name} does not match its SHA-256."}, status_code=409)
 
-    image_hash = sha256(image_data).hexdigest()
-    text = get_key(image_hash)
-    if text:
-        return JSONResponse(content={"text": text})
+    return await cached_ocr(path_hash, lambda *args: ocr(str(path), *args))
 
-    text = await process_image(image_data)
 
-    await set_key_async(image_hash, text)
+@app.post("/ocr/image/")
+async def upload_file(file: UploadFile = File(...)):
+    image_data = await file.read()
 
-    return JSONResponse(content={"text": text})
+    image_hash = sha256(image_data).hexdigest()
+    return await cached_image_ocr(image_hash, lambda: engine.ocr_image(image_data))
+
+
+@app.post("/ocr/image/filepath")
+async def process_file_path(file_path: str, sha256: str | None = SHA256_QUERY):
+    """
+    OCR an image of the shared media volume, ``file_path`` being relative to
+    ``OCR_MEDIA_ROOT``.
+    """
+    return await shared_file_ocr(file_path, sha256, cached_image_ocr, engine.ocr_image_path)
 
 
 @app.post("/ocr/pdf/")
-async def ocr_pdf_endpoint(file: UploadFile = File(...)):
+async def ocr_pdf_endpoint(file: UploadFile = File(...), pages: str | None = None):
+    """
+    OCR an uploaded PDF.
+
+    ``pages`` optionally restricts OCR to a comma separated list of 1-based
+    page numbers, the response then also maps each of them to its text.
+
+    """
+    try:
+        page_list = parse_pages(pages) if pages else None
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid pages."}, status_code=422)
+
     # Read the PDF file from the request
     pdf_data = await file.read()
 
     # Generate a hash of the PDF content
     pdf_hash = sha256(pdf_data).hexdigest()
 
-    # Check if OCR text for this PDF is already cached
-    cached_text = get_key(pdf_hash)
-    if cached_text:
-        return JSONResponse(content={"text": cached_text})
-
-    # Perform OCR on the PDF
-    ocr_text = await ocr_pdf(pdf_data)
-
-    # Cache the OCR text
-    await set_key_async(pdf_hash, ocr_text)
-
-    return JSONResponse(content={"text": ocr_text})
+    return await cached_pdf_ocr(pdf_hash, page_list, lambda pages: engine.ocr_pdf(pdf_data, pages))
 
 
 @app.post("/ocr/pdf/filepath")
-async def ocr_pdf_filepath(pdf_path: str):
-    # Check if the file exists
-    if not os.path.isfile(pdf_path):
-        return JSONResponse(content={"error": "File not found."}, status_code=404)
-
-    # Read the PDF file
-    with open(pdf_path, "rb") as file:
-        pdf_data = file.read()
-
-    # Generate a hash of the PDF file path
-    pdf_hash = sha256(pdf_data).hexdigest()
+async def ocr_pdf_filepath(pdf_path: str, sha256: str | None = SHA256_QUERY, pages: str | None = None):
+    """
+    OCR a PDF of the shared media volume, ``pdf_path`` being relative to
+    ``OCR_MEDIA_ROOT``.
 
-    # Check if OCR text for this PDF is already cached
-    cached_text = get_key(pdf_hash)
-    if cached_text:
-        return JSONResponse(content={"text": cached_text})
+    Answers like ``/ocr/pdf/``, sharing its cache, without the PDF being
+    uploaded. ``sha256`` is the hash the backend stored the file under, a
+    file that does not match it is refused with a 409.
 
-    # Perform OCR on the PDF
-    ocr_text = await ocr_pdf(pdf_data)
+    """
+    try:
+        page_list = parse_pages(pages) if pages else None
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid pages."}, status_code=422)
 
-    # Cache the OCR text
-    await set_key_async(pdf_hash, ocr_text)
+    async def cached_ocr(pdf_hash, ocr):
+        return await cached_pdf_ocr(pdf_hash, page_list, ocr)
 
-    return JSONResponse(content={"text": ocr_text})
+    return await shared_file_ocr(pdf_path, sha256, cached_ocr, engine.ocr_pdf_path)
@@ -0,0 +1,59 @@
+"""
+Files shared with the backend on the media volume.
+
+The backend refers to a stored file by its path relative to its
+``MEDIA_ROOT`` instead of uploading it. Paths are resolved inside
+``OCR_MEDIA_ROOT`` only, symlinks included, so a request cannot make the
+service read anything else on its filesystem.
+
+"""
+
+import mmap
+import os
+from hashlib import sha256
+from pathlib import Path
+
+from config import settings
+
+
+class MediaPathError(ValueError):
+    """
+    A path that is not a file inside ``OCR_MEDIA_ROOT``.
+    """
+
+
+def resolve_media_path(name: str) -> Path:
+    """
+    Return the real path of the media-relative ``name``.
+
+    Raises:
+        MediaPathError: If shared media is not configured, or ``name`` is
+            absolute or leaves ``OCR_MEDIA_ROOT``.
+        FileNotFoundError: If there is no file at ``name``.
+
+    """
+    if settings.OCR_MEDIA_ROOT is None:
+        raise MediaPathError("Shared media is not configured.")
+    if not name or "\0" in name or os.path.isabs(name):
+        raise MediaPathError("Expected a path relative to the media root.")
+
+    root = settings.OCR_MEDIA_ROOT.resolve()
+    path = (root / name).resolve()
+    if not path.is_relative_to(root):
+        raise MediaPathError("Path outside of the media root.")
+    if not path.is_file():
+        raise FileNotFoundError(name)
+    return path
+
+
+def file_sha256(path: Path) -> str:
+    """
+    Return the SHA-256 of the file at ``path``, hashed from a memory map rather
+    than read into memory.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            return sha256().hexdigest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return sha256(mapped).hexdigest()
@@ -0,0 +1,175 @@
+import asyncio
+import io
+import os
+import tempfile
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pytesseract
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
+
+
+def ocr_page(image: Image.Image) -> str:
+    """
+    Binarize and denoise a single page image, then run Tesseract on it.
+
+    Runs inside a pool worker process, so it must stay a module-level function.
+
+    """
+    gray = np.array(image.convert("L"))
+    gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    gray = cv2.medianBlur(gray, 3)
+
+    return pytesseract.image_to_string(Image.fromarray(gray))
+
+
+def ocr_image_bytes(image_data: bytes) -> str:
+    return ocr_page(Image.open(io.BytesIO(image_data)))
+
+
+def ocr_page_file(path: str) -> str:
+    with Image.open(path) as image:
+        return ocr_page(image)
+
+
+def parse_pages(spec: str) -> list[int]:
+    """
+    Parse a ``"1,3,5"`` page list (1-based) into sorted unique page numbers.
+    """
+    pages = sorted({int(page) for page in spec.split(",") if page.strip()})
+    if not pages or pages[0] < 1:
+        raise ValueError("Pages must be positive integers.")
+    return pages
+
+
+def page_runs(pages: list[int], window: int) -> Iterator[tuple[int, int]]:
+    """
+    Group sorted page numbers into ``(first, last)`` runs of at most ``window``
+    consecutive pages.
+    """
+    first = last = pages[0]
+    for page in pages[1:]:
+        if page == last + 1 and page - first < window:
+            last = page
+            continue
+        yield first, last
+        first = last = page
+    yield first, last
+
+
+def iter_page_files(
+    pdf_path: str, output_folder: str, *, window: int, dpi: int, pages: list[int] | None = None
+) -> Iterator[str]:
+    """
+    Rasterize ``pdf_path`` ``window`` pages at a time into ``output_folder``.
+
+    Yields the path of each rendered page in page order, restricted to
+    ``pages`` when given. Only one window is rendered ahead of the consumer,
+    so disk and memory use do not grow with the page count.
+
+    """
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    pages = [page for page in pages if page <= page_count] if pages else list(range(1, page_count + 1))
+    if not pages:
+        return
+
+    for first_page, last_page in page_runs(pages, window):
+        yield from convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            output_folder=output_folder,
+            first_page=first_page,
+            last_page=last_page,
+            grayscale=True,
+            paths_only=True,
+        )
+
+
+class OCREngine:
+    """
+    Process pool that OCRs PDF pages in parallel.
+
+    Tesseract and OpenCV are CPU bound, so pages are fanned out across processes
+    and the event loop only awaits their results. Pages are rendered to a
+    temporary directory a window at a time and handed to the workers by path, so
+    the server never holds a whole document as images.
+
+    """
+
+    def __init__(self, workers: int | None = None, *, window: int = 4, dpi: int = 200):
+        self.workers = workers
+        self.window = window
+        self.dpi = dpi
+        self._pool: ProcessPoolExecutor | None = None
+
+    def start(self) -> None:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    @property
+    def max_in_flight(self) -> int:
+        # Enough queued pages to keep every worker busy while the next window renders
+        return 2 * (self.workers or os.cpu_count() or 1)
+
+    def _submit(self, fn, *args) -> asyncio.Future:
+        self.start()
+        return asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def ocr_image(self, image_data: bytes) -> str:
+        return await self._submit(ocr_image_bytes, image_data)
+
+    async def ocr_image_path(self, image_path: str) -> str:
+        # The worker opens the file itself, its bytes never go through the pool's pipe
+        return await self._submit(ocr_page_file, image_path)
+
+    async def ocr_pdf(self, pdf_data: bytes, pages: list[int] | None = None) -> list[str]:
+        """
+        OCR a PDF given as bytes, see ``ocr_pdf_path``.
+        """
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as file:
+            file.write(pdf_data)
+            file.flush()
+            return await self.ocr_pdf_path(file.name, pages)
+
+    async def ocr_pdf_path(self, pdf_path: str, pages: list[int] | None = None) -> list[str]:
+        """
+        Return the OCR text of each page of ``pdf_path`` (or of ``pages`` only),
+        in page order.
+        """
+        texts = []
+        in_flight: deque[tuple[str, asyncio.Future]] = deque()
+
+        async def collect_oldest():
+            path, future = in_flight.popleft()
+            try:
+                texts.append(await future)
+            finally:
+                os.remove(path)
+
+        with tempfile.TemporaryDirectory() as output_folder:
+            page_files = iter_page_files(pdf_path, output_folder, window=self.window, dpi=self.dpi, pages=pages)
+
+            # Rasterization shells out to poppler, keep it off the event loop too
+            while (path := await asyncio.to_thread(next, page_files, None)) is not None:
+                in_flight.append((path, self._submit(ocr_page_file, path)))
+                if len(in_flight) >= self.max_in_flight:
+                    await collect_oldest()
+
+            # Collecting oldest first keeps the text in page order
+            while in_flight:
+                await collect_oldest()
+
+        return texts
+
+
+def join_pages(texts: list[str]) -> str:
+    return "".join(text + "\n" for text in texts)
@@ -0,0 +1,165 @@
+import os
+import tempfile
+from hashlib import sha256
+from pathlib import Path
+from unittest import TestCase, mock
+
+from config import settings
+from fastapi.testclient import TestClient
+from main import app, engine
+from services.media import MediaPathError, file_sha256, resolve_media_path
+
+
+class MediaTestCase(TestCase):
+    """
+    Shared media rooted in a temporary directory, next to a file outside it.
+    """
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.media_root = Path(temp_dir.name, "media")
+        self.media_root.mkdir()
+        (self.media_root / "chats").mkdir()
+        self.secret = Path(temp_dir.name, "secret.txt")
+        self.secret.write_bytes(b"secret")
+
+        patcher = mock.patch.object(settings, "OCR_MEDIA_ROOT", self.media_root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def media_file(self, name, content=b"%PDF-1.4"):
+        path = self.media_root / name
+        path.write_bytes(content)
+        return path
+
+
+class ResolveMediaPathTests(MediaTestCase):
+    def test_resolves_files_under_the_media_root(self):
+        path = self.media_file("chats/return.pdf")
+
+        self.assertEqual(resolve_media_path("chats/return.pdf"), path.resolve())
+        self.assertEqual(resolve_media_path("chats/../chats/return.pdf"), path.resolve())
+
+    def test_refuses_traversal_out_of_the_media_root(self):
+        for name in ("../secret.txt", "chats/../../secret.txt", "chats/../../media/../secret.txt"):
+            with self.subTest(name=name), self.assertRaises(MediaPathError):
+                resolve_media_path(name)
+
+    def test_refuses_absolute_paths(self):
+        for name in (str(self.secret), str(self.media_file("chats/return.pdf"))):
+            with self.subTest(name=name), self.assertRaises(MediaPathError):
+                resolve_media_path(name)
+
+    def test_refuses_symlinks_leaving_the_media_root(self):
+        os.symlink(self.secret, self.media_root / "chats" / "link.pdf")
+        os.symlink(self.secret.parent, self.media_root / "outside")
+
+        for name in ("chats/link.pdf", "outside/secret.txt"):
+            with self.subTest(name=name), self.assertRaises(MediaPathError):
+                resolve_media_path(name)
+
+    def test_follows_symlinks_within_the_media_root(self):
+        path = self.media_file("chats/return.pdf")
+        os.symlink(path, self.media_root / "link.pdf")
+
+        self.assertEqual(resolve_media_path("link.pdf"), path.resolve())
+
+    def test_refuses_empty_and_nul_paths(self):
+        for name in ("", "chats/return.pdf\0.png"):
+            with self.subTest(name=name), self.assertRaises(MediaPathError):
+                resolve_media_path(name)
+
+    def test_refuses_directories_and_missing_files(self):
+        for name in ("chats", ".", "chats/missing.pdf"):
+            with self.subTest(name=name), self.assertRaises(FileNotFoundError):
+                resolve_media_path(name)
+
+    def test_refuses_everything_without_a_media_root(self):
+        self.media_file("chats/return.pdf")
+
+        with mock.patch.object(settings, "OCR_MEDIA_ROOT", None), self.assertRaises(MediaPathError):
+            resolve_media_path("chats/return.pdf")
+
+    def test_hashes_files_empty_or_not(self):
+        self.assertEqual(file_sha256(self.media_file("empty.pdf", b"")), sha256(b"").hexdigest())
+        self.assertEqual(file_sha256(self.media_file("return.pdf", b"1040")), sha256(b"1040").hexdigest())
+
+
+class FilepathEndpointTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = {}
+        self.ocr_pdf_path = mock.AsyncMock(side_effect=lambda path, pages: [f"text of {Path(path).name}"])
+        self.ocr_image_path = mock.AsyncMock(side_effect=lambda path: f"text of {Path(path).name}")
+
+        async def get_key(key):
+            return self.cache.get(key)
+
+        async def set_key(key, value):
+            self.cache[key] = value
+
+        for patcher in (
+            mock.patch("main.get_key_async", get_key),
+            mock.patch("main.set_key_async", set_key),
+            mock.patch.object(engine, "ocr_pdf_path", self.ocr_pdf_path),
+            mock.patch.object(engine, "ocr_image_path", self.ocr_image_path),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = TestClient(app)
+
+    def test_ocrs_a_file_of_the_media_root(self):
+        path = self.media_file("chats/return.pdf", b"1040")
+
+        response = self.client.post("/ocr/pdf/filepath", params={"pdf_path": "chats/return.pdf"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["text"].strip(), "text of return.pdf")
+        self.ocr_pdf_path.assert_awaited_once_with(str(path.resolve()), None)
+        self.assertIn(sha256(b"1040").hexdigest(), self.cache)
+
+    def test_refuses_paths_outside_the_media_root(self):
+        os.symlink(self.secret, self.media_root / "link.png")
+
+        for file_path in ("../secret.txt", str(self.secret), "link.png"):
+            with self.subTest(file_path=file_path):
+                response = self.client.post("/ocr/image/filepath", params={"file_path": file_path})
+
+                self.assertEqual(response.status_code, 403)
+        self.ocr_image_path.assert_not_awaited()
+
+    def test_answers_404_for_missing_files(self):
+        response = self.client.post("/ocr/image/filepath", params={"file_path": "chats/missing.png"})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_refuses_a_file_not_matching_its_sha256(self):
+        self.media_file("chats/return.pdf", b"1040")
+
+        response = self.client.post(
+            "/ocr/pdf/filepath", params={"pdf_path": "chats/return.pdf", "sha256": sha256(b"W-2").hexdigest()}
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.ocr_pdf_path.assert_not_awaited()
+
+    def test_does_not_answer_the_text_cached_for_the_sha256_of_another_file(self):
+        other_hash = sha256(b"W-2").hexdigest()
+        self.cache[other_hash] = "text of the W-2"
+        self.media_file("chats/return.pdf", b"1040")
+
+        response = self.client.post("/ocr/pdf/filepath", params={"pdf_path": "chats/return.pdf", "sha256": other_hash})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn("W-2", response.text)
+
+    def test_answers_a_cached_result_for_a_matching_sha256(self):
+        file_hash = sha256(b"1040").hexdigest()
+        self.cache[file_hash] = "cached text"
+        self.media_file("chats/return.pdf", b"1040")
+
+        response = self.client.post("/ocr/pdf/filepath", params={"pdf_path": "chats/return.pdf", "sha256": file_hash})
+
+        self.assertEqual(response.json(), {"text": "cached text"})
+        self.ocr_pdf_path.assert_not_awaited()